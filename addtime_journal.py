@@ -0,0 +1,188 @@
+import logging
+import time
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS addtime_journal (
+    operation_id TEXT NOT NULL,
+    account TEXT NOT NULL,
+    hours INTEGER NOT NULL,
+    admin_id INTEGER,
+    status TEXT NOT NULL,
+    message TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (operation_id, account)
+);
+CREATE INDEX IF NOT EXISTS idx_addtime_journal_status ON addtime_journal (status, updated_at);
+CREATE INDEX IF NOT EXISTS idx_addtime_journal_account ON addtime_journal (account, updated_at);
+"""
+
+# Trạng thái của một dòng journal:
+# pending   - đã ghi nhận, chưa gửi request
+# in_flight - đã bắt đầu gửi request, chưa có kết quả
+# done / failed - đã có kết quả
+# unknown   - bot tắt khi đang gửi hoặc request bị timeout / mất kết nối,
+#             không biết upstream đã cộng giờ hay chưa
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+log = logging.getLogger("bot.addtime")
+
+
+class AddTimeJournal:
+    """
+    Journal ghi trước (write-ahead) cho /addtime, khoá theo (operation_id, account).
+    - Dòng được đánh dấu in_flight và ghi xuống đĩa trước khi gửi request,
+      nên sau khi bot tắt đột ngột biết chính xác tài khoản nào chưa gửi
+    - Tài khoản vừa được thêm cùng số giờ trong dedup_window giây bị bỏ qua
+      (admin bấm lại sau khi timeout)
+    - Các tài khoản trong một thao tác vẫn chạy đồng thời qua BatchExecutor
+    - Nhiều process dùng chung database: mỗi dòng được giành (pending -> in_flight)
+      bằng một UPDATE có điều kiện nên chỉ một process gửi request; khi khởi động
+      chỉ khôi phục dòng của chính process (owner) hoặc dòng đã quá recover_after giây
+    """
+
+    def __init__(self, store, *, dedup_window: float = 600, owner: str = "", recover_after: float = 3600):
+        self.store = store
+        self.dedup_window = dedup_window
+        self.owner = owner
+        self.recover_after = recover_after
+        store.add_schema(JOURNAL_SCHEMA)
+        store.add_column("addtime_journal", "owner", "TEXT NOT NULL DEFAULT ''")
+
+    async def recent(self, accounts, hours: int, *, exclude_operation=None) -> dict:
+        """
+        Các tài khoản đã được thêm cùng số giờ trong dedup_window: {account: status}.
+        exclude_operation: bỏ qua các dòng của chính thao tác đang chạy.
+        """
+        accounts = list(accounts)
+        if not accounts:
+            return {}
+        placeholders = ",".join("?" * len(accounts))
+        rows = await self.store.fetchall(
+            f"SELECT account, status FROM addtime_journal WHERE account IN ({placeholders}) "
+            "AND hours = ? AND status IN (?, ?, ?) AND updated_at >= ? AND operation_id != ?",
+            (*accounts, hours, DONE, IN_FLIGHT, UNKNOWN, time.time() - self.dedup_window,
+             "" if exclude_operation is None else str(exclude_operation)),
+        )
+        return {row["account"]: row["status"] for row in rows}
+
+    async def begin(self, operation_id, admin_id, accounts, hours: int):
+        """
+        Ghi nhận thao tác (chờ ghi xong mới trả về). Dòng đã có giữ nguyên trạng thái.
+        Trả về các tài khoản mới được ghi (tài khoản đã có trong thao tác bị bỏ).
+        """
+        now = time.time()
+        rows = [(str(operation_id), account, hours, admin_id, PENDING, self.owner, now, now) for account in accounts]
+
+        def write(conn):
+            inserted = []
+            with conn:
+                for row in rows:
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO addtime_journal "
+                        "(operation_id, account, hours, admin_id, status, owner, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        row,
+                    )
+                    if cursor.rowcount:
+                        inserted.append(row[1])
+            return inserted
+
+        await self.store.flush()
+        return await self.store.run(write)
+
+    async def _claim(self, operation_id: str, account: str) -> bool:
+        """
+        Chuyển dòng pending sang in_flight, trả về False nếu process khác đã giành dòng này
+        """
+        def write(conn):
+            with conn:
+                return conn.execute(
+                    "UPDATE addtime_journal SET status = ?, owner = ?, updated_at = ? "
+                    "WHERE operation_id = ? AND account = ? AND status = ?",
+                    (IN_FLIGHT, self.owner, time.time(), operation_id, account, PENDING),
+                ).rowcount == 1
+
+        return await self.store.run(write)
+
+    async def run(self, operation_id, add_time, executor) -> dict:
+        """
+        Chạy các dòng còn pending của thao tác, trả về {account: (account, thành công, message)}.
+        Dòng do process khác giành trước không được chạy và không có trong kết quả.
+        add_time(account, hours) là KeyAPIClient.add_time; thành công là None khi
+        không rõ kết quả, dòng đó được ghi unknown để không bị thêm lại trong dedup_window.
+        """
+        operation_id = str(operation_id)
+        rows = await self.store.fetchall(
+            "SELECT account, hours FROM addtime_journal WHERE operation_id = ? AND status = ?",
+            (operation_id, PENDING),
+        )
+
+        async def apply(row):
+            account = row["account"]
+            if not await self._claim(operation_id, account):
+                return None
+            try:
+                result = await add_time(account, row["hours"])
+            except Exception as e:
+                result = (account, None, f"Không rõ kết quả: {str(e) or type(e).__name__}")
+            if result[1] is None:
+                status = UNKNOWN
+            else:
+                status = DONE if result[1] else FAILED
+            # Kết quả ghi theo lô; nếu bot tắt trước khi ghi, dòng còn in_flight và bị coi là unknown
+            self.store.enqueue(
+                "UPDATE addtime_journal SET status = ?, message = ?, updated_at = ? "
+                "WHERE operation_id = ? AND account = ?",
+                (status, result[2], time.time(), operation_id, account),
+            )
+            return result
+
+        results = await executor.map(apply, rows)
+        output = {}
+        for row, result in zip(rows, results):
+            if result is None:
+                continue
+            if isinstance(result, Exception):
+                result = (row["account"], False, str(result))
+            output[row["account"]] = result
+        return output
+
+    async def recover(self):
+        """
+        Gọi khi khởi động: dòng in_flight của lần chạy trước chuyển thành unknown
+        (không gửi lại vì có thể đã được cộng giờ). Trả về (id các thao tác còn
+        dòng pending, danh sách dòng unknown mới).
+        Chỉ xét dòng của process này hoặc dòng không đổi trong recover_after giây,
+        dòng process khác đang chạy được để nguyên.
+        """
+        now = time.time()
+        cutoff = now - self.recover_after
+
+        def update(conn):
+            with conn:
+                unknown = conn.execute(
+                    "UPDATE addtime_journal SET status = ?, updated_at = ? "
+                    "WHERE status = ? AND (owner = ? OR updated_at < ?) "
+                    "RETURNING operation_id, account, hours, admin_id",
+                    (UNKNOWN, now, IN_FLIGHT, self.owner, cutoff),
+                ).fetchall()
+                pending = conn.execute(
+                    "SELECT DISTINCT operation_id FROM addtime_journal "
+                    "WHERE status = ? AND (owner = ? OR updated_at < ?)",
+                    (PENDING, self.owner, cutoff),
+                ).fetchall()
+            return [row[0] for row in pending], [dict(row) for row in unknown]
+
+        await self.store.flush()
+        pending, unknown = await self.store.run(update)
+        if pending or unknown:
+            log.warning(
+                "Khôi phục journal /addtime",
+                extra={"pending_operations": len(pending), "unknown": len(unknown)},
+            )
+        return pending, unknown
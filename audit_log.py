@@ -0,0 +1,111 @@
+import asyncio
+import contextlib
+import logging
+
+import discord
+
+from report import MAX_EMBEDS_PER_MESSAGE, pack_embeds
+
+log = logging.getLogger("bot.audit")
+
+
+class AuditLogWriter:
+    """
+    Ghi log vào LOG_CHANNEL_ID ở nền.
+    Lệnh chỉ đưa embed vào hàng đợi; worker gom các embed trong flush_interval
+    giây thành một tin nhắn (tối đa 10 embed / 6000 ký tự) để giảm số lần gửi.
+    Hàng đợi có giới hạn: khi đầy, log() sẽ chờ (backpressure).
+    """
+
+    def __init__(self, client: discord.Client, channel_id: int, *, flush_interval: float = 2.0, max_queue: int = 1000):
+        self.client = client
+        self.channel_id = channel_id
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._worker = None
+        self._batch = []
+        self._sending = None
+        self.sent_messages = 0
+        self.sent_embeds = 0
+        self.failed_embeds = 0
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def log(self, embed: discord.Embed):
+        """
+        Đưa một embed vào hàng đợi log
+        """
+        await self._queue.put(embed)
+
+    def pending(self) -> int:
+        return self._queue.qsize() + len(self._batch)
+
+    async def _get_channel(self):
+        channel = self.client.get_channel(self.channel_id)
+        if channel is None:
+            try:
+                channel = await self.client.fetch_channel(self.channel_id)
+            except discord.HTTPException:
+                channel = None
+        return channel
+
+    async def _send(self, embeds):
+        channel = await self._get_channel()
+        if channel is None:
+            log.error("Không tìm thấy channel log", extra={"channel_id": self.channel_id, "dropped": len(embeds)})
+            self.failed_embeds += len(embeds)
+            return
+        for group in pack_embeds(embeds):
+            try:
+                await channel.send(embeds=group)
+                self.sent_messages += 1
+                self.sent_embeds += len(group)
+            except Exception as e:
+                # Lỗi bất kỳ (HTTP, mất kết nối, embed sai...) chỉ bỏ lô này, worker vẫn chạy tiếp
+                log.exception("Error sending log: %s", e, extra={"dropped": len(group)})
+                self.failed_embeds += len(group)
+
+    async def _run(self):
+        while True:
+            self._batch = [await self._queue.get()]
+            # Chưa đủ một tin nhắn thì chờ flush_interval để gom thêm embed
+            if self._queue.qsize() < MAX_EMBEDS_PER_MESSAGE - 1:
+                await asyncio.sleep(self.flush_interval)
+            while len(self._batch) < MAX_EMBEDS_PER_MESSAGE and not self._queue.empty():
+                self._batch.append(self._queue.get_nowait())
+            self._sending = asyncio.ensure_future(self._send(self._batch))
+            try:
+                await asyncio.shield(self._sending)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Lỗi ngoài dự kiến (vd. không lấy được channel) chỉ làm mất lô này
+                log.exception("Error sending log batch: %s", e, extra={"dropped": len(self._batch)})
+                self.failed_embeds += len(self._batch)
+            self._batch = []
+            self._sending = None
+
+    async def close(self):
+        """
+        Dừng worker và gửi nốt toàn bộ log còn trong hàng đợi
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+        if self._sending is not None:
+            # Lô đang gửi dở thì chờ gửi xong, không gửi lại
+            with contextlib.suppress(Exception):
+                await self._sending
+            self._batch = []
+            self._sending = None
+
+        remaining = self._batch
+        self._batch = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining:
+            await self._send(remaining)
@@ -0,0 +1,361 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import itertools
+import time
+from urllib.parse import urlsplit
+
+# Luồng (flow) của công việc đang chạy: (tên, trọng số). Lệnh đặt giá trị này
+# (vd. ("user:123", 1)), các task con tự thừa hưởng qua context của asyncio.
+request_flow = contextvars.ContextVar("request_flow", default=("background", 1))
+
+
+class TokenBucket:
+    """
+    Token bucket giới hạn số request mỗi giây (rate) với burst tối đa capacity.
+    rate <= 0 nghĩa là không giới hạn.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        # Lock để các lượt chờ được phục vụ theo thứ tự đến
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """
+    Mỗi upstream host có một token bucket riêng
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.capacity)
+        return bucket
+
+    async def acquire(self, url: str):
+        await self.bucket(url).acquire()
+
+
+class SharedRateLimiter:
+    """
+    Token bucket theo host lưu trong state backend dùng chung (state.py), để
+    nhiều shard / process cùng chia một quota thay vì mỗi process một quota
+    """
+
+    def __init__(self, backend, rate: float, capacity: float = None):
+        self.backend = backend
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+
+    async def acquire(self, url: str):
+        if self.rate <= 0:
+            return
+        name = f"ratelimit:{urlsplit(url).netloc}"
+        while True:
+            wait = await self.backend.take_token(name, self.rate, self.capacity)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class _Flow:
+    __slots__ = ("weight", "waiters", "credit")
+
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.waiters = collections.deque()
+        self.credit = weight
+
+
+class FairScheduler:
+    """
+    Chia `concurrency` slot gọi upstream giữa các luồng theo weighted round robin.
+    Khi hết slot, mỗi lượt một luồng được cấp tối đa `weight` slot rồi nhường
+    luồng kế tiếp, nên một user gửi lô lớn không chặn được user khác và luồng
+    trọng số cao (vd. admin /addtime) được phục vụ nhiều hơn.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.active = 0
+        # Thứ tự trong dict là thứ tự round robin, luồng đầu tiên đang tới lượt
+        self._flows = collections.OrderedDict()
+
+    def waiting(self) -> int:
+        return sum(len(flow.waiters) for flow in self._flows.values())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, name: str = None, weight: int = None):
+        if name is None or weight is None:
+            default_name, default_weight = request_flow.get()
+            name = name or default_name
+            weight = weight or default_weight
+        if self.active < self.concurrency and not self._flows:
+            self.active += 1
+        else:
+            flow = self._flows.get(name)
+            if flow is None:
+                flow = self._flows[name] = _Flow(max(1, int(weight)))
+            waiter = asyncio.get_running_loop().create_future()
+            flow.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Đã được cấp slot ngay lúc bị huỷ thì nhường lại
+                    self._release()
+                else:
+                    if waiter in flow.waiters:
+                        flow.waiters.remove(waiter)
+                    if not flow.waiters and self._flows.get(name) is flow:
+                        del self._flows[name]
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._flows:
+            name, flow = next(iter(self._flows.items()))
+            waiter = flow.waiters.popleft()
+            flow.credit -= 1
+            if not flow.waiters:
+                del self._flows[name]
+            elif flow.credit <= 0:
+                flow.credit = flow.weight
+                self._flows.move_to_end(name)
+            if not waiter.done():
+                # Chuyển thẳng slot cho lượt kế tiếp, active giữ nguyên
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class CommandRateLimiter:
+    """
+    Token bucket theo user và theo guild cho slash command, lưu trong state
+    backend (dùng chung giữa các shard nếu backend là sqlite).
+    Mỗi lệnh tốn `cost` token (vd. số key cần kiểm tra).
+    """
+
+    def __init__(self, backend, *, user_rate: float, user_burst: float, guild_rate: float, guild_burst: float):
+        self.backend = backend
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+
+    async def acquire(self, user_id: int, guild_id: int = None, cost: float = 1):
+        """
+        Trả về (None, 0) nếu được phép, ngược lại (phạm vi bị chặn, số giây cần chờ)
+        """
+        if self.user_rate > 0:
+            wait = await self.backend.take_token(f"cmd:user:{user_id}", self.user_rate, self.user_burst, cost)
+            if wait > 0:
+                return "user", wait
+        if guild_id is not None and self.guild_rate > 0:
+            wait = await self.backend.take_token(f"cmd:guild:{guild_id}", self.guild_rate, self.guild_burst, cost)
+            if wait > 0:
+                # Guild từ chối thì trả lại token đã lấy của user
+                await self.refund(user_id, None, cost)
+                return "guild", wait
+        return None, 0
+
+    async def refund(self, user_id: int, guild_id: int = None, cost: float = 1):
+        """
+        Trả lại token đã lấy nhưng không dùng
+        """
+        if self.user_rate > 0:
+            await self.backend.take_token(f"cmd:user:{user_id}", self.user_rate, self.user_burst, -min(cost, self.user_burst))
+        if guild_id is not None and self.guild_rate > 0:
+            await self.backend.take_token(f"cmd:guild:{guild_id}", self.guild_rate, self.guild_burst, -min(cost, self.guild_burst))
+
+    async def throttle(self, items, user_id: int, guild_id: int = None, *, block: int = 20):
+        """
+        Lấy token cho từng phần tử của async iterable (lấy theo khối block phần tử),
+        hết token thì chờ thay vì từ chối. Dùng cho lệnh hàng loạt đọc dần từ file
+        để mỗi key vẫn tốn một token như lệnh thường.
+        """
+        remaining = 0
+        try:
+            async for item in items:
+                while remaining == 0:
+                    scope, wait = await self.acquire(user_id, guild_id, block)
+                    if scope is None:
+                        remaining = block
+                    else:
+                        await asyncio.sleep(wait)
+                remaining -= 1
+                yield item
+        finally:
+            if remaining:
+                await self.refund(user_id, guild_id, remaining)
+
+
+class BatchExecutor:
+    """
+    Chạy một hàm async cho nhiều phần tử với số lượng đồng thời giới hạn.
+    Semaphore (hoặc FairScheduler) dùng chung cho mọi lệnh nên tổng số request
+    tới upstream luôn bị chặn.
+    """
+
+    def __init__(self, concurrency: int = 20, *, scheduler: FairScheduler = None):
+        self.concurrency = concurrency
+        self.scheduler = scheduler
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(self, func, item):
+        if self.scheduler is not None:
+            async with self.scheduler.slot():
+                return await func(item)
+        async with self._semaphore:
+            return await func(item)
+
+    async def map(self, func, items, *, return_exceptions: bool = True) -> list:
+        """
+        Chạy func(item) cho từng phần tử, kết quả trả về đúng thứ tự đầu vào.
+        Chỉ tạo tối đa `concurrency` worker thay vì một task cho mỗi phần tử.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        indexes = iter(range(len(items)))
+
+        async def worker():
+            for i in indexes:
+                try:
+                    results[i] = await self._run(func, items[i])
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[i] = e
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(items)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return results
+
+    async def as_completed(self, func, items):
+        """
+        Async generator trả về (index, kết quả) ngay khi từng phần tử xong,
+        không chờ cả batch. Exception được trả về như kết quả.
+        """
+        items = list(items)
+        queue = asyncio.Queue()
+        indexes = iter(range(len(items)))
+
+        async def worker():
+            for i in indexes:
+                try:
+                    result = await self._run(func, items[i])
+                except Exception as e:
+                    result = e
+                queue.put_nowait((i, result))
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(items)))]
+        try:
+            for _ in range(len(items)):
+                yield await queue.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def stream(self, func, items, *, buffer: int = None):
+        """
+        Như as_completed nhưng nhận iterable hoặc async iterable có thể rất dài
+        (vd. đọc dần từ file). Chỉ lấy phần tử mới khi có worker rảnh và hàng
+        đợi kết quả tối đa `buffer` phần tử, nên bộ nhớ không tăng theo số
+        phần tử. Trả về (index, phần tử, kết quả) theo thứ tự xong trước.
+        """
+        if hasattr(items, "__aiter__"):
+            source = items.__aiter__()
+        else:
+            source = _AsyncIter(items)
+
+        queue = asyncio.Queue(buffer or self.concurrency)
+        read_lock = asyncio.Lock()
+        counter = itertools.count()
+        finished = object()
+        errors = []
+
+        async def worker():
+            while True:
+                async with read_lock:
+                    try:
+                        item = await source.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except Exception as e:
+                        # Lỗi khi đọc nguồn (vd. file sai định dạng) được ném lại cho bên gọi
+                        errors.append(e)
+                        break
+                    index = next(counter)
+                try:
+                    result = await self._run(func, item)
+                except Exception as e:
+                    result = e
+                await queue.put((index, item, result))
+            await queue.put(finished)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                entry = await queue.get()
+                if entry is finished:
+                    running -= 1
+                    continue
+                yield entry
+        finally:
+            for task in workers:
+                task.cancel()
+        if errors:
+            raise errors[0]
+
+
+class _AsyncIter:
+    """
+    Bọc iterable thường thành async iterator
+    """
+
+    def __init__(self, items):
+        self._iterator = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
@@ -0,0 +1,165 @@
+"""
+Benchmark /check và /addtime trên server giả lập (mock_server.py).
+
+    python benchmark.py --sizes 1,10,50,100,250,500 --iterations 5 --latency 0.05
+
+Đo thông lượng (key/giây), độ trễ p50/p99 của cả lệnh và từng request,
+cùng bộ nhớ cấp phát đỉnh (tracemalloc) cho mỗi kích thước batch.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+import qr_payment_bot
+from batch import HostRateLimiter
+from key_api import KeyAPIClient
+from mock_server import MockKeyAPI, MockTransport, parse_shapes, start_server
+from resilience import RetryPolicy
+from storage import BotStore
+
+bot = qr_payment_bot.bot
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def run_check(keys, per_request):
+    async def timed(key):
+        start = time.perf_counter()
+        try:
+            return await qr_payment_bot.check_single_key(key)
+        finally:
+            per_request.append(time.perf_counter() - start)
+
+    results = await bot.executor.map(timed, keys)
+    qr_payment_bot.build_check_report(keys, results).messages()
+
+
+async def run_addtime(accounts, per_request):
+    async def timed(account):
+        start = time.perf_counter()
+        try:
+            return await bot.api.add_time(account, 1)
+        finally:
+            per_request.append(time.perf_counter() - start)
+
+    results = await bot.executor.map(timed, accounts)
+    success, failed = qr_payment_bot.classify_addtime_results(accounts, results)
+    qr_payment_bot.build_addtime_report(len(accounts), success, failed, 1).messages()
+
+
+async def bench(command, size, args):
+    runner = run_check if command == "check" else run_addtime
+    command_latency = []
+    per_request = []
+    peak_memory = 0
+    started = time.perf_counter()
+
+    for iteration in range(args.iterations):
+        if not args.warm_cache:
+            bot.key_cache.clear()
+        batches = [
+            [f"{command}-{iteration}-{p}-{i}" for i in range(size)]
+            for p in range(args.parallel)
+        ]
+        tracemalloc.start()
+
+        async def one(batch):
+            begin = time.perf_counter()
+            await runner(batch, per_request)
+            command_latency.append(time.perf_counter() - begin)
+
+        await asyncio.gather(*(one(batch) for batch in batches))
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    elapsed = time.perf_counter() - started
+    total_items = size * args.parallel * args.iterations
+    return {
+        "command": command,
+        "size": size,
+        "throughput": total_items / elapsed if elapsed else 0.0,
+        "p50": percentile(command_latency, 50),
+        "p99": percentile(command_latency, 99),
+        "req_p50": percentile(per_request, 50),
+        "req_p99": percentile(per_request, 99),
+        "mean": statistics.mean(command_latency) if command_latency else 0.0,
+        "peak_kib": peak_memory / 1024,
+    }
+
+
+async def main(args):
+    mock = MockKeyAPI(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        shapes=parse_shapes(args.shapes),
+        seed=args.seed,
+    )
+    runner = None
+    if args.transport == "http":
+        runner, base_url = await start_server(mock)
+        transport = None
+    else:
+        base_url = "http://mock/API"
+        transport = MockTransport(mock)
+
+    bot.api = KeyAPIClient(
+        base_url,
+        "benchmark",
+        transport=transport,
+        rate_limiter=HostRateLimiter(args.rate_limit, args.rate_burst) if args.rate_limit > 0 else None,
+        retry_policy=RetryPolicy(qr_payment_bot.API_RETRY_ATTEMPTS, qr_payment_bot.API_RETRY_BASE_DELAY, qr_payment_bot.API_RETRY_MAX_DELAY),
+        failure_threshold=10 ** 9,
+        metrics=bot.metrics,
+    )
+    await bot.api.start()
+    bot.store = BotStore(":memory:")
+    await bot.store.open()
+
+    print(f"transport={args.transport} latency={args.latency}s error_rate={args.error_rate} "
+          f"concurrency={bot.executor.concurrency} rate_limit={args.rate_limit}/s parallel={args.parallel}")
+    header = f"{'lệnh':<8}{'batch':>6}{'key/s':>10}{'p50(s)':>9}{'p99(s)':>9}{'req p50':>9}{'req p99':>9}{'peak KiB':>10}"
+    print(header)
+    print("-" * len(header))
+    try:
+        for command in args.commands.split(","):
+            for size in args.sizes:
+                r = await bench(command, size, args)
+                print(f"{r['command']:<8}{r['size']:>6}{r['throughput']:>10.1f}{r['p50']:>9.3f}{r['p99']:>9.3f}"
+                      f"{r['req_p50']:>9.3f}{r['req_p99']:>9.3f}{r['peak_kib']:>10.1f}")
+        if args.metrics:
+            print()
+            print(bot.metrics.render(), end="")
+    finally:
+        await bot.api.close()
+        await bot.store.close()
+        if runner is not None:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /check và /addtime trên API giả lập")
+    parser.add_argument("--commands", default="check,addtime")
+    parser.add_argument("--sizes", default="1,10,50,100,250,500",
+                        type=lambda s: [int(x) for x in s.split(",") if x])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--parallel", type=int, default=1, help="Số lệnh chạy đồng thời")
+    parser.add_argument("--transport", choices=("http", "inprocess"), default="http")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--shapes", default="ok=1")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate-limit", type=float, default=0, help="request/giây, 0 = không giới hạn")
+    parser.add_argument("--rate-burst", type=float, default=None)
+    parser.add_argument("--warm-cache", action="store_true")
+    parser.add_argument("--metrics", action="store_true", help="In số liệu /metrics sau khi chạy")
+    asyncio.run(main(parser.parse_args()))
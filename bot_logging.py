@@ -0,0 +1,175 @@
+"""
+Log có cấu trúc (JSON) cho bot.
+
+Handler chỉ đưa record vào hàng đợi; việc format và ghi ra stdout chạy trên
+thread của QueueListener nên event loop không bao giờ bị chặn bởi I/O log.
+Mỗi record được gắn correlation id (id interaction, đơn hàng, lô sweeper...)
+và được lọc các giá trị nhạy cảm trước khi rời thread gọi.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+from datetime import datetime, timezone
+
+# Id của interaction / task nền đang chạy, tự đi theo các task con (asyncio copy context)
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+REDACTED = "***"
+# Field có tên chứa các từ này luôn bị ẩn giá trị
+SENSITIVE_FIELDS = ("password", "passwd", "secret", "token", "api_key", "apikey")
+# Tham số nhạy cảm trong URL / query string, vd. addtime.php?API=...
+_SENSITIVE_PARAM = re.compile(r"(?i)\b(API|api_key|password|token|secret)=([^&\s\"']+)")
+# Dòng tài khoản giao cho khách có dạng "username - password", đứng riêng một dòng
+# (chỉ khớp cả dòng để không che nhầm nội dung kiểu "a - b" trong câu)
+_CREDENTIAL_LINE = re.compile(r"(?m)^([^\s-]\S*) - (\S+)$")
+
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "correlation_id"}
+
+
+class Redactor:
+    """
+    Ẩn các secret đã biết (token, API key...) và mật khẩu trong log
+    """
+
+    def __init__(self, secrets=()):
+        self._secrets = set()
+        for secret in secrets:
+            self.add(secret)
+
+    def add(self, secret):
+        # Bỏ qua chuỗi quá ngắn để không che nhầm nội dung bình thường
+        if secret and len(str(secret)) >= 4:
+            self._secrets.add(str(secret))
+
+    def text(self, text: str) -> str:
+        for secret in self._secrets:
+            if secret in text:
+                text = text.replace(secret, REDACTED)
+        text = _SENSITIVE_PARAM.sub(lambda m: f"{m.group(1)}={REDACTED}", text)
+        return _CREDENTIAL_LINE.sub(lambda m: f"{m.group(1)} - {REDACTED}", text)
+
+    def value(self, name: str, value):
+        if any(word in name.lower() for word in SENSITIVE_FIELDS):
+            return REDACTED
+        if isinstance(value, str):
+            return self.text(value)
+        if isinstance(value, dict):
+            return {k: self.value(str(k), v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.value(name, v) for v in value]
+        return value
+
+
+redactor = Redactor()
+
+
+def add_secret(secret):
+    """
+    Đăng ký thêm giá trị cần ẩn khỏi log
+    """
+    redactor.add(secret)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Mỗi record là một dòng JSON; các field truyền qua extra={...} được giữ nguyên
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRS and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Dạng text một dòng cho lúc chạy thử trên máy
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(correlation_id)s] %(message)s")
+
+    def format(self, record):
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = "-"
+        line = super().format(record)
+        extra = {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS and not k.startswith("_")}
+        if extra:
+            line += " " + json.dumps(extra, ensure_ascii=False, default=str)
+        return line
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler không chặn: hàng đợi đầy thì bỏ record và đếm số record bị bỏ
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Ghép message, format traceback và ẩn secret ngay tại thread gọi để
+        # record gửi sang listener không còn tham chiếu tới object của bot
+        record = copy.copy(record)
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = correlation_id.get()
+        record.msg = redactor.text(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.exc_text:
+            record.exc_text = redactor.text(record.exc_text)
+        for name in list(record.__dict__):
+            if name not in _RECORD_ATTRS and not name.startswith("_"):
+                record.__dict__[name] = redactor.value(name, record.__dict__[name])
+        return record
+
+
+def setup_logging(level: str = "INFO", *, fmt: str = "json", secrets=(), max_queue: int = 10000, stream=None):
+    """
+    Cấu hình root logger ghi qua hàng đợi. Trả về QueueListener, gọi stop()
+    khi tắt bot để ghi nốt các log còn trong hàng đợi.
+    """
+    for secret in secrets:
+        add_secret(secret)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.Queue(max_queue)
+    handler = AsyncQueueHandler(log_queue)
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    return listener
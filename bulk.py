@@ -0,0 +1,204 @@
+"""
+Chế độ hàng loạt cho /check và /addtime qua file đính kèm.
+
+File được tải và đọc dần từng đoạn (không nạp cả file vào bộ nhớ), mỗi key /
+tài khoản đi qua BatchExecutor.stream với số request đồng thời giới hạn, kết
+quả được ghi dần vào file CSV tạm (chuyển xuống đĩa khi lớn) rồi gửi lại
+thành file đính kèm. Bộ nhớ dùng không phụ thuộc kích thước file.
+"""
+import codecs
+import csv
+import io
+import tempfile
+
+import aiohttp
+
+# Tên cột được nhận là cột key / tài khoản trong file CSV có tiêu đề
+ITEM_COLUMNS = {"key", "keys", "account", "accounts", "tk", "taikhoan", "tai_khoan", "tai khoan", "username"}
+# Dòng dài hơn mức này bị coi là file sai định dạng
+MAX_LINE_LENGTH = 4096
+# Kết quả CSV được giữ trong RAM tới mức này rồi mới chuyển xuống file tạm
+REPORT_MEMORY_LIMIT = 1024 * 1024
+
+
+async def iter_url_chunks(url: str, *, chunk_size: int = 64 * 1024, timeout: float = 60):
+    """
+    Tải file (vd. attachment.url) theo từng đoạn bytes
+    """
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise ValueError(f"Không tải được file (mã lỗi: {response.status})")
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+
+async def iter_lines(chunks, *, max_line_length: int = MAX_LINE_LENGTH):
+    """
+    Giải mã UTF-8 (có hoặc không BOM) và tách dòng dần từ các đoạn bytes
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if len(pending) > max_line_length:
+            raise ValueError(f"File có dòng dài hơn {max_line_length} ký tự")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+class BulkReader:
+    """
+    Đọc key / tài khoản từ file text hoặc CSV:
+    - File text: mỗi dòng một hoặc nhiều giá trị cách nhau bằng khoảng trắng,
+      dòng dạng "tk - mk" lấy phần tài khoản
+    - File CSV (phân cách bằng , ; hoặc tab): lấy cột có tên trong ITEM_COLUMNS
+      nếu dòng đầu là tiêu đề, ngược lại lấy cột đầu tiên
+    Dòng trống và dòng bắt đầu bằng # bị bỏ qua. Đọc tối đa `limit` giá trị,
+    phần còn lại bị bỏ và `truncated` được bật.
+    """
+
+    def __init__(self, chunks, *, limit: int = None):
+        self.chunks = chunks
+        self.limit = limit
+        self.count = 0
+        self.truncated = False
+
+    def _fields(self, line: str):
+        for delimiter in (",", ";", "\t"):
+            if delimiter in line:
+                return next(csv.reader([line], delimiter=delimiter))
+        return None
+
+    async def __aiter__(self):
+        column = None
+        first = True
+        async for line in iter_lines(self.chunks):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = self._fields(line)
+            if fields is not None:
+                if first:
+                    first = False
+                    names = [field.strip().lower() for field in fields]
+                    matched = [i for i, name in enumerate(names) if name in ITEM_COLUMNS]
+                    if matched:
+                        column = matched[0]
+                        continue
+                index = column or 0
+                values = [fields[index].strip()] if index < len(fields) else []
+            else:
+                if first:
+                    first = False
+                    if line.lower() in ITEM_COLUMNS:
+                        continue
+                if " - " in line:
+                    line = line.split(" - ", 1)[0]
+                values = line.split()
+            for value in values:
+                if not value:
+                    continue
+                if self.limit is not None and self.count >= self.limit:
+                    self.truncated = True
+                    return
+                self.count += 1
+                yield value
+
+
+class CsvReport:
+    """
+    File CSV kết quả được ghi dần từng dòng
+    """
+
+    def __init__(self, header, *, memory_limit: int = REPORT_MEMORY_LIMIT):
+        self._file = tempfile.SpooledTemporaryFile(max_size=memory_limit, mode="w+b")
+        # utf-8-sig để Excel đọc đúng tiếng Việt
+        self._text = io.TextIOWrapper(self._file, encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(header)
+        self.rows = 0
+
+    def write(self, *row):
+        self._writer.writerow(row)
+        self.rows += 1
+
+    def finish(self):
+        """
+        Trả về file nhị phân đã tua về đầu (truyền vào discord.File)
+        """
+        self._text.flush()
+        self._text.detach()
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        self._file.close()
+
+
+async def iter_batches(items, size: int):
+    """
+    Gom async iterable thành từng list tối đa size phần tử
+    """
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_delivery_line(line: str):
+    """
+    Đọc một dòng giao key: "<người nhận> tk - mk [tk - mk ...]", "<người nhận> tk mk"
+    hoặc CSV "<người nhận>,tk,mk". Người nhận là mention, id hoặc tên.
+    Trả về (người nhận, [(tk, mk), ...]) hoặc None nếu dòng không hợp lệ.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if "," in line or "\t" in line:
+        fields = [field.strip() for field in next(csv.reader([line], delimiter="," if "," in line else "\t"))]
+        tokens = [field for field in fields if field]
+    else:
+        tokens = line.split()
+    if len(tokens) < 3:
+        return None
+    recipient, rest = tokens[0], tokens[1:]
+    pairs = []
+    i = 0
+    while i < len(rest):
+        if i + 2 < len(rest) and rest[i + 1] == "-":
+            pairs.append((rest[i], rest[i + 2]))
+            i += 3
+        elif i + 1 < len(rest) and rest[i + 1] != "-":
+            pairs.append((rest[i], rest[i + 1]))
+            i += 2
+        else:
+            return None
+    return recipient, pairs
+
+
+def parse_deliveries(lines):
+    """
+    Gom các dòng giao key theo người nhận (giữ thứ tự xuất hiện).
+    Trả về ({người nhận: [(tk, mk), ...]}, số dòng lỗi).
+    """
+    deliveries = {}
+    invalid = 0
+    for line in lines:
+        if not line.strip() or line.strip().startswith("#"):
+            continue
+        parsed = parse_delivery_line(line)
+        if parsed is None:
+            invalid += 1
+            continue
+        recipient, pairs = parsed
+        deliveries.setdefault(recipient, []).extend(pairs)
+    return deliveries, invalid
@@ -0,0 +1,161 @@
+"""
+Số liệu chẩn đoán lúc chạy cho lệnh /status.
+
+Mẫu được giữ trong bộ đệm kích thước cố định (deque có maxlen) nên bộ nhớ và
+chi phí ghi không tăng theo thời gian chạy hay số request; thống kê theo cửa
+sổ thời gian (1 phút, 5 phút...) chỉ được tính khi có người xem.
+"""
+import asyncio
+import math
+import os
+import sys
+import time
+from collections import deque
+
+# Cửa sổ thời gian hiển thị trong /status (giây)
+WINDOWS = (60, 300)
+
+
+def percentile(values, q: float):
+    """
+    Phân vị q (0-1) của list đã sắp xếp, None nếu rỗng
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def read_rss() -> int:
+    """
+    Bộ nhớ RSS hiện tại của process (bytes).
+    Không có /proc (vd. macOS, Windows) thì trả về RSS lớn nhất từ getrusage.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS tính bằng bytes, Linux tính bằng KB
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Histogram thời gian xử lý: bin i chứa [LATENCY_MIN * LATENCY_GROWTH^i, ... ^(i+1)),
+# sai số của p50 / p99 tối đa khoảng 5%
+LATENCY_MIN = 0.001
+LATENCY_GROWTH = 1.1
+
+
+def latency_bin(elapsed: float) -> int:
+    if elapsed <= LATENCY_MIN:
+        return 0
+    return int(math.log(elapsed / LATENCY_MIN, LATENCY_GROWTH))
+
+
+def bin_value(index: int) -> float:
+    # Giá trị giữa bin (trung bình nhân hai cận)
+    return LATENCY_MIN * LATENCY_GROWTH ** (index + 0.5)
+
+
+class LatencyWindow:
+    """
+    Request của một endpoint gom theo khoảng bucket giây: mỗi khoảng giữ số
+    request, số lỗi và histogram thời gian xử lý. Số khoảng giữ lại đủ phủ
+    span giây nên cửa sổ 5 phút luôn đủ dữ liệu dù nhiều request tới đâu.
+    """
+
+    def __init__(self, *, bucket: float = 10, span: float = max(WINDOWS)):
+        self.bucket = bucket
+        # (mốc bắt đầu khoảng, [số request, số lỗi], {bin: số request})
+        self._buckets = deque(maxlen=int(math.ceil(span / bucket)) + 1)
+
+    def record(self, elapsed: float, ok: bool):
+        start = time.monotonic() // self.bucket * self.bucket
+        if not self._buckets or self._buckets[-1][0] != start:
+            self._buckets.append((start, [0, 0], {}))
+        _, counts, histogram = self._buckets[-1]
+        counts[0] += 1
+        if not ok:
+            counts[1] += 1
+        index = latency_bin(elapsed)
+        histogram[index] = histogram.get(index, 0) + 1
+
+    def summary(self, window: float) -> dict:
+        """
+        Số request, số lỗi, p50 / p99 trong window giây gần nhất (làm tròn theo bucket)
+        """
+        since = time.monotonic() - window
+        count = errors = 0
+        histogram = {}
+        for start, counts, bins in self._buckets:
+            if start < since:
+                continue
+            count += counts[0]
+            errors += counts[1]
+            for index, n in bins.items():
+                histogram[index] = histogram.get(index, 0) + n
+        return {
+            "count": count,
+            "errors": errors,
+            "error_ratio": errors / count if count else 0.0,
+            "p50": self._percentile(histogram, count, 0.50),
+            "p99": self._percentile(histogram, count, 0.99),
+        }
+
+    @staticmethod
+    def _percentile(histogram: dict, count: int, q: float):
+        if not count:
+            return None
+        rank = min(count - 1, int(q * count))
+        seen = 0
+        for index in sorted(histogram):
+            seen += histogram[index]
+            if seen > rank:
+                return bin_value(index)
+
+
+class RuntimeSampler:
+    """
+    Task nền lấy mẫu mỗi interval giây: độ trễ event loop (thời gian ngủ thực
+    tế trừ thời gian hẹn), số asyncio task và RSS của process
+    """
+
+    def __init__(self, *, interval: float = 1.0, maxlen: int = 600):
+        self.interval = interval
+        # (thời điểm, độ trễ loop, số task, RSS)
+        self._samples = deque(maxlen=maxlen)
+        self.lag = 0.0
+        self.tasks = 0
+        self.rss = 0
+
+    def sample(self, lag: float):
+        self.lag = lag
+        self.tasks = len(asyncio.all_tasks())
+        self.rss = read_rss()
+        self._samples.append((time.monotonic(), lag, self.tasks, self.rss))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.sample(max(0.0, loop.time() - expected))
+
+    def summary(self, window: float) -> dict:
+        """
+        Độ trễ loop (trung bình, p99, lớn nhất), số task và RSS lớn nhất trong window giây gần nhất
+        """
+        since = time.monotonic() - window
+        recent = [sample for sample in self._samples if sample[0] >= since]
+        lags = sorted(sample[1] for sample in recent)
+        return {
+            "samples": len(recent),
+            "lag_avg": sum(lags) / len(lags) if lags else None,
+            "lag_p99": percentile(lags, 0.99),
+            "lag_max": lags[-1] if lags else None,
+            "tasks_max": max((sample[2] for sample in recent), default=None),
+            "rss_max": max((sample[3] for sample in recent), default=None),
+        }
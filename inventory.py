@@ -0,0 +1,218 @@
+import io
+import re
+import time
+
+INVENTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS key_inventory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    product TEXT NOT NULL DEFAULT 'default',
+    status TEXT NOT NULL DEFAULT 'available',
+    reserved_by TEXT,
+    reserved_at REAL,
+    delivered_to INTEGER,
+    delivered_at REAL,
+    imported_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_inventory_pick ON key_inventory (product, status, id);
+CREATE INDEX IF NOT EXISTS idx_inventory_reserved ON key_inventory (status, reserved_at);
+"""
+
+# Số dòng ghi mỗi lần khi import
+IMPORT_BATCH_SIZE = 1000
+
+
+class OutOfStockError(Exception):
+    """
+    Kho không đủ key cho yêu cầu
+    """
+
+    def __init__(self, requested: int, available: int):
+        super().__init__(f"Kho chỉ còn {available} key, cần {requested} key")
+        self.requested = requested
+        self.available = available
+
+
+class KeyImportError(Exception):
+    """
+    Import key bị dừng giữa chừng; summary là số key đã được ghi vào kho trước khi lỗi
+    """
+
+    def __init__(self, message: str, summary: dict):
+        super().__init__(message)
+        self.summary = summary
+
+
+def parse_key_line(line: str):
+    """
+    Đọc một dòng "tk - mk", "tk,mk", "tk:mk" hoặc "tk mk"; dòng không hợp lệ trả về None
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    parts = [p for p in re.split(r"\s+-\s+|[,;:|\t]|\s+", line, maxsplit=1) if p.strip()]
+    if len(parts) != 2:
+        return None
+    account, password = parts[0].strip(), parts[1].strip()
+    if not account or not password or " " in password:
+        return None
+    return account, password
+
+
+class KeyInventory:
+    """
+    Kho key giao tự động.
+    Key đi qua các trạng thái available -> reserved -> delivered. Mọi thao tác
+    chạy trên thread SQLite của BotStore trong transaction riêng, nên hai đơn
+    không bao giờ lấy trùng một key.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        store.add_schema(INVENTORY_SCHEMA)
+
+    async def import_lines(self, lines, product: str = "default") -> dict:
+        """
+        Import key từ các dòng văn bản, bỏ qua dòng lỗi và key đã có.
+        Lỗi giữa chừng thì raise KeyImportError kèm số key đã nhập.
+        """
+        summary = {"added": 0, "duplicates": 0, "invalid": 0}
+        batch = []
+
+        def write(conn, rows):
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO key_inventory (account, password, product, imported_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                return conn.total_changes - before
+
+        async def flush():
+            added = await self.store.run(lambda conn: write(conn, batch))
+            summary["added"] += added
+            summary["duplicates"] += len(batch) - added
+            batch.clear()
+
+        now = time.time()
+        try:
+            for line in lines:
+                parsed = parse_key_line(line)
+                if parsed is None:
+                    if line.strip():
+                        summary["invalid"] += 1
+                    continue
+                batch.append((parsed[0], parsed[1], product, now))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await flush()
+            if batch:
+                await flush()
+        except Exception as e:
+            raise KeyImportError(str(e), summary) from e
+        return summary
+
+    async def import_bytes(self, data: bytes, product: str = "default") -> dict:
+        """
+        Import file text UTF-8; file không đọc được thì không nhập key nào
+        """
+        try:
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError as e:
+            line = data[:e.start].count(b"\n") + 1
+            raise KeyImportError(f"File không phải UTF-8 (dòng {line})", {"added": 0, "duplicates": 0, "invalid": 0}) from e
+        return await self.import_lines(io.StringIO(text), product)
+
+    async def reserve(self, count: int, reference: str, product: str = "default"):
+        """
+        Giữ chỗ count key còn trống cho một đơn (tất cả hoặc không).
+        Trả về list dict (id, account, password).
+        """
+        def reserve(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "UPDATE key_inventory SET status = 'reserved', reserved_by = ?, reserved_at = ? "
+                    "WHERE id IN (SELECT id FROM key_inventory WHERE product = ? AND status = 'available' "
+                    "ORDER BY id LIMIT ?) RETURNING id, account, password",
+                    (reference, time.time(), product, count),
+                ).fetchall()
+                if len(rows) < count:
+                    conn.execute("ROLLBACK")
+                    raise OutOfStockError(count, len(rows))
+                conn.execute("COMMIT")
+            except OutOfStockError:
+                raise
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return sorted((dict(row) for row in rows), key=lambda row: row["id"])
+
+        await self.store.flush()
+        return await self.store.run(reserve)
+
+    async def mark_delivered(self, ids, user_id: int):
+        ids = list(ids)
+
+        def update(conn):
+            with conn:
+                conn.executemany(
+                    "UPDATE key_inventory SET status = 'delivered', delivered_to = ?, delivered_at = ? WHERE id = ?",
+                    [(user_id, time.time(), key_id) for key_id in ids],
+                )
+
+        await self.store.run(update)
+
+    async def release(self, ids):
+        """
+        Trả key đã giữ chỗ về kho (giao thất bại)
+        """
+        ids = list(ids)
+
+        def update(conn):
+            with conn:
+                conn.executemany(
+                    "UPDATE key_inventory SET status = 'available', reserved_by = NULL, reserved_at = NULL "
+                    "WHERE id = ? AND status = 'reserved'",
+                    [(key_id,) for key_id in ids],
+                )
+
+        await self.store.run(update)
+
+    async def reference_status(self, reference: str) -> dict:
+        """
+        Số key theo trạng thái (reserved / delivered) đã lấy cho một đơn
+        """
+        rows = await self.store.fetchall(
+            "SELECT status, COUNT(*) AS total FROM key_inventory WHERE reserved_by = ? AND status != 'available' "
+            "GROUP BY status",
+            (reference,),
+        )
+        return {row["status"]: row["total"] for row in rows}
+
+    async def release_stale(self, older_than: float = 3600) -> int:
+        """
+        Trả về kho các key bị giữ chỗ quá lâu (vd. bot tắt giữa lúc giao)
+        """
+        def update(conn):
+            with conn:
+                return conn.execute(
+                    "UPDATE key_inventory SET status = 'available', reserved_by = NULL, reserved_at = NULL "
+                    "WHERE status = 'reserved' AND reserved_at < ?",
+                    (time.time() - older_than,),
+                ).rowcount
+
+        return await self.store.run(update)
+
+    async def stock(self) -> dict:
+        """
+        Số key theo sản phẩm và trạng thái: {product: {status: count}}
+        """
+        rows = await self.store.fetchall(
+            "SELECT product, status, COUNT(*) AS total FROM key_inventory GROUP BY product, status"
+        )
+        result = {}
+        for row in rows:
+            result.setdefault(row["product"], {})[row["status"]] = row["total"]
+        return result
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import time
+import aiohttp
+
+from bot_logging import correlation_id
+from diagnostics import LatencyWindow
+from metrics import MetricsRegistry
+from resilience import CircuitBreaker, CircuitOpenError, RetryableError, RetryPolicy, RETRYABLE_STATUSES, call_with_retry
+
+# Địa chỉ mặc định của API key
+DEFAULT_BASE_URL = "https://api.autoit.pro/API"
+
+# Thông báo khi request thêm giờ có thể đã tới server nhưng không nhận được kết quả
+ADDTIME_UNKNOWN_MESSAGE = "Không rõ kết quả ({}), kiểm tra thời hạn tài khoản trước khi thêm lại"
+
+log = logging.getLogger("bot.keyapi")
+
+
+class AiohttpTransport:
+    """
+    Transport HTTP mặc định.
+    Giữ một connection pool (keep-alive, DNS cache) cho toàn bộ bot thay vì
+    mở ClientSession mới cho mỗi lệnh.
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession = None,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 30,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        total_timeout: float = 10,
+        connect_timeout: float = 5,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        # Session truyền từ ngoài vào thì không tự đóng
+        self._session = session
+        self._owns_session = session is None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("Transport chưa được khởi động, hãy gọi start() trước")
+        return self._session
+
+    async def start(self):
+        """
+        Tạo connection pool dùng chung
+        """
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self._owns_session = True
+
+    async def close(self):
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get(self, url: str, params: dict, headers: dict = None):
+        """
+        Gửi GET, trả về (mã HTTP, nội dung dạng text)
+        """
+        async with self.session.get(url, params=params, headers=headers) as response:
+            return response.status, await response.text()
+
+
+class KeyAPIClient:
+    """
+    Client dùng chung cho api.autoit.pro.
+    Transport có thể thay thế (vd. MockTransport trong mock_server.py) để chạy
+    thử mà không cần gọi API thật. Transport chỉ cần có start(), close() và
+    get(url, params, headers) -> (status, text).
+    Correlation id của lệnh đang chạy được gửi kèm trong header X-Request-ID.
+    """
+
+    def __init__(
+        self,
+        base_url: str = DEFAULT_BASE_URL,
+        api_key: str = None,
+        *,
+        transport=None,
+        session: aiohttp.ClientSession = None,
+        rate_limiter=None,
+        retry_policy: RetryPolicy = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        metrics: MetricsRegistry = None,
+        latency_bucket: float = 10,
+        **transport_options,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.transport = transport or AiohttpTransport(session, **transport_options)
+        # Giới hạn tốc độ theo host (HostRateLimiter), None = không giới hạn
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Mỗi endpoint có một circuit breaker riêng
+        self.breakers = {
+            endpoint: CircuitBreaker(endpoint, failure_threshold, reset_timeout)
+            for endpoint in ("api.php", "addtime.php")
+        }
+        self.retries = 0
+        # Các request gần nhất và số request đang chờ response theo endpoint (cho /status)
+        self.windows = {endpoint: LatencyWindow(bucket=latency_bucket) for endpoint in self.breakers}
+        self.in_flight = dict.fromkeys(self.breakers, 0)
+        self.metrics = metrics or MetricsRegistry()
+        self._latency = self.metrics.histogram(
+            "keyapi_request_duration_seconds", "Thời gian mỗi request tới API key", ("endpoint",)
+        )
+        self._responses = self.metrics.counter(
+            "keyapi_responses_total", "Số response của API key theo mã HTTP", ("endpoint", "status")
+        )
+        self._retry_counter = self.metrics.counter(
+            "keyapi_retries_total", "Số lần retry request tới API key", ("endpoint",)
+        )
+        self._throttle_wait = self.metrics.counter(
+            "keyapi_throttle_wait_seconds_total", "Tổng thời gian chờ rate limiter phía bot", ("endpoint",)
+        )
+        self.metrics.collect(
+            "keyapi_requests_in_flight",
+            "Số request tới API key đang chờ response",
+            lambda: dict(self.in_flight),
+            labelnames=("endpoint",),
+        )
+        self.metrics.collect(
+            "keyapi_circuit_open",
+            "Circuit breaker đang mở (1) hay không (0)",
+            lambda: {name: int(breaker.state != "closed") for name, breaker in self.breakers.items()},
+            labelnames=("endpoint",),
+        )
+
+    async def start(self):
+        """
+        Mở transport (gọi trong setup_hook)
+        """
+        await self.transport.start()
+
+    async def close(self):
+        """
+        Đóng transport khi bot tắt
+        """
+        await self.transport.close()
+
+    async def _throttle(self, endpoint: str, url: str):
+        if self.rate_limiter is not None:
+            started = time.perf_counter()
+            await self.rate_limiter.acquire(url)
+            self._throttle_wait.inc(time.perf_counter() - started, endpoint=endpoint)
+
+    def _count_retry(self, endpoint: str, attempt: int, exc: Exception):
+        self.retries += 1
+        self._retry_counter.inc(endpoint=endpoint)
+        log.warning("Retry request tới API key", extra={"endpoint": endpoint, "attempt": attempt, "error": str(exc)})
+
+    async def _get(self, endpoint: str, params: dict, parse, *, idempotent: bool = True):
+        """
+        Gửi GET tới endpoint qua rate limiter, retry (backoff + jitter) và circuit breaker.
+        parse(status, body) xử lý kết quả; mã HTTP tạm thời được chuyển thành RetryableError.
+        """
+        api_url = f"{self.base_url}/{endpoint}"
+
+        async def attempt():
+            await self._throttle(endpoint, api_url)
+            request_id = correlation_id.get()
+            headers = {"X-Request-ID": request_id} if request_id else None
+            started = time.perf_counter()
+            self.in_flight[endpoint] += 1
+            status = None
+            try:
+                status, body = await self.transport.get(api_url, params, headers)
+            except asyncio.TimeoutError:
+                self._responses.inc(endpoint=endpoint, status="timeout")
+                raise
+            except Exception:
+                self._responses.inc(endpoint=endpoint, status="error")
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.in_flight[endpoint] -= 1
+                self._latency.observe(elapsed, endpoint=endpoint)
+                self.windows[endpoint].record(elapsed, status == 200)
+            self._responses.inc(endpoint=endpoint, status=status)
+            log.debug("Request tới API key", extra={"endpoint": endpoint, "status": status, "elapsed": round(elapsed, 4)})
+            if status in RETRYABLE_STATUSES:
+                raise RetryableError(f"Mã lỗi: {status}", status)
+            return parse(status, body)
+
+        return await call_with_retry(
+            attempt,
+            policy=self.retry_policy,
+            breaker=self.breakers[endpoint],
+            idempotent=idempotent,
+            on_retry=lambda attempt, exc: self._count_retry(endpoint, attempt, exc),
+        )
+
+    async def check_key(self, key: str):
+        """
+        Hàm kiểm tra một key riêng lẻ
+        """
+        def parse(status, body):
+            if status != 200:
+                return (key, "error")
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return (key, "error")
+            return parse_check_response(key, data)
+
+        try:
+            return await self._get("api.php", {"TK": key}, parse)
+        except (CircuitOpenError, RetryableError, aiohttp.ClientError, asyncio.TimeoutError):
+            return (key, "error")
+
+    async def add_time(self, account: str, hours: int):
+        """
+        Hàm xử lý thêm thời gian cho một tài khoản.
+        Không retry khi request có thể đã tới server, tránh cộng giờ hai lần.
+        Trả về (account, True/False, message), hoặc (account, None, message) khi
+        request đã gửi đi nhưng không có response (timeout, mất kết nối) nên
+        không biết upstream đã cộng giờ hay chưa.
+        """
+        def parse(status, body):
+            if status != 200:
+                return (account, False, f"Mã lỗi: {status}")
+            return parse_addtime_response(account, body)
+
+        params = {"API": self.api_key or "", "TK": account, "SOGIO": str(hours)}
+        try:
+            return await self._get("addtime.php", params, parse, idempotent=False)
+        except CircuitOpenError:
+            return (account, False, "API tạm thời không khả dụng")
+        except RetryableError as e:
+            return (account, False, str(e))
+        except aiohttp.ClientConnectorError as e:
+            # Chưa kết nối được tới server, request chắc chắn chưa được gửi
+            return (account, False, f"Không kết nối được tới API: {e}")
+        except asyncio.TimeoutError:
+            return (account, None, ADDTIME_UNKNOWN_MESSAGE.format("hết thời gian chờ API"))
+        except Exception as e:
+            return (account, None, ADDTIME_UNKNOWN_MESSAGE.format(str(e) or type(e).__name__))
+
+
+def parse_check_response(key: str, data):
+    """
+    Phân loại key từ JSON trả về của api.php
+    """
+    if not isinstance(data, dict):
+        return (key, "error")
+
+    error = data.get("error")
+    message = data.get("message")
+    seconds_remaining = data.get("data")
+
+    if error is None or message is None:
+        return (key, "error")
+
+    # Convert error to int if needed
+    if isinstance(error, str):
+        try:
+            error = int(error)
+        except ValueError:
+            return (key, "error")
+
+    # Phân loại key
+    if error == 2:
+        return (key, "not_activated")
+    elif error != 0 or str(message).lower() != "ok":
+        return (key, "inactive")
+    else:
+        try:
+            seconds_remaining = int(seconds_remaining)
+            if seconds_remaining > 0:
+                days_remaining = seconds_remaining // (24 * 3600)
+                return (key, "active", days_remaining)
+            else:
+                return (key, "inactive")
+        except (ValueError, TypeError):
+            return (key, "error")
+
+
+def parse_addtime_response(account: str, data: str):
+    """
+    Phân tích phản hồi của addtime.php
+    """
+    try:
+        # Thử parse JSON từ phản hồi
+        json_data = json.loads(data)
+    except ValueError:
+        json_data = None
+
+    if isinstance(json_data, dict):
+        # Kiểm tra nếu message là "OK" thì coi là thành công
+        if json_data.get("message") == "OK":
+            return (account, True, "Thành công")
+        return (account, False, f"Lỗi: {data}")
+
+    # Nếu không phải JSON, kiểm tra theo cách cũ
+    if "success" in data.lower() or "ok" in data.lower():
+        return (account, True, "Thành công")
+    return (account, False, f"Lỗi: {data}")
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# TTL mặc định (giây) theo trạng thái key
+DEFAULT_TTLS = {
+    "active": 300,
+    "inactive": 300,
+    "not_activated": 60,
+    "error": 5,
+}
+
+
+class KeyStatusCache:
+    """
+    Cache trạng thái key trong bộ nhớ.
+    - TTL riêng cho từng trạng thái (lỗi thì hết hạn nhanh)
+    - Xoá theo LRU khi vượt quá max_entries
+    - Gộp các lượt kiểm tra cùng một key đang chạy thành một request
+    - Có shared (state backend dùng chung) thì các shard / process dùng chung
+      kết quả và chỉ một process gọi API cho mỗi key tại một thời điểm
+    """
+
+    def __init__(
+        self,
+        ttls: dict = None,
+        *,
+        default_ttl: float = 60,
+        max_entries: int = 10000,
+        shared=None,
+        shared_wait: float = 5,
+    ):
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        # key -> (thời điểm hết hạn, kết quả)
+        self._entries = OrderedDict()
+        # key -> task của request đang chạy
+        self._inflight = {}
+        self.shared = shared
+        self.shared_wait = shared_wait
+        self.shared_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        """
+        Lấy kết quả còn hạn trong cache, không có thì trả về None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def ttl_for(self, result) -> float:
+        return self.ttls.get(result[1], self.default_ttl)
+
+    def set(self, key: str, result):
+        ttl = self.ttl_for(result)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key: str, fetch):
+        """
+        Trả về kết quả trong cache, nếu không có thì gọi fetch(key).
+        Các lượt gọi đồng thời cho cùng một key dùng chung một request.
+        Request chạy trong task riêng: một lượt gọi bị huỷ không làm huỷ
+        request mà các lượt gọi khác đang chờ.
+        """
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+        # Lấy exception để không bị cảnh báo khi mọi lượt gọi đều đã bị huỷ
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key: str, fetch):
+        task = asyncio.current_task()
+        try:
+            result = await self._fetch(key, fetch)
+        except BaseException:
+            self._release(key, task)
+            raise
+        # Chỉ lưu nếu key không bị invalidate trong lúc đang chạy
+        if self._release(key, task):
+            self.set(key, result)
+        return result
+
+    async def _fetch(self, key: str, fetch):
+        if self.shared is None:
+            return await fetch(key)
+
+        name = f"keystatus:{key}"
+        result = await self.shared.get(name)
+        if result is not None:
+            self.shared_hits += 1
+            return tuple(result)
+
+        # Process khác đang gọi API cho key này thì chờ kết quả của nó
+        lock = f"keystatus-lock:{key}"
+        locked = await self.shared.add(lock, 1, self.shared_wait)
+        if not locked:
+            deadline = time.monotonic() + self.shared_wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+                result = await self.shared.get(name)
+                if result is not None:
+                    self.shared_hits += 1
+                    return tuple(result)
+
+        try:
+            result = await fetch(key)
+            ttl = self.ttl_for(result)
+            if ttl > 0:
+                await self.shared.set(name, list(result), ttl)
+            return result
+        finally:
+            # Hết thời gian chờ mà không có lock thì lock vẫn thuộc process khác, không được xoá
+            if locked:
+                await self.shared.delete([lock])
+
+    def _release(self, key: str, task) -> bool:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            return True
+        return False
+
+    async def invalidate(self, keys):
+        """
+        Xoá các key khỏi cache (vd. sau khi /addtime)
+        """
+        keys = list(keys)
+        for key in keys:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+        if self.shared is not None:
+            await self.shared.delete(f"keystatus:{key}" for key in keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "evictions": self.evictions,
+            # Lượt tra không phải gọi API (kết quả từ process khác cũng tính)
+            "hit_rate": (self.hits + self.coalesced + self.shared_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,104 @@
+"""
+Tắt bot an toàn khi nhận SIGTERM (vd. khi deploy lại worker).
+
+Khi bắt đầu tắt: ngừng nhận lệnh mới, chờ các lệnh và task giao key đang
+chạy xong trong thời hạn cho phép, rồi mới đóng bot (gửi nốt log, ghi nốt
+database, đóng các kết nối). Task còn chạy quá hạn bị huỷ; phần việc dở dang
+được chạy tiếp khi khởi động lại (journal /addtime, đơn đã thanh toán chưa giao).
+"""
+import asyncio
+import logging
+import signal
+
+log = logging.getLogger("bot.lifecycle")
+
+
+class InFlightTracker:
+    """
+    Theo dõi các task đang xử lý (lệnh, giao key) để chờ chúng xong trước khi tắt
+    """
+
+    def __init__(self):
+        self.accepting = True
+        self._tasks = set()
+        self._abort = asyncio.Event()
+        self.rejected = 0
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def add(self, task: asyncio.Task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def track(self) -> bool:
+        """
+        Theo dõi task hiện tại; trả về False nếu đang tắt (không nhận việc mới)
+        """
+        if not self.accepting:
+            self.rejected += 1
+            return False
+        self.add(asyncio.current_task())
+        return True
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+        Chạy coroutine ở nền và chờ nó khi tắt (dùng cho việc không được bỏ dở)
+        """
+        return self.add(asyncio.create_task(coro))
+
+    def stop_accepting(self):
+        self.accepting = False
+
+    def abort_drain(self):
+        """
+        Không chờ nữa (vd. nhận tín hiệu tắt lần thứ hai)
+        """
+        self._abort.set()
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Chờ các task đang chạy xong, tối đa timeout giây.
+        Task mới được thêm trong lúc chờ (vd. lệnh tạo task giao key) cũng được chờ.
+        Trả về số task chưa xong.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        current = asyncio.current_task()
+        while not self._abort.is_set():
+            tasks = self._tasks - {current}
+            remaining = deadline - loop.time()
+            if not tasks or remaining <= 0:
+                break
+            abort = asyncio.ensure_future(self._abort.wait())
+            try:
+                await asyncio.wait(tasks | {abort}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                abort.cancel()
+        return len(self._tasks - {current})
+
+    async def cancel(self) -> int:
+        """
+        Huỷ các task còn chạy và chờ chúng kết thúc, trả về số task bị huỷ
+        """
+        tasks = [task for task in self._tasks if task is not asyncio.current_task() and not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+
+def install_signal_handlers(callback, signals=(signal.SIGTERM, signal.SIGINT)) -> bool:
+    """
+    Gọi callback(sig) khi process nhận tín hiệu tắt.
+    Trả về False nếu event loop không hỗ trợ (Windows).
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        for sig in signals:
+            loop.add_signal_handler(sig, callback, sig)
+    except (NotImplementedError, RuntimeError):
+        return False
+    return True
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+
+import discord
+
+log = logging.getLogger("bot.members")
+
+# Chế độ cache member:
+# off     - không cần intent members, kiểm tra role từ dữ liệu member của interaction
+# lazy    - tải (chunk) member của guild ở nền khi guild được dùng lần đầu
+# startup - tải member của mọi guild ở nền ngay sau khi kết nối
+MODES = ("off", "lazy", "startup")
+
+
+class MemberCache:
+    """
+    Cache member và chỉ mục những ai đang có một role (CUSTOMER_ROLE_ID).
+    - Chỉ mục được dựng từ cache member của discord.py sau khi chunk guild và
+      cập nhật qua các event member_update / member_join / member_remove, nên
+      kiểm tra "đã có role chưa" là tra set O(1), không cần gọi API
+    - Khi member chưa có trong cache thì fetch một lần, đồng thời chunk guild ở nền
+    Các chế độ lazy / startup cần bật Server Members Intent trong Developer Portal.
+    """
+
+    def __init__(self, client: discord.Client, role_id: int, *, mode: str = "off"):
+        if mode not in MODES:
+            raise ValueError(f"MEMBER_CACHE không hợp lệ: {mode}")
+        self.client = client
+        self.role_id = role_id
+        self.mode = mode
+        # guild_id -> set user_id đang có role; chỉ có sau khi guild đã được chunk
+        self._holders = {}
+        self._chunking = {}
+        self.hits = 0
+        self.fetches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @staticmethod
+    def configure_intents(intents: discord.Intents, mode: str) -> discord.Intents:
+        """
+        Bật intent members khi cần cache member
+        """
+        if mode != "off":
+            intents.members = True
+        return intents
+
+    def holders(self) -> int:
+        return sum(len(users) for users in self._holders.values())
+
+    def role(self, guild: discord.Guild):
+        return guild.get_role(self.role_id)
+
+    def _index(self, guild: discord.Guild):
+        role = self.role(guild)
+        if role is None:
+            self._holders.pop(guild.id, None)
+            return
+        self._holders[guild.id] = {member.id for member in role.members}
+        log.info("Đã dựng chỉ mục role", extra={"guild_id": guild.id, "holders": len(self._holders[guild.id])})
+
+    async def _chunk(self, guild: discord.Guild):
+        try:
+            if not guild.chunked:
+                await guild.chunk()
+            self._index(guild)
+        except Exception:
+            log.exception("Error chunking guild members", extra={"guild_id": guild.id})
+        finally:
+            self._chunking.pop(guild.id, None)
+
+    def ensure_chunked(self, guild: discord.Guild):
+        """
+        Tải member của guild ở nền (một lần), trả về task hoặc None nếu không cần
+        """
+        if not self.enabled or guild.id in self._holders:
+            return None
+        task = self._chunking.get(guild.id)
+        if task is None:
+            task = self._chunking[guild.id] = asyncio.create_task(self._chunk(guild))
+        return task
+
+    async def warm_up(self):
+        """
+        Chế độ startup: tải member lần lượt từng guild có role (chạy nền sau khi ready)
+        """
+        if self.mode != "startup":
+            return
+        await self.client.wait_until_ready()
+        for guild in list(self.client.guilds):
+            if self.role(guild) is not None:
+                task = self.ensure_chunked(guild)
+                if task is not None:
+                    await task
+
+    async def get_member(self, guild: discord.Guild, user_id: int):
+        """
+        Lấy member từ cache; chưa có thì fetch (và chunk guild ở nền nếu đang bật cache)
+        """
+        member = guild.get_member(user_id)
+        if member is not None:
+            self.hits += 1
+            return member
+        if self.mode == "lazy" and self.role(guild) is not None:
+            self.ensure_chunked(guild)
+        self.fetches += 1
+        try:
+            return await guild.fetch_member(user_id)
+        except discord.NotFound:
+            return None
+
+    def has_role(self, member: discord.Member) -> bool:
+        holders = self._holders.get(member.guild.id)
+        if holders is not None:
+            return member.id in holders
+        return member.get_role(self.role_id) is not None
+
+    def mark(self, member: discord.Member):
+        """
+        Ghi nhận member vừa được thêm role (trước khi event member_update tới)
+        """
+        holders = self._holders.get(member.guild.id)
+        if holders is not None:
+            holders.add(member.id)
+
+    # Các hàm dưới đây được gọi từ event gateway của client
+
+    def on_guild_available(self, guild: discord.Guild):
+        if self.enabled and guild.chunked:
+            self._index(guild)
+
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        holders = self._holders.get(after.guild.id)
+        if holders is None:
+            return
+        if after.get_role(self.role_id) is not None:
+            holders.add(after.id)
+        else:
+            holders.discard(after.id)
+
+    def on_member_join(self, member: discord.Member):
+        self.on_member_update(member, member)
+
+    def on_member_remove(self, member: discord.Member):
+        holders = self._holders.get(member.guild.id)
+        if holders is not None:
+            holders.discard(member.id)
+
+    def on_guild_role_delete(self, role: discord.Role):
+        if role.id == self.role_id:
+            self._holders.pop(role.guild.id, None)
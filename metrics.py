@@ -0,0 +1,282 @@
+"""
+Số liệu vận hành dạng Prometheus (text exposition format) cho bot.
+
+Không phụ thuộc prometheus_client: counter, gauge và histogram chỉ là dict
+trong bộ nhớ, được render thành text khi có request tới GET /metrics.
+"""
+import bisect
+import functools
+import logging
+import math
+import time
+
+from aiohttp import web
+
+# Mốc histogram (giây) cho lệnh Discord và request upstream
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+log = logging.getLogger("bot.metrics")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} cần các label {self.labelnames}, nhận được {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [số lần rơi vào từng mốc..., tổng, số lần]
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def samples(self):
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, hits in zip(self.buckets, state):
+                cumulative += hits
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f"{self.name}_bucket", labels, state[-1]
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), state[-1]
+
+
+class _Collected(_Metric):
+    """
+    Metric được tính lại mỗi lần scrape từ func() -> {tuple label: giá trị} hoặc một số
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, func, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if not isinstance(key, tuple):
+                key = (key,)
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class MetricsRegistry:
+    """
+    Tập hợp các metric; gọi lại counter()/histogram() cùng tên trả về metric đã có
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} đã được đăng ký với kiểu {metric.kind}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def collect(self, name: str, documentation: str, func, *, kind: str = "gauge", labelnames=()):
+        """
+        Đăng ký metric đọc từ trạng thái có sẵn (vd. thống kê cache) lúc scrape
+        """
+        self._metrics[name] = _Collected(name, documentation, kind, func, labelnames)
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                log.exception("Error collecting metric %s", name)
+                continue
+            lines.append(f"# HELP {name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def instrument_command(registry: MetricsRegistry):
+    """
+    Decorator đo thời gian xử lý slash command, đặt ngay dưới @bot.tree.command.
+    Nếu lệnh dùng defer() bên dưới thì đo thêm thời gian tới lúc defer và từ
+    lúc defer tới khi gửi xong followup.
+    """
+    duration = registry.histogram(
+        "discord_command_duration_seconds", "Thời gian xử lý slash command", ("command", "status")
+    )
+    defer_latency = registry.histogram(
+        "discord_command_defer_seconds", "Thời gian từ lúc nhận lệnh tới lúc defer", ("command",)
+    )
+    followup_latency = registry.histogram(
+        "discord_command_followup_seconds", "Thời gian từ lúc defer tới khi gửi xong followup", ("command",)
+    )
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction, *args, **kwargs):
+            started = time.perf_counter()
+            interaction.extras["started_at"] = started
+            status = "ok"
+            try:
+                return await func(interaction, *args, **kwargs)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                finished = time.perf_counter()
+                command = interaction.command.name if interaction.command else func.__name__
+                if interaction.command_failed:
+                    status = "error"
+                duration.observe(finished - started, command=command, status=status)
+                deferred = interaction.extras.get("deferred_at")
+                if deferred is not None:
+                    defer_latency.observe(deferred - started, command=command)
+                    followup_latency.observe(finished - deferred, command=command)
+
+        return wrapper
+
+    return decorator
+
+
+async def defer(interaction, **kwargs):
+    """
+    interaction.response.defer() có ghi lại thời điểm defer cho instrument_command
+    """
+    interaction.extras["deferred_at"] = time.perf_counter()
+    await interaction.response.defer(**kwargs)
+
+
+class RateLimitLogHandler(logging.Handler):
+    """
+    Đếm số lần và tổng thời gian chờ khi Discord trả về 429.
+    discord.py không có event cho rate limit nên đọc từ log của logger "discord.http".
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        super().__init__(logging.WARNING)
+        self.hits = registry.counter(
+            "discord_rate_limited_total", "Số lần bị Discord rate limit", ("scope",)
+        )
+        self.waits = registry.counter(
+            "discord_rate_limit_wait_seconds_total", "Tổng thời gian chờ do Discord rate limit", ("scope",)
+        )
+
+    def emit(self, record):
+        message = record.msg if isinstance(record.msg, str) else ""
+        if message.startswith("We are being rate limited"):
+            scope = "route"
+        elif message.startswith("Global rate limit has been hit"):
+            scope = "global"
+        else:
+            return
+        self.hits.inc(scope=scope)
+        if record.args and isinstance(record.args[-1], (int, float)):
+            self.waits.inc(float(record.args[-1]), scope=scope)
+
+    def install(self, logger_name: str = "discord.http"):
+        logger = logging.getLogger(logger_name)
+        logger.addHandler(self)
+        if logger.getEffectiveLevel() > logging.WARNING:
+            logger.setLevel(logging.WARNING)
+        return self
+
+
+def create_metrics_app(registry: MetricsRegistry, app: web.Application = None) -> web.Application:
+    """
+    Thêm endpoint GET /metrics
+    """
+    async def handler(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = app or web.Application()
+    app.router.add_get("/metrics", handler)
+    return app
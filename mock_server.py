@@ -0,0 +1,181 @@
+"""
+Server giả lập api.autoit.pro để chạy thử bot và benchmark mà không gọi API thật.
+
+Chạy độc lập:
+    python mock_server.py --port 8080 --latency 0.05 --error-rate 0.1
+rồi đặt API_BASE_URL=http://127.0.0.1:8080/API khi chạy bot.
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+# Các dạng phản hồi của api.php mà mock hỗ trợ
+SHAPES = ("ok", "expired", "not_activated", "string_error", "non_json", "server_error")
+
+
+def parse_shapes(text: str) -> dict:
+    """
+    Đọc trọng số dạng "ok=8,not_activated=1,non_json=1"
+    """
+    shapes = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SHAPES:
+            raise ValueError(f"Dạng phản hồi không hợp lệ: {name}")
+        shapes[name] = float(weight or 1)
+    return shapes
+
+
+class MockKeyAPI:
+    """
+    Logic giả lập của api.php và addtime.php.
+    - latency / latency_jitter: độ trễ mỗi request (giây)
+    - error_rate: tỉ lệ trả về HTTP 500
+    - shapes: trọng số các dạng phản hồi của api.php
+    Key có dạng "<shape>-..." (vd. "non_json-123") luôn trả về đúng dạng đó.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        shapes: dict = None,
+        days: int = 30,
+        seed: int = None,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.shapes = shapes or {"ok": 1}
+        self.days = days
+        self.random = random.Random(seed)
+        # Số giờ đã cộng cho từng tài khoản qua addtime.php
+        self.added_hours = {}
+        self.requests = {"api.php": 0, "addtime.php": 0}
+
+    def _pick_shape(self, key: str) -> str:
+        prefix = key.split("-", 1)[0]
+        if prefix in SHAPES:
+            return prefix
+        names = list(self.shapes)
+        return self.random.choices(names, weights=[self.shapes[n] for n in names])[0]
+
+    async def _delay(self):
+        delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def handle(self, endpoint: str, params: dict):
+        """
+        Xử lý một request, trả về (mã HTTP, nội dung)
+        """
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        await self._delay()
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 500, "Internal Server Error"
+        if endpoint == "api.php":
+            return self._check(params.get("TK", ""))
+        if endpoint == "addtime.php":
+            return self._addtime(params.get("TK", ""), params.get("SOGIO", "0"))
+        return 404, "Not Found"
+
+    def _check(self, key: str):
+        shape = self._pick_shape(key)
+        seconds = self.days * 24 * 3600 + int(self.added_hours.get(key, 0)) * 3600
+        if shape == "ok":
+            return 200, json.dumps({"error": 0, "message": "OK", "data": seconds})
+        if shape == "expired":
+            return 200, json.dumps({"error": 1, "message": "Expired", "data": 0})
+        if shape == "not_activated":
+            return 200, json.dumps({"error": 2, "message": "Not activated", "data": 0})
+        if shape == "string_error":
+            return 200, json.dumps({"error": "0", "message": "OK", "data": str(seconds)})
+        if shape == "non_json":
+            return 200, "<html><body>Service temporarily unavailable</body></html>"
+        return 500, "Internal Server Error"
+
+    def _addtime(self, account: str, hours: str):
+        try:
+            hours = int(hours)
+        except ValueError:
+            return 200, json.dumps({"error": 1, "message": "Invalid hours"})
+        self.added_hours[account] = self.added_hours.get(account, 0) + hours
+        return 200, json.dumps({"error": 0, "message": "OK"})
+
+
+class MockTransport:
+    """
+    Transport gọi thẳng MockKeyAPI trong cùng process (không qua socket)
+    """
+
+    def __init__(self, mock: MockKeyAPI):
+        self.mock = mock
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get(self, url: str, params: dict, headers: dict = None):
+        endpoint = url.rsplit("/", 1)[-1]
+        return await self.mock.handle(endpoint, params)
+
+
+def create_app(mock: MockKeyAPI) -> web.Application:
+    """
+    Tạo aiohttp app phục vụ /API/api.php và /API/addtime.php
+    """
+    async def handler(request):
+        status, body = await mock.handle(request.match_info["endpoint"], dict(request.query))
+        return web.Response(status=status, text=body, content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/API/{endpoint}", handler)
+    return app
+
+
+async def start_server(mock: MockKeyAPI, host: str = "127.0.0.1", port: int = 0):
+    """
+    Chạy server giả lập, trả về (runner, base_url). Gọi runner.cleanup() để dừng.
+    """
+    runner = web.AppRunner(create_app(mock), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/API"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập api.autoit.pro")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--shapes", default="ok=1", help="vd. ok=8,not_activated=1,non_json=1")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    mock = MockKeyAPI(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        shapes=parse_shapes(args.shapes),
+        seed=args.seed,
+    )
+    print(f"Mock API đang chạy tại http://{args.host}:{args.port}/API")
+    web.run_app(create_app(mock), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Bảng giá cho /thanhtoan, đọc từ file JSON (PRICING_FILE).
+
+File có dạng:
+
+    {
+        "default_product": "default",
+        "products": {
+            "default": {
+                "name": "Key",
+                "unit_price": 250000,
+                "min_quantity": 5,
+                "max_quantity": 500,
+                "tiers": [
+                    {"min_quantity": 20, "unit_price": 230000},
+                    {"min_quantity": 50, "unit_price": 210000}
+                ]
+            }
+        },
+        "promo_codes": {
+            "TET10": {"percent": 10, "products": ["default"], "min_quantity": 10, "expires": "2026-02-28"},
+            "GIAM50K": {"amount": 50000}
+        }
+    }
+
+Tên sản phẩm trùng với cột product của kho key. Đơn giá theo từng số lượng
+được tính sẵn khi nạp file nên mỗi lần báo giá chỉ là vài lần tra list / dict.
+File được nạp lại khi thay đổi, không cần khởi động lại bot; file lỗi thì
+giữ nguyên bảng giá đang dùng.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+log = logging.getLogger("bot.pricing")
+
+DEFAULT_PRODUCT = "default"
+# min_quantity lớn nhất của một bậc giá (list đơn giá tính sẵn dài bằng số này)
+MAX_TIER_QUANTITY = 10000
+
+# Bảng giá khi không có file cấu hình (giữ nguyên giá cũ)
+DEFAULT_PRICING = {
+    "default_product": DEFAULT_PRODUCT,
+    "products": {
+        DEFAULT_PRODUCT: {"name": "Key", "unit_price": 250000, "min_quantity": 5},
+    },
+    "promo_codes": {},
+}
+
+
+class PricingError(ValueError):
+    """
+    Lỗi báo giá (sản phẩm / số lượng / mã giảm giá không hợp lệ), message hiển thị cho người dùng
+    """
+
+
+def _positive_int(value, field: str, *, allow_zero: bool = False) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or int(value) != value:
+        raise ValueError(f"{field} phải là số nguyên")
+    value = int(value)
+    if value < 0 or (value == 0 and not allow_zero):
+        raise ValueError(f"{field} phải lớn hơn 0")
+    return value
+
+
+def _mapping(value, field: str) -> dict:
+    if not isinstance(value, dict):
+        raise ValueError(f"{field} phải là object")
+    return value
+
+
+def _parse_expires(value, field: str):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"{field}: ngày hết hạn không hợp lệ ({value})") from None
+    if len(str(value)) <= 10:
+        # Chỉ có ngày thì mã dùng được hết ngày đó
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    return parsed.timestamp()
+
+
+class PriceTable:
+    """
+    Bảng giá đã kiểm tra và tính sẵn.
+    Với mỗi sản phẩm, _unit_prices[q] là đơn giá khi mua q key, tính tới mức
+    số lượng của bậc giá cuối; mua nhiều hơn thì dùng đơn giá của bậc cuối.
+    """
+
+    def __init__(self, config: dict):
+        if not isinstance(config, dict) or not isinstance(config.get("products"), dict) or not config["products"]:
+            raise ValueError("Bảng giá phải có ít nhất một sản phẩm trong 'products'")
+        self.products = {}
+        self._unit_prices = {}
+        for sku, product in config["products"].items():
+            self._add_product(str(sku), _mapping(product, f"products.{sku}"))
+        self.default_product = str(config.get("default_product") or next(iter(self.products)))
+        if self.default_product not in self.products:
+            raise ValueError(f"default_product '{self.default_product}' không có trong 'products'")
+        self.promo_codes = {}
+        for code, promo in _mapping(config.get("promo_codes") or {}, "promo_codes").items():
+            self._add_promo(str(code), _mapping(promo, f"promo_codes.{code}"))
+
+    def _add_product(self, sku: str, product: dict):
+        field = f"products.{sku}"
+        unit_price = _positive_int(product.get("unit_price"), f"{field}.unit_price")
+        min_quantity = _positive_int(product.get("min_quantity", 1), f"{field}.min_quantity")
+        max_quantity = product.get("max_quantity")
+        if max_quantity is not None:
+            max_quantity = _positive_int(max_quantity, f"{field}.max_quantity")
+            if max_quantity < min_quantity:
+                raise ValueError(f"{field}.max_quantity nhỏ hơn min_quantity")
+        raw_tiers = product.get("tiers") or []
+        if not isinstance(raw_tiers, list):
+            raise ValueError(f"{field}.tiers phải là list")
+        tiers = sorted(
+            (
+                (_positive_int(tier.get("min_quantity"), f"{field}.tiers.min_quantity"),
+                 _positive_int(tier.get("unit_price"), f"{field}.tiers.unit_price"))
+                for tier in (_mapping(tier, f"{field}.tiers") for tier in raw_tiers)
+            )
+        )
+        if tiers and tiers[-1][0] > MAX_TIER_QUANTITY:
+            raise ValueError(f"{field}.tiers.min_quantity tối đa là {MAX_TIER_QUANTITY}")
+        # Đơn giá theo số lượng, từ 0 tới bậc cuối
+        last = tiers[-1][0] if tiers else 0
+        prices = [unit_price] * (last + 1)
+        for tier_min, tier_price in tiers:
+            prices[tier_min:] = [tier_price] * (last + 1 - tier_min)
+        self._unit_prices[sku] = prices
+        self.products[sku] = {
+            "sku": sku,
+            "name": str(product.get("name") or sku),
+            "unit_price": unit_price,
+            "min_quantity": min_quantity,
+            "max_quantity": max_quantity,
+            "tiers": tiers,
+        }
+
+    def _add_promo(self, code: str, promo: dict):
+        field = f"promo_codes.{code}"
+        if ("percent" in promo) == ("amount" in promo):
+            raise ValueError(f"{field} phải có đúng một trong 'percent' hoặc 'amount'")
+        percent = promo.get("percent")
+        if percent is not None:
+            percent = _positive_int(percent, f"{field}.percent")
+            if percent >= 100:
+                raise ValueError(f"{field}.percent phải nhỏ hơn 100")
+        products = promo.get("products")
+        if products is not None:
+            if not isinstance(products, list):
+                raise ValueError(f"{field}.products phải là list")
+            products = frozenset(str(sku) for sku in products)
+            unknown = products - self.products.keys()
+            if unknown:
+                raise ValueError(f"{field}.products có sản phẩm không tồn tại: {', '.join(sorted(unknown))}")
+        self.promo_codes[code.strip().upper()] = {
+            "code": code.strip().upper(),
+            "percent": percent,
+            "amount": _positive_int(promo["amount"], f"{field}.amount") if percent is None else None,
+            "products": products,
+            "min_quantity": _positive_int(promo.get("min_quantity", 1), f"{field}.min_quantity"),
+            "expires_at": _parse_expires(promo.get("expires"), field),
+        }
+
+    def unit_price(self, sku: str, quantity: int) -> int:
+        prices = self._unit_prices[sku]
+        return prices[min(quantity, len(prices) - 1)]
+
+    def quote(self, quantity: int, product: str = None, promo_code: str = None) -> dict:
+        """
+        Báo giá một đơn, trả về chi tiết (đơn giá gốc, giảm giá theo số lượng,
+        mã giảm giá, tổng tiền). Raise PricingError nếu đơn không hợp lệ.
+        """
+        sku = product or self.default_product
+        info = self.products.get(sku)
+        if info is None:
+            raise PricingError(f"Sản phẩm `{sku}` không tồn tại!")
+        if quantity < info["min_quantity"]:
+            raise PricingError(f"Số lượng key phải lớn hơn hoặc bằng {info['min_quantity']}!")
+        if info["max_quantity"] is not None and quantity > info["max_quantity"]:
+            raise PricingError(f"Số lượng key tối đa cho một đơn là {info['max_quantity']}!")
+
+        unit_price = self.unit_price(sku, quantity)
+        subtotal = info["unit_price"] * quantity
+        total = unit_price * quantity
+        promo = None
+        promo_discount = 0
+        if promo_code:
+            promo = self.promo_codes.get(promo_code.strip().upper())
+            if promo is None or (promo["expires_at"] is not None and promo["expires_at"] < time.time()):
+                raise PricingError(f"Mã giảm giá `{promo_code}` không hợp lệ hoặc đã hết hạn!")
+            if promo["products"] is not None and sku not in promo["products"]:
+                raise PricingError(f"Mã giảm giá `{promo['code']}` không áp dụng cho sản phẩm này!")
+            if quantity < promo["min_quantity"]:
+                raise PricingError(f"Mã giảm giá `{promo['code']}` cần mua tối thiểu {promo['min_quantity']} key!")
+            if promo["percent"] is not None:
+                promo_discount = total * promo["percent"] // 100
+            else:
+                promo_discount = promo["amount"]
+            # Luôn còn tiền phải trả để mã QR là mã động có số tiền
+            promo_discount = min(promo_discount, total - 1)
+            total -= promo_discount
+
+        return {
+            "product": sku,
+            "name": info["name"],
+            "quantity": quantity,
+            "base_unit_price": info["unit_price"],
+            "unit_price": unit_price,
+            "subtotal": subtotal,
+            "volume_discount": subtotal - unit_price * quantity,
+            "promo_code": promo["code"] if promo else None,
+            "promo_discount": promo_discount,
+            "total": total,
+        }
+
+    def describe(self, sku: str) -> str:
+        """
+        Mô tả bảng giá một sản phẩm, mỗi bậc một dòng
+        """
+        info = self.products[sku]
+        lines = [f"Từ {info['min_quantity']} key: **{info['unit_price']:,}** VNĐ/key"]
+        lines.extend(f"Từ {tier_min} key: **{tier_price:,}** VNĐ/key" for tier_min, tier_price in info["tiers"])
+        if info["max_quantity"] is not None:
+            lines.append(f"Tối đa {info['max_quantity']} key / đơn")
+        return "\n".join(lines)
+
+
+class PricingConfig:
+    """
+    Giữ bảng giá hiện hành và nạp lại khi file cấu hình thay đổi.
+    Không có file thì dùng DEFAULT_PRICING.
+    """
+
+    def __init__(self, path: str = None, *, reload_interval: float = 30):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.table = PriceTable(DEFAULT_PRICING)
+        self._signature = None
+        self.reloads = 0
+        self.reload_errors = 0
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read(self):
+        with open(self.path, encoding="utf-8-sig") as f:
+            return PriceTable(json.load(f))
+
+    async def reload(self, *, force: bool = False) -> bool:
+        """
+        Nạp lại file nếu đã thay đổi, trả về True nếu bảng giá được thay.
+        File lỗi thì giữ bảng giá cũ và raise lỗi.
+        """
+        if not self.path:
+            return False
+        signature = await asyncio.to_thread(self._stat)
+        if signature == self._signature and not force:
+            return False
+        if signature is None:
+            self.table = PriceTable(DEFAULT_PRICING)
+            self._signature = None
+            log.warning("Không có file bảng giá, dùng giá mặc định", extra={"path": self.path})
+            return True
+        try:
+            table = await asyncio.to_thread(self._read)
+        except (OSError, ValueError) as e:
+            # Không nạp lại file lỗi cho tới khi file đổi tiếp
+            self._signature = signature
+            self.reload_errors += 1
+            raise ValueError(f"{self.path}: {e}") from e
+        self.table = table
+        self._signature = signature
+        self.reloads += 1
+        log.info("Đã nạp bảng giá", extra={"path": self.path, "products": list(table.products)})
+        return True
+
+    def quote(self, quantity: int, product: str = None, promo_code: str = None) -> dict:
+        return self.table.quote(quantity, product, promo_code)
+
+    async def watch(self):
+        """
+        Task nền kiểm tra file bảng giá mỗi reload_interval giây
+        """
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except ValueError as e:
+                log.error("Bảng giá mới không hợp lệ, giữ bảng giá cũ: %s", e)
+            except Exception:
+                # Lỗi ngoài dự kiến không được làm dừng task theo dõi file
+                log.exception("Lỗi khi nạp lại bảng giá, giữ bảng giá cũ")
@@ -6,7 +6,34 @@ from urllib.parse import quote
 import requests
 from datetime import datetime
 import asyncio
-import aiohttp  # Thêm import aiohttp cho async requests
+import functools
+import hashlib
+import io
+import json
+import logging
+import math
+import time
+from aiohttp import web
+from key_api import KeyAPIClient, DEFAULT_BASE_URL
+from key_cache import KeyStatusCache
+from batch import BatchExecutor, CommandRateLimiter, FairScheduler, HostRateLimiter, SharedRateLimiter, request_flow
+from resilience import RetryPolicy
+from storage import BotStore
+from audit_log import AuditLogWriter
+from vietqr import VietQRRenderer
+from reconcile import PaymentReconciler, create_webhook_app, iter_statement_bytes, order_memo
+from inventory import KeyImportError, KeyInventory, OutOfStockError
+from pricing import PricingConfig, PricingError
+from sweeper import ExpirySweeper
+from member_cache import MemberCache
+from lifecycle import InFlightTracker, install_signal_handlers
+from diagnostics import WINDOWS, RuntimeSampler
+from addtime_journal import AddTimeJournal
+from bulk import BulkReader, CsvReport, iter_batches, iter_url_chunks, parse_deliveries
+from report import MAX_FIELD_CHARS, ReportBuilder, pack_lines, send_report
+from metrics import MetricsRegistry, RateLimitLogHandler, create_metrics_app, defer, instrument_command
+from bot_logging import correlation_id, setup_logging
+from state import create_state_backend
 
 # Load environment variables
 load_dotenv()
@@ -19,12 +46,146 @@ ACCOUNT_NAME = os.getenv('ACCOUNT_NAME')
 # Thêm API_KEY cho lệnh addtime
 API_KEY = os.getenv('API_KEY')
 
+# Cấu hình connection pool dùng chung cho api.autoit.pro
+API_BASE_URL = os.getenv('API_BASE_URL', DEFAULT_BASE_URL)
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', '10'))
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '5'))
+API_LIMIT_PER_HOST = int(os.getenv('API_LIMIT_PER_HOST', '30'))
+API_DNS_TTL = int(os.getenv('API_DNS_TTL', '300'))
+
+# Cấu hình cache trạng thái key (TTL tính bằng giây)
+CACHE_TTL_ACTIVE = float(os.getenv('CACHE_TTL_ACTIVE', '300'))
+CACHE_TTL_INACTIVE = float(os.getenv('CACHE_TTL_INACTIVE', '300'))
+CACHE_TTL_NOT_ACTIVATED = float(os.getenv('CACHE_TTL_NOT_ACTIVATED', '60'))
+CACHE_TTL_ERROR = float(os.getenv('CACHE_TTL_ERROR', '5'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+
+# Cấu hình xử lý hàng loạt
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '20'))
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', '20'))  # request/giây cho mỗi host
+API_RATE_BURST = float(os.getenv('API_RATE_BURST', '40'))
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '300'))
+# Giới hạn lệnh theo user / guild: token/giây và burst, mỗi key tốn một token (0 = tắt)
+USER_RATE_LIMIT = float(os.getenv('USER_RATE_LIMIT', '2'))
+USER_RATE_BURST = float(os.getenv('USER_RATE_BURST', '300'))
+GUILD_RATE_LIMIT = float(os.getenv('GUILD_RATE_LIMIT', '20'))
+GUILD_RATE_BURST = float(os.getenv('GUILD_RATE_BURST', '1500'))
+# Trọng số của admin khi chia slot gọi upstream (user thường là 1)
+ADMIN_FLOW_WEIGHT = int(os.getenv('ADMIN_FLOW_WEIGHT', '4'))
+# Cấu hình retry và circuit breaker cho upstream
+API_RETRY_ATTEMPTS = int(os.getenv('API_RETRY_ATTEMPTS', '3'))
+API_RETRY_BASE_DELAY = float(os.getenv('API_RETRY_BASE_DELAY', '0.5'))
+API_RETRY_MAX_DELAY = float(os.getenv('API_RETRY_MAX_DELAY', '5'))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+# Cấu hình cơ sở dữ liệu SQLite
+DB_PATH = os.getenv('DB_PATH', 'bot.db')
+DB_FLUSH_INTERVAL = float(os.getenv('DB_FLUSH_INTERVAL', '1'))
+# Cấu hình ghi log vào channel (gom nhiều log thành một tin nhắn)
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '2'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '1000'))
+# Số ảnh QR giữ trong cache
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '256'))
+# Cấu hình đối soát thanh toán
+ORDER_TTL_HOURS = float(os.getenv('ORDER_TTL_HOURS', '24'))
+# Bảng giá /thanhtoan (JSON), được nạp lại khi file thay đổi
+PRICING_FILE = os.getenv('PRICING_FILE', 'pricing.json')
+PRICING_RELOAD_INTERVAL = float(os.getenv('PRICING_RELOAD_INTERVAL', '30'))
+# Header X-Webhook-Secret của webhook ngân hàng; không đặt thì không mở /bank/webhook
+BANK_WEBHOOK_SECRET = os.getenv('BANK_WEBHOOK_SECRET')
+# Tự động giao key từ kho khi đơn được thanh toán
+AUTO_DELIVERY = os.getenv('AUTO_DELIVERY', '1') == '1'
+DELIVERY_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', '5'))
+# Cache member / chỉ mục role khách hàng: off, lazy hoặc startup (cần Server Members Intent)
+MEMBER_CACHE = os.getenv('MEMBER_CACHE', 'off')
+# Cấu hình task nền kiểm tra key sắp hết hạn
+SWEEP_ENABLED = os.getenv('SWEEP_ENABLED', '1') == '1'
+SWEEP_INTERVAL = float(os.getenv('SWEEP_INTERVAL', '60'))
+SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', '200'))
+SWEEP_CONCURRENCY = int(os.getenv('SWEEP_CONCURRENCY', '3'))
+SWEEP_RATE = float(os.getenv('SWEEP_RATE', '2'))  # request/giây
+REMIND_DAYS = tuple(int(d) for d in os.getenv('REMIND_DAYS', '3,1').split(','))
+# Bỏ qua tài khoản vừa được /addtime cùng số giờ trong khoảng này (giây), tránh cộng giờ hai lần
+ADDTIME_DEDUP_WINDOW = float(os.getenv('ADDTIME_DEDUP_WINDOW', '600'))
+# Dòng journal /addtime của process khác chỉ được khôi phục sau khoảng này (giây) không thay đổi
+ADDTIME_RECOVER_AFTER = float(os.getenv('ADDTIME_RECOVER_AFTER', '3600'))
+# Thời gian tối đa chờ lệnh đang chạy xong khi nhận SIGTERM (nên nhỏ hơn hạn
+# kill của nền tảng deploy, vd. 30 giây)
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '25'))
+# Cổng HTTP nội bộ (webhook ngân hàng, /metrics), 0 = tắt. Khi chạy nhiều
+# process, chỉ process chính mở webhook tại HTTP_PORT; process khác chỉ có
+# /metrics tại HTTP_PORT + shard nhỏ nhất của nó
+HTTP_HOST = os.getenv('HTTP_HOST', '127.0.0.1')
+HTTP_PORT = int(os.getenv('HTTP_PORT', '0'))
+# Chu kỳ (giây) cập nhật tiến độ khi /check nhiều key
+CHECK_PROGRESS_INTERVAL = float(os.getenv('CHECK_PROGRESS_INTERVAL', '1.5'))
+
+# Chế độ hàng loạt qua file đính kèm của /check và /addtime
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '50000'))
+BULK_MAX_FILE_SIZE = int(os.getenv('BULK_MAX_FILE_SIZE', str(5 * 1024 * 1024)))
+BULK_ADDTIME_CHUNK = int(os.getenv('BULK_ADDTIME_CHUNK', '200'))
+# Token của interaction hết hạn sau 15 phút; quá mốc này thì kết quả được gửi qua DM
+INTERACTION_TOKEN_SAFE_SECONDS = float(os.getenv('INTERACTION_TOKEN_SAFE_SECONDS', '840'))
+# Chẩn đoán cho /status: chu kỳ lấy mẫu event loop / RSS và độ dài mỗi khoảng
+# (giây) khi gom request theo endpoint
+DIAG_SAMPLE_INTERVAL = float(os.getenv('DIAG_SAMPLE_INTERVAL', '1'))
+DIAG_LATENCY_BUCKET = float(os.getenv('DIAG_LATENCY_BUCKET', '10'))
+# Sync lệnh: SYNC_GUILD_ID = sync vào một guild (có hiệu lực ngay) thay vì global,
+# FORCE_SYNC=1 = luôn sync kể cả khi định nghĩa lệnh không đổi.
+# Hai chế độ loại trừ nhau: đổi chế độ thì lệnh ở phạm vi cũ bị xoá
+SYNC_GUILD_ID = int(os.getenv('SYNC_GUILD_ID', '0'))
+FORCE_SYNC = os.getenv('FORCE_SYNC', '0') == '1'
+# Cấu hình log: LOG_FORMAT=json (mặc định) hoặc text
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+
+
+def parse_shard_ids(value: str):
+    """
+    Đọc danh sách shard dạng "0-3" hoặc "0,2,4"
+    """
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            ids.append(int(part))
+    return ids or None
+
+
+# Sharding: AUTO_SHARD=1 để discord.py tự chia shard trong một process.
+# Chạy nhiều process thì mỗi process đặt cùng SHARD_COUNT và SHARD_IDS riêng (vd. "0-3")
+AUTO_SHARD = os.getenv('AUTO_SHARD', '0') == '1'
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or None
+SHARD_IDS = parse_shard_ids(os.getenv('SHARD_IDS', ''))
+if SHARD_IDS and not SHARD_COUNT:
+    raise ValueError("SHARD_IDS cần đặt kèm SHARD_COUNT")
+SHARDED = AUTO_SHARD or SHARD_COUNT is not None
+# Process giữ shard 0 (hoặc process duy nhất) chạy các task nền và sync lệnh
+IS_PRIMARY = SHARD_IDS is None or 0 in SHARD_IDS
+# Trạng thái dùng chung (cache key, rate limit, chống trùng):
+# memory = trong process, sqlite = chia sẻ qua DB_PATH giữa các process
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite' if SHARD_IDS else 'memory')
+
 # Thêm hằng số cho ROLE_ID
 CUSTOMER_ROLE_ID = 1334194617322831935
 
 # Thêm hằng số cho LOG_CHANNEL_ID
 LOG_CHANNEL_ID = 1336368295363874909
 
+# Mốc bắt đầu khởi động, dùng để log thời gian startup
+BOOT_STARTED = time.perf_counter()
+
+# Logger cho từng phần của bot
+log = logging.getLogger("bot")
+qr_log = logging.getLogger("bot.qr")
+check_log = logging.getLogger("bot.check")
+addtime_log = logging.getLogger("bot.addtime")
+role_log = logging.getLogger("bot.roles")
+delivery_log = logging.getLogger("bot.delivery")
+
 
 def generate_vietqr_content(amount: float, message: str = ""):
     """
@@ -41,55 +202,648 @@ def generate_vietqr_content(amount: float, message: str = ""):
         qr_url += f"&addInfo={encoded_message}"
     qr_url += f"&accountName={encoded_account_name}"
 
-    print(f"Generated QR URL: {qr_url}")  # For debugging
+    qr_log.debug("Generated QR URL: %s", qr_url)
     return qr_url
 
 
-class QRPaymentBot(discord.Client):
+class BotCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Mỗi interaction chạy trong task riêng nên correlation id này đi theo
+        # mọi log và request upstream của lệnh (kể cả các task con)
+        correlation_id.set(f"i-{interaction.id}")
+        if interaction.type is not discord.InteractionType.application_command:
+            return True
+        # Theo dõi task của lệnh để chờ nó xong khi tắt bot
+        if not self.client.lifecycle.track():
+            await interaction.response.send_message(
+                "🔄 Bot đang khởi động lại, vui lòng thử lại sau ít phút.", ephemeral=True
+            )
+            return False
+        log.info(
+            "Nhận lệnh /%s", (interaction.data or {}).get("name"),
+            extra={"user_id": interaction.user.id, "guild_id": interaction.guild_id},
+        )
+        return True
+
+
+class QRPaymentBot(discord.AutoShardedClient if SHARDED else discord.Client):
     def __init__(self):
-        intents = discord.Intents.default()
-        super().__init__(intents=intents)
-        self.tree = app_commands.CommandTree(self)
+        intents = MemberCache.configure_intents(discord.Intents.default(), MEMBER_CACHE)
+        shard_options = {}
+        if SHARD_COUNT:
+            shard_options["shard_count"] = SHARD_COUNT
+        if SHARD_IDS:
+            shard_options["shard_ids"] = SHARD_IDS
+        # Member được tải ở nền bởi MemberCache, không chặn on_ready
+        super().__init__(intents=intents, chunk_guilds_at_startup=False, **shard_options)
+        self.tree = BotCommandTree(self)
+        # Lệnh và task giao key đang chạy, được chờ xong khi tắt bot
+        self.lifecycle = InFlightTracker()
+        self._shutdown_task = None
+        # Độ trễ event loop, số task và RSS, giữ đủ mẫu cho cửa sổ dài nhất của /status
+        self.runtime = RuntimeSampler(
+            interval=DIAG_SAMPLE_INTERVAL, maxlen=int(max(WINDOWS) / DIAG_SAMPLE_INTERVAL) + 1
+        )
+        self.checks_in_flight = 0
+        # Cache member và chỉ mục ai đã có role khách hàng
+        self.members = MemberCache(self, CUSTOMER_ROLE_ID, mode=MEMBER_CACHE)
+        # Số liệu vận hành, xem tại GET /metrics trên HTTP_PORT
+        self.metrics = MetricsRegistry()
+        # Lưu lịch sử giao key, thêm giờ và trạng thái key
+        self.store = BotStore(DB_PATH, flush_interval=DB_FLUSH_INTERVAL)
+        # Trạng thái dùng chung giữa các shard / process
+        self.state = create_state_backend(STATE_BACKEND, self.store)
+        shared = self.state if self.state.shared else None
+        # Client API dùng chung, có thể thay bằng client trỏ tới server giả lập
+        self.api = KeyAPIClient(
+            API_BASE_URL,
+            API_KEY,
+            limit_per_host=API_LIMIT_PER_HOST,
+            dns_cache_ttl=API_DNS_TTL,
+            total_timeout=API_TIMEOUT,
+            connect_timeout=API_CONNECT_TIMEOUT,
+            rate_limiter=(
+                SharedRateLimiter(shared, API_RATE_LIMIT, API_RATE_BURST) if shared
+                else HostRateLimiter(API_RATE_LIMIT, API_RATE_BURST)
+            ),
+            retry_policy=RetryPolicy(API_RETRY_ATTEMPTS, API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY),
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT,
+            metrics=self.metrics,
+            latency_bucket=DIAG_LATENCY_BUCKET,
+        )
+        # Giới hạn số request đồng thời tới upstream cho mọi lệnh, chia đều
+        # giữa các user (admin được trọng số cao hơn)
+        self.scheduler = FairScheduler(BATCH_CONCURRENCY)
+        self.executor = BatchExecutor(BATCH_CONCURRENCY, scheduler=self.scheduler)
+        # Giới hạn tần suất lệnh theo user / guild
+        self.command_limiter = CommandRateLimiter(
+            self.state,
+            user_rate=USER_RATE_LIMIT,
+            user_burst=USER_RATE_BURST,
+            guild_rate=GUILD_RATE_LIMIT,
+            guild_burst=GUILD_RATE_BURST,
+        )
+        # Cache trạng thái key cho /check
+        self.key_cache = KeyStatusCache(
+            {
+                "active": CACHE_TTL_ACTIVE,
+                "inactive": CACHE_TTL_INACTIVE,
+                "not_activated": CACHE_TTL_NOT_ACTIVATED,
+                "error": CACHE_TTL_ERROR,
+            },
+            max_entries=CACHE_MAX_ENTRIES,
+            shared=shared,
+        )
+        # Tạo ảnh VietQR ngay trong bot thay vì phụ thuộc img.vietqr.io
+        self.qr_renderer = VietQRRenderer(BANK_ID, ACCOUNT_NO or "", cache_size=QR_CACHE_SIZE)
+        # Ghi log vào LOG_CHANNEL_ID ở nền
+        self.audit_log = AuditLogWriter(
+            self, LOG_CHANNEL_ID, flush_interval=LOG_FLUSH_INTERVAL, max_queue=LOG_QUEUE_SIZE
+        )
+        # Đối soát chuyển khoản với đơn /thanhtoan
+        self.reconciler = PaymentReconciler(
+            self.store, order_ttl=ORDER_TTL_HOURS * 3600, on_paid=self.on_order_paid, shared=shared
+        )
+        # Bảng giá /thanhtoan
+        self.pricing = PricingConfig(PRICING_FILE, reload_interval=PRICING_RELOAD_INTERVAL)
+        # Journal ghi trước cho /addtime (chống cộng giờ trùng, khôi phục sau khi crash)
+        # owner cố định theo SHARD_IDS để process khởi động lại nhận lại đúng dòng của mình
+        self.addtime_journal = AddTimeJournal(
+            self.store,
+            dedup_window=ADDTIME_DEDUP_WINDOW,
+            owner="shards:" + ",".join(map(str, SHARD_IDS)) if SHARD_IDS else "main",
+            recover_after=ADDTIME_RECOVER_AFTER,
+        )
+        # Kho key giao tự động
+        self.inventory = KeyInventory(self.store)
+        self.delivery_semaphore = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+        # Kiểm tra định kỳ các key đã giao và nhắc khách sắp hết hạn
+        self.sweeper = ExpirySweeper(
+            self.store,
+            lambda key: check_single_key(key),
+            self.remind_expiry,
+            interval=SWEEP_INTERVAL,
+            batch_size=SWEEP_BATCH_SIZE,
+            concurrency=SWEEP_CONCURRENCY,
+            rate=SWEEP_RATE,
+            remind_days=REMIND_DAYS,
+        )
+        # Webhook chỉ ở process chính (process chạy đối soát và giao key tự động)
+        self.web_app = create_webhook_app(self.reconciler, BANK_WEBHOOK_SECRET) if IS_PRIMARY else web.Application()
+        create_metrics_app(self.metrics, self.web_app)
+        self.register_metrics()
+        self._web_runner = None
+        self._background_tasks = []
+        self.setup_seconds = None
+        self.ready_seconds = None
+
+    def register_metrics(self):
+        """
+        Số liệu đọc từ trạng thái sẵn có của các thành phần, tính lúc scrape
+        """
+        m = self.metrics
+        m.collect("key_cache_entries", "Số key trong cache trạng thái", lambda: self.key_cache.stats()["size"])
+        m.collect(
+            "key_cache_lookups_total",
+            "Số lần tra cache trạng thái key theo kết quả",
+            lambda: {
+                "hit": self.key_cache.hits,
+                "miss": self.key_cache.misses,
+                "coalesced": self.key_cache.coalesced,
+                "shared": self.key_cache.shared_hits,
+            },
+            kind="counter",
+            labelnames=("result",),
+        )
+        m.collect("key_cache_evictions_total", "Số key bị loại khỏi cache", lambda: self.key_cache.evictions, kind="counter")
+        m.collect("key_cache_hit_ratio", "Tỉ lệ tra cache không phải gọi API", lambda: self.key_cache.stats()["hit_rate"])
+        m.collect(
+            "qr_cache_lookups_total",
+            "Số lần tra cache ảnh QR theo kết quả",
+            lambda: {"hit": self.qr_renderer.hits, "miss": self.qr_renderer.misses},
+            kind="counter",
+            labelnames=("result",),
+        )
+        m.collect("upstream_slots_active", "Số slot gọi upstream đang dùng", lambda: self.scheduler.active)
+        m.collect("upstream_slots_waiting", "Số request đang chờ slot gọi upstream", self.scheduler.waiting)
+        m.collect("member_cache_role_holders", "Số member có role khách hàng trong chỉ mục", self.members.holders)
+        m.collect(
+            "member_cache_lookups_total",
+            "Số lần tìm member theo kết quả",
+            lambda: {"hit": self.members.hits, "fetch": self.members.fetches},
+            kind="counter",
+            labelnames=("result",),
+        )
+        m.collect("audit_log_pending", "Số log đang chờ gửi vào LOG_CHANNEL_ID", self.audit_log.pending)
+        m.collect(
+            "pricing_reloads_total",
+            "Số lần nạp lại bảng giá theo kết quả",
+            lambda: {"ok": self.pricing.reloads, "error": self.pricing.reload_errors},
+            kind="counter",
+            labelnames=("result",),
+        )
+        m.collect("event_loop_lag_seconds", "Độ trễ event loop ở lần lấy mẫu gần nhất", lambda: self.runtime.lag)
+        m.collect("asyncio_tasks", "Số asyncio task đang tồn tại", lambda: self.runtime.tasks)
+        m.collect("process_resident_memory_bytes", "Bộ nhớ RSS của process", lambda: self.runtime.rss)
+        m.collect("key_checks_in_flight", "Số lần kiểm tra key đang chờ kết quả", lambda: self.checks_in_flight)
+        m.collect("commands_in_flight", "Số lệnh và task giao key đang chạy", self.lifecycle.in_flight)
+        m.collect("payment_orders_pending", "Số đơn /thanhtoan đang chờ thanh toán", self.reconciler.pending_count)
+        m.collect("sweeper_checked_total", "Số key đã được task nền kiểm tra lại", lambda: self.sweeper.checked, kind="counter")
+        m.collect("sweeper_reminders_total", "Số DM nhắc gia hạn đã gửi", lambda: self.sweeper.reminders, kind="counter")
+        m.collect(
+            "bot_startup_seconds",
+            "Thời gian từ lúc khởi động process tới khi sẵn sàng",
+            lambda: {"setup": self.setup_seconds or 0, "ready": self.ready_seconds or 0},
+            labelnames=("phase",),
+        )
+        m.collect(
+            "discord_gateway_latency_seconds",
+            "Độ trễ heartbeat tới gateway Discord",
+            lambda: self.latency if math.isfinite(self.latency) else 0,
+        )
+        # Rate limit của Discord chỉ xuất hiện trong log của discord.py
+        RateLimitLogHandler(m).install()
 
     async def setup_hook(self):
+        # SIGTERM / SIGINT: chờ lệnh đang chạy xong rồi mới tắt
+        if not install_signal_handlers(self.request_shutdown):
+            log.warning("Không cài được signal handler, tắt bot sẽ không chờ lệnh đang chạy")
+        self._background_tasks.append(asyncio.create_task(self.runtime.run()))
+        # Mở connection pool một lần cho cả vòng đời bot
+        await self.api.start()
+        await self.store.open()
+        self.audit_log.start()
+        await self.reconciler.load()
+        try:
+            await self.pricing.reload()
+        except ValueError as e:
+            log.error("Bảng giá không hợp lệ, dùng giá mặc định: %s", e)
+        # Mỗi process giữ bảng giá riêng nên process nào cũng theo dõi file
+        self._background_tasks.append(asyncio.create_task(self.pricing.watch()))
+        released = await self.inventory.release_stale()
+        if released:
+            log.info("Đã trả %d key bị giữ chỗ về kho", released)
+        # Mỗi process khôi phục dòng journal /addtime của chính nó
+        self._background_tasks.append(asyncio.create_task(self.resume_addtime()))
+        # Chỉ một process chạy task nền để không nhân số request upstream theo số shard
+        if IS_PRIMARY:
+            if AUTO_DELIVERY:
+                self._background_tasks.append(asyncio.create_task(self.resume_orders()))
+            self._background_tasks.append(asyncio.create_task(self.reconciler.run_expiry()))
+            if SWEEP_ENABLED:
+                self._background_tasks.append(asyncio.create_task(self.sweeper.run()))
+        # Mỗi process có cache member riêng nên process nào cũng tải member
+        if self.members.mode == "startup":
+            self._background_tasks.append(asyncio.create_task(self.members.warm_up()))
+        if HTTP_PORT:
+            # Các process chạy trên cùng máy (dùng chung DB_PATH) nên mỗi process một cổng
+            port = HTTP_PORT if IS_PRIMARY else HTTP_PORT + min(SHARD_IDS)
+            self._web_runner = web.AppRunner(self.web_app, access_log=None)
+            await self._web_runner.setup()
+            await web.TCPSite(self._web_runner, HTTP_HOST, port).start()
+            log.info(
+                "HTTP server (%s) đang chạy tại %s:%d",
+                "webhook, /metrics" if IS_PRIMARY else "/metrics", HTTP_HOST, port,
+            )
+        if IS_PRIMARY:
+            # Sync ở nền để không chặn việc kết nối gateway
+            self._background_tasks.append(asyncio.create_task(self.sync_commands()))
+        self.setup_seconds = time.perf_counter() - BOOT_STARTED
+        log.info("setup_hook xong sau %.2fs", self.setup_seconds)
+
+    def command_hash(self, guild=None) -> str:
+        """
+        Hash ổn định của định nghĩa các lệnh đã đăng ký
+        """
+        commands = sorted(
+            (command.to_dict() for command in self.tree.get_commands(guild=guild)),
+            key=lambda command: (command.get("type", 1), command["name"]),
+        )
+        payload = json.dumps(commands, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def sync_commands(self):
+        """
+        Chỉ sync lệnh với Discord khi định nghĩa lệnh thay đổi so với lần sync trước.
+        Sync vào SYNC_GUILD_ID và sync global loại trừ nhau: bật sync guild thì xoá
+        lệnh global (nếu không guild đó thấy mỗi lệnh hai lần), tắt thì xoá lệnh
+        của guild đã sync trước đó.
+        """
+        meta_key = f"command_sync_guild:{self.application_id}"
+        previous = int(await self.store.get_meta(meta_key) or 0)
+        if SYNC_GUILD_ID:
+            guild = discord.Object(id=SYNC_GUILD_ID)
+            # Lệnh của guild có hiệu lực ngay, không phải chờ lan truyền như lệnh global
+            self.tree.copy_global_to(guild=guild)
+            if not await self._sync_scope(guild):
+                return
+            # Bản copy trong guild vẫn nhận lệnh, chỉ bỏ tập lệnh global
+            self.tree.clear_commands(guild=None)
+            await self._sync_scope(None)
+        elif not await self._sync_scope(None):
+            return
+        if previous and previous != SYNC_GUILD_ID:
+            # Tree không có lệnh riêng cho guild cũ nên sync sẽ xoá hết lệnh ở đó
+            if not await self._sync_scope(discord.Object(id=previous)):
+                return
+        if previous != SYNC_GUILD_ID:
+            await self.store.set_meta(meta_key, str(SYNC_GUILD_ID))
+
+    async def _sync_scope(self, guild) -> bool:
+        """
+        Sync một phạm vi (global hoặc một guild) nếu hash khác lần trước, trả về False nếu lỗi
+        """
+        scope = f"guild:{guild.id}" if guild else "global"
+        meta_key = f"command_hash:{self.application_id}:{scope}"
+        digest = self.command_hash(guild)
+        if not FORCE_SYNC and await self.store.get_meta(meta_key) == digest:
+            log.info("Lệnh không thay đổi, bỏ qua sync", extra={"scope": scope})
+            return True
+        started = time.perf_counter()
         try:
-            print("Synchronizing commands...")
-            await self.tree.sync()
-            print("Command synchronization successful!")
+            log.info("Synchronizing commands...", extra={"scope": scope})
+            await self.tree.sync(guild=guild)
         except Exception as e:
-            print(f"Error synchronizing commands: {e}")
+            log.exception("Error synchronizing commands: %s", e)
+            return False
+        await self.store.set_meta(meta_key, digest)
+        log.info(
+            "Command synchronization successful!",
+            extra={"scope": scope, "elapsed": round(time.perf_counter() - started, 3)},
+        )
+        return True
+
+    async def resume_addtime(self):
+        """
+        Chạy tiếp các thao tác /addtime bị dừng giữa chừng ở lần chạy trước
+        """
+        try:
+            pending, unknown = await self.addtime_journal.recover()
+            resumed = 0
+            for operation_id in pending:
+                outcome = await self.addtime_journal.run(operation_id, self.api.add_time, self.executor)
+                success = [acc for acc, result in outcome.items() if result[1]]
+                await self.key_cache.invalidate(outcome)
+                self.sweeper.reschedule(success)
+                resumed += len(success)
+                addtime_log.info(
+                    "Đã chạy tiếp thao tác /addtime",
+                    extra={"operation_id": operation_id, "success": len(success), "total": len(outcome)},
+                )
+        except Exception as e:
+            addtime_log.exception("Error resuming addtime journal: %s", e)
+            return
+        if not pending and not unknown:
+            return
+
+        report = ReportBuilder(
+            "♻️ Khôi phục /addtime sau khi khởi động lại",
+            f"Thao tác chạy tiếp: **{len(pending)}**\nTài khoản đã thêm giờ: **{resumed}**",
+            color=discord.Color.orange()
+        )
+        if unknown:
+            # Không gửi lại vì upstream có thể đã cộng giờ, cần admin kiểm tra
+            report.add_section(
+                f"⚠️ Chưa rõ kết quả, cần kiểm tra thủ công ({len(unknown)})",
+                (f"`{row['account']}` (+{row['hours']} giờ)" for row in unknown)
+            )
+        for embed in report.embeds():
+            await self.audit_log.log(embed)
+
+    async def on_order_paid(self, order, transaction):
+        """
+        Ghi log khi một đơn /thanhtoan đã được thanh toán
+        """
+        embed = discord.Embed(
+            title="💸 Đã nhận thanh toán",
+            description="Chi tiết đơn hàng:",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Người mua", value=f"<@{order['user_id']}> (`{order['user_name']}`)", inline=True)
+        embed.add_field(name="Số lượng key", value=f"`{order['quantity']} key`", inline=True)
+        embed.add_field(name="Sản phẩm", value=f"`{order.get('product', 'default')}`", inline=True)
+        embed.add_field(name="Số tiền", value=f"`{order['amount']:,} VNĐ`", inline=True)
+        embed.add_field(name="Mã giao dịch", value=f"`{transaction.get('reference')}`", inline=False)
+        await self.audit_log.log(embed)
+
+        if AUTO_DELIVERY:
+            # Giao key ở nền để không chặn việc đối soát các giao dịch khác
+            self.lifecycle.spawn(self.fulfill_order(order))
+
+    async def find_member(self, user_id: int):
+        """
+        Tìm member trong guild có role khách hàng
+        """
+        for guild in self.guilds:
+            if guild.get_role(CUSTOMER_ROLE_ID) is None:
+                continue
+            try:
+                member = await self.members.get_member(guild, user_id)
+            except discord.HTTPException:
+                continue
+            if member is not None:
+                return member
+        return None
+
+    async def fulfill_order(self, order):
+        """
+        Lấy key từ kho và giao cho người mua của đơn đã thanh toán
+        """
+        async with self.delivery_semaphore:
+            try:
+                member = await self.find_member(order["user_id"])
+                if member is None:
+                    raise RuntimeError("không tìm thấy người mua trong server")
+                await deliver_from_inventory(
+                    member, order["quantity"], f"order:{order['id']}",
+                    sender_id=self.user.id, sender_text=f"{self.user.mention} (tự động)",
+                    product=order.get("product", "default")
+                )
+            except Exception as e:
+                self.reconciler.mark_fulfilled(order["id"], delivered=False)
+                delivery_log.exception("Error fulfilling order: %s", e, extra={"order_id": order["id"]})
+                embed = discord.Embed(
+                    title="⚠️ Chưa giao được key",
+                    description=f"Đơn `{order['id']}` của <@{order['user_id']}> cần giao thủ công: {e}",
+                    color=discord.Color.orange()
+                )
+                await self.audit_log.log(embed)
+            else:
+                self.reconciler.mark_fulfilled(order["id"])
+
+    async def resume_orders(self):
+        """
+        Giao tiếp các đơn đã thanh toán nhưng chưa giao key ở lần chạy trước
+        """
+        await self.wait_until_ready()
+        try:
+            # Đơn thanh toán trước khi bot ghi trạng thái giao key có thể đã được
+            # admin giao thủ công, chỉ giao tiếp các đơn từ lần đầu ghi trạng thái
+            tracked_since = await self.store.get_meta("orders_fulfilment_since")
+            if tracked_since is None:
+                tracked_since = time.time()
+                await self.store.set_meta("orders_fulfilment_since", str(tracked_since))
+            since = max(float(tracked_since), time.time() - ORDER_TTL_HOURS * 3600)
+            orders = await self.reconciler.unfulfilled(since)
+            uncertain = []
+            for order in orders:
+                keys = await self.inventory.reference_status(f"order:{order['id']}")
+                if keys.get("delivered", 0) >= order["quantity"]:
+                    # Đã giao xong, chỉ chưa kịp ghi trạng thái đơn
+                    self.reconciler.mark_fulfilled(order["id"])
+                    continue
+                if keys:
+                    # Đang giao dở thì có thể khách đã nhận key, không giao lại
+                    self.reconciler.mark_fulfilled(order["id"], delivered=False)
+                    uncertain.append(order)
+                    continue
+                self.lifecycle.spawn(self.fulfill_order(order))
+        except Exception as e:
+            delivery_log.exception("Error resuming paid orders: %s", e)
+            return
+        if orders:
+            delivery_log.info(
+                "Đã giao tiếp các đơn chưa giao", extra={"orders": len(orders), "uncertain": len(uncertain)}
+            )
+        if uncertain:
+            report = ReportBuilder(
+                "⚠️ Đơn giao dở trước khi khởi động lại",
+                "Các đơn đã giữ chỗ key nhưng chưa rõ khách đã nhận được chưa, cần kiểm tra thủ công.",
+                color=discord.Color.orange()
+            )
+            report.add_section(
+                f"Đơn ({len(uncertain)})",
+                (f"`{order['id']}` - <@{order['user_id']}> ({order['quantity']} key)" for order in uncertain)
+            )
+            for embed in report.embeds():
+                await self.audit_log.log(embed)
+
+    async def remind_expiry(self, user_id, keys):
+        """
+        DM nhắc khách (có role khách hàng) các key sắp hết hạn, trả về False nếu không gửi
+        """
+        member = await self.find_member(user_id)
+        if member is None or not self.members.has_role(member):
+            return False
+        keys_text = "\n".join(f"`{key}` - còn **{days}** ngày" for key, days in sorted(keys, key=lambda k: k[1]))
+        embed = discord.Embed(
+            title="⏰ Key sắp hết hạn",
+            description=f"Các key sau của bạn sắp hết hạn:\n\n{keys_text}",
+            color=discord.Color.orange()
+        )
+        embed.set_footer(text="Liên hệ admin để gia hạn key")
+        await member.send(embed=embed)
+        return True
+
+    async def on_guild_available(self, guild):
+        self.members.on_guild_available(guild)
+
+    async def on_guild_join(self, guild):
+        if self.members.mode == "startup":
+            self.members.ensure_chunked(guild)
+
+    async def on_member_update(self, before, after):
+        self.members.on_member_update(before, after)
+
+    async def on_member_join(self, member):
+        self.members.on_member_join(member)
+
+    async def on_member_remove(self, member):
+        self.members.on_member_remove(member)
+
+    async def on_guild_role_delete(self, role):
+        self.members.on_guild_role_delete(role)
+
+    def request_shutdown(self, sig=None):
+        """
+        Signal handler: lần đầu bắt đầu tắt an toàn, lần thứ hai thì không chờ nữa
+        """
+        if self._shutdown_task is None:
+            log.info("Nhận tín hiệu %s, bắt đầu tắt bot", getattr(sig, "name", sig))
+            self._shutdown_task = asyncio.create_task(self.shutdown())
+        else:
+            log.warning("Nhận tín hiệu tắt lần nữa, không chờ lệnh đang chạy")
+            self.lifecycle.abort_drain()
+
+    async def shutdown(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """
+        Ngừng nhận lệnh / webhook mới, chờ lệnh và task giao key đang chạy xong
+        (tối đa timeout giây) rồi đóng bot
+        """
+        self.lifecycle.stop_accepting()
+        started = time.perf_counter()
+        if self._web_runner is not None:
+            # Webhook ngân hàng đang xử lý vẫn được chạy xong
+            await self._web_runner.cleanup()
+            self._web_runner = None
+        remaining = await self.lifecycle.drain(max(0.0, timeout - (time.perf_counter() - started)))
+        log.info(
+            "Đã chờ lệnh đang chạy",
+            extra={
+                "elapsed": round(time.perf_counter() - started, 3),
+                "unfinished": remaining,
+                "rejected": self.lifecycle.rejected,
+            },
+        )
+        await self.close()
+
+    async def close(self):
+        self.lifecycle.stop_accepting()
+        for task in self._background_tasks:
+            if not task.done():
+                task.cancel()
+        if self._web_runner is not None:
+            await self._web_runner.cleanup()
+            self._web_runner = None
+        # Lệnh còn chạy quá hạn bị huỷ; /addtime dở dang chạy tiếp khi khởi động lại nhờ journal
+        cancelled = await self.lifecycle.cancel()
+        if cancelled:
+            log.warning("Đã huỷ %d lệnh / task chưa xong khi tắt bot", cancelled)
+        # Gửi nốt log còn chờ trước khi đóng kết nối Discord
+        await self.audit_log.close()
+        await self.api.close()
+        await self.store.close()
+        await super().close()
 
 
 bot = QRPaymentBot()
+# Đo thời gian xử lý của các slash command
+timed_command = instrument_command(bot.metrics)
+
+
+def rate_limited(cost=lambda options: 1):
+    """
+    Decorator giới hạn tần suất lệnh theo user / guild, đặt dưới @timed_command.
+    cost(options) tính số token từ tham số của lệnh. Admin không bị giới hạn.
+    Công việc gọi upstream của lệnh được xếp vào luồng riêng của user trong
+    FairScheduler (admin có trọng số ADMIN_FLOW_WEIGHT).
+    """
+    rejected = bot.metrics.counter(
+        "discord_command_rate_limited_total", "Số lệnh bị từ chối do vượt giới hạn tần suất", ("command", "scope")
+    )
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction, *args, **kwargs):
+            permissions = getattr(interaction.user, "guild_permissions", None)
+            if permissions is not None and permissions.administrator:
+                request_flow.set((f"admin:{interaction.user.id}", ADMIN_FLOW_WEIGHT))
+                return await func(interaction, *args, **kwargs)
+
+            scope, retry_after = await bot.command_limiter.acquire(
+                interaction.user.id, interaction.guild_id, cost(kwargs)
+            )
+            if scope is not None:
+                command = interaction.command.name if interaction.command else func.__name__
+                rejected.inc(command=command, scope=scope)
+                log.info(
+                    "Từ chối lệnh do vượt giới hạn",
+                    extra={"command": command, "scope": scope, "retry_after": round(retry_after, 1)},
+                )
+                who = "Bạn" if scope == "user" else "Server này"
+                await interaction.response.send_message(
+                    f"⏳ {who} đang dùng lệnh quá nhanh. Vui lòng thử lại sau **{math.ceil(retry_after)}** giây "
+                    f"(<t:{math.ceil(time.time() + retry_after)}:R>).",
+                    ephemeral=True
+                )
+                return
+            request_flow.set((f"user:{interaction.user.id}", 1))
+            return await func(interaction, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def check_cost(options):
+    """
+    Số token của /check: mỗi key một token. Kiểm tra từ file chỉ tốn một token
+    lúc gọi lệnh, từng key được tính token khi đọc tới (xem check_key_file)
+    """
+    if options.get("file") is not None:
+        return 1
+    return max(1, len((options.get("key") or "").split()))
 
 
 @bot.tree.command(name="thanhtoan", description="Tạo mã QR thanh toán ngân hàng")
 @app_commands.describe(
     amount="Số lượng key cần thanh toán",
+    product="Loại key (mặc định theo bảng giá)",
+    promo="Mã giảm giá (nếu có)",
 )
+@timed_command
+@rate_limited()
 async def generate_qr(
     interaction: discord.Interaction,
     amount: int,
+    product: str = None,
+    promo: str = None,
 ):
     try:
-        # Validate key amount
-        if amount < 5:
-            await interaction.response.send_message("❌ Số lượng key phải lớn hơn hoặc bằng 5!")
+        # Tính giá theo bảng giá hiện hành (bậc số lượng, mã giảm giá)
+        try:
+            quote = bot.pricing.quote(amount, product, promo)
+        except PricingError as e:
+            await interaction.response.send_message(f"❌ {e}")
             return
+        total_price = quote["total"]
 
-        # Calculate price based on quantity
-        total_price = 250000 * amount
+        await defer(interaction)
 
-        await interaction.response.defer()
+        # Mỗi đơn một nội dung CK riêng để đối soát đúng đơn
+        message = order_memo(interaction.id)
 
-        # Generate VietQR URL with encoded parameters
-        message = f"{interaction.user.name}"
-        qr_url = generate_vietqr_content(total_price, message)
+        # Lưu đơn chờ để đối soát khi nhận được chuyển khoản
+        bot.reconciler.create_order(
+            interaction.id, interaction.user.id, interaction.user.name, message, total_price, amount,
+            product=quote["product"]
+        )
 
         # Create embed with payment information
         embed = discord.Embed(
             title="💳 Thông tin thanh toán",
-            description=f"**Số lượng key:** {amount} key\n**Đơn giá:** 250,000 VNĐ/key",
+            description=quote_text(quote),
             color=0x00ff00  # Màu xanh lá cây tươi sáng
         )
 
@@ -107,37 +861,191 @@ async def generate_qr(
             inline=False
         )
 
-        # Set the encoded QR URL
+        # Tạo ảnh QR và gửi kèm dưới dạng file đính kèm
+        qr_file = None
         try:
-            embed.set_image(url=qr_url)
+            qr_png = await bot.qr_renderer.render(total_price, message)
+            qr_file = discord.File(io.BytesIO(qr_png), filename="vietqr.png")
+            embed.set_image(url="attachment://vietqr.png")
         except Exception as e:
-            print(f"Error setting image URL: {e}")
-            await interaction.followup.send("❌ Không thể tạo mã QR. Vui lòng thử lại sau.")
-            return
+            # Không tạo được ảnh thì dùng ảnh từ img.vietqr.io
+            qr_log.exception("Error rendering QR image: %s", e)
+            try:
+                embed.set_image(url=generate_vietqr_content(total_price, message))
+            except Exception as e:
+                qr_log.exception("Error setting image URL: %s", e)
+                await interaction.followup.send("❌ Không thể tạo mã QR. Vui lòng thử lại sau.")
+                return
 
         embed.set_footer(text=f"Yêu cầu bởi: {interaction.user.name}")
 
-        await interaction.followup.send(embed=embed)
+        if qr_file is not None:
+            await interaction.followup.send(embed=embed, file=qr_file)
+        else:
+            await interaction.followup.send(embed=embed)
 
     except ValueError:
         await interaction.followup.send('❌ Vui lòng nhập một số hợp lệ.')
     except Exception as e:
-        print(f"Error: {e}")
+        qr_log.exception("Error: %s", e)
         await interaction.followup.send('❌ Có lỗi xảy ra. Vui lòng thử lại sau.')
 
 
+@generate_qr.autocomplete("product")
+async def product_autocomplete(interaction: discord.Interaction, current: str):
+    current = current.lower()
+    return [
+        app_commands.Choice(name=f"{info['name']} ({sku})"[:100], value=sku)
+        for sku, info in bot.pricing.table.products.items()
+        if current in sku.lower() or current in info["name"].lower()
+    ][:25]
+
+
+def quote_text(quote) -> str:
+    """
+    Mô tả chi tiết giá của một đơn cho embed /thanhtoan
+    """
+    lines = [f"**Số lượng key:** {quote['quantity']} key"]
+    if len(bot.pricing.table.products) > 1:
+        lines.append(f"**Sản phẩm:** {quote['name']}")
+    if quote["volume_discount"]:
+        lines.append(f"**Đơn giá:** ~~{quote['base_unit_price']:,}~~ {quote['unit_price']:,} VNĐ/key")
+        lines.append(f"**Giảm theo số lượng:** -{quote['volume_discount']:,} VNĐ")
+    else:
+        lines.append(f"**Đơn giá:** {quote['unit_price']:,} VNĐ/key")
+    if quote["promo_code"]:
+        lines.append(f"**Mã giảm giá `{quote['promo_code']}`:** -{quote['promo_discount']:,} VNĐ")
+    return "\n".join(lines)
+
+
+@bot.tree.command(name="banggia", description="Xem bảng giá key")
+@timed_command
+async def price_list(interaction: discord.Interaction):
+    table = bot.pricing.table
+    embed = discord.Embed(title="🏷️ Bảng giá", color=discord.Color.blue())
+    for sku, info in table.products.items():
+        name = info["name"] if len(table.products) == 1 else f"{info['name']} (`{sku}`)"
+        embed.add_field(name=name, value=table.describe(sku), inline=False)
+    embed.set_footer(text="Dùng /thanhtoan để tạo mã QR thanh toán")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+async def send_accounts_dm(user, formatted_lines, on_sent=None):
+    """
+    Gửi DM danh sách tài khoản cho user.
+    discord.Forbidden được raise nếu user chặn DM.
+    on_sent(n) được gọi sau mỗi tin nhắn gửi thành công với số dòng vừa gửi
+    (các dòng được gửi theo đúng thứ tự của formatted_lines).
+    """
+    dm_channel = await user.create_dm()
+
+    # Tạo embed để gửi cho user, danh sách dài được chia thành nhiều phần
+    report = ReportBuilder(
+        "🔑 Thông tin tài khoản",
+        f"Format: `username - password`\nSố lượng: `{len(formatted_lines)} key`",
+        footer="Lưu ý: Mỗi dòng là một tài khoản và mật khẩu"
+    )
+    for chunk in pack_lines(formatted_lines, MAX_FIELD_CHARS - 8):
+        report.add_field("Danh sách tài khoản", f"```\n{chunk}\n```")
+
+    # Gửi embed cho user
+    for group in report.messages():
+        await dm_channel.send(embeds=group)
+        if on_sent is not None:
+            # Mỗi field là một khối ```...```, số dòng = số ký tự xuống dòng - 1
+            on_sent(sum(field.value.count("\n") - 1 for embed in group for field in embed.fields))
+
+
+def log_delivery(user, formatted_lines, accounts, *, sender_id, sender_text, reference_id=None, timestamp=None):
+    """
+    Lưu lịch sử giao key và tạo các embed log
+    """
+    # Lưu lịch sử giao key (ghi nền, không chờ)
+    bot.store.record_delivery(reference_id, user.id, user.name, sender_id, accounts)
+
+    # Tạo embed để ghi log
+    log_report = ReportBuilder(
+        "📝 Log Gửi Key",
+        "Chi tiết giao dịch:",
+        color=discord.Color.green(),
+        timestamp=timestamp or discord.utils.utcnow()
+    )
+    log_report.add_field("Người gửi", sender_text, inline=True)
+    log_report.add_field("Người nhận", f"{user.mention} (`{user.name}`)", inline=True)
+    log_report.add_field("Số lượng key", f"`{len(formatted_lines)} key`", inline=True)
+    for chunk in pack_lines(formatted_lines, MAX_FIELD_CHARS - 8):
+        log_report.add_field("Danh sách key", f"```\n{chunk}\n```")
+    return log_report.embeds()
+
+
+async def deliver_from_inventory(member, quantity, reference, *, sender_id, sender_text, timestamp=None, product="default"):
+    """
+    Giữ chỗ key trong kho, thêm role và gửi cho member.
+    Giao thất bại thì trả về kho các key chưa gửi được (key đã gửi trong các
+    tin nhắn trước đó được ghi là đã giao). Trả về danh sách key đã giao.
+    """
+    keys = await bot.inventory.reserve(quantity, reference, product)
+    formatted_lines = [f"{key['account']} - {key['password']}" for key in keys]
+    sending = False
+    sent = 0
+
+    def on_sent(count):
+        nonlocal sent
+        sent += count
+
+    try:
+        role_added = await check_and_add_role(member, CUSTOMER_ROLE_ID)
+        if not role_added:
+            raise RuntimeError("không thể thêm role cho user")
+        sending = True
+        await send_accounts_dm(member, formatted_lines, on_sent)
+    except BaseException as e:
+        if sent:
+            # Khách đã nhận các key này, không được bán lại
+            await bot.inventory.mark_delivered((key["id"] for key in keys[:sent]), member.id)
+            for log_embed in log_delivery(
+                member, formatted_lines[:sent], [key["account"] for key in keys[:sent]],
+                sender_id=sender_id, sender_text=sender_text, timestamp=timestamp
+            ):
+                await bot.audit_log.log(log_embed)
+        if isinstance(e, asyncio.CancelledError) and sending:
+            # Bị huỷ khi đang gửi: không biết tin nhắn dở dang đã tới chưa, giữ
+            # chỗ các key còn lại để release_stale / admin xử lý
+            delivery_log.warning(
+                "Giao key bị huỷ giữa chừng, giữ chỗ %d key chưa rõ đã gửi", len(keys) - sent,
+                extra={"user_id": member.id, "reference": reference, "accounts": [key["account"] for key in keys[sent:]]},
+            )
+        else:
+            # Trả về kho các key chưa gửi được
+            await bot.inventory.release(key["id"] for key in keys[sent:])
+        raise
+    await bot.inventory.mark_delivered((key["id"] for key in keys), member.id)
+    delivery_log.info(
+        "Đã giao %d key từ kho", len(keys),
+        extra={"user_id": member.id, "reference": reference, "accounts": [key["account"] for key in keys]},
+    )
+
+    for log_embed in log_delivery(
+        member, formatted_lines, [key["account"] for key in keys],
+        sender_id=sender_id, sender_text=sender_text, timestamp=timestamp
+    ):
+        await bot.audit_log.log(log_embed)
+    return keys
+
+
 @bot.tree.command(name="sendmsg", description="Gửi tin nhắn trực tiếp đến user")
 @app_commands.describe(
     user="Người dùng cần gửi tin nhắn",
     message="Nội dung tin nhắn cần gửi"
 )
+@timed_command
 async def send_direct_message(
     interaction: discord.Interaction,
     user: discord.Member,
     message: str
 ):
     try:
-        await interaction.response.defer(ephemeral=True)
+        await defer(interaction, ephemeral=True)
 
         try:
             # Kiểm tra và thêm role cho user
@@ -149,11 +1057,10 @@ async def send_direct_message(
                 )
                 return
 
-            dm_channel = await user.create_dm()
-
             # Tách chuỗi thành các cặp dựa trên khoảng trắng
             pairs = message.split()
             formatted_lines = []
+            delivered_accounts = []
 
             # Xử lý từng cặp 3 phần tử (tk - mk)
             for i in range(0, len(pairs), 3):
@@ -162,57 +1069,21 @@ async def send_direct_message(
                     dash = pairs[i+1]  # Dấu -
                     pwd = pairs[i+2]
                     formatted_lines.append(f"{acc} {dash} {pwd}")
+                    delivered_accounts.append(acc)
 
-            # Join các dòng thành text
-            accounts_text = '\n'.join(formatted_lines)
-
-            # Tạo embed để gửi cho user
-            user_embed = discord.Embed(
-                title="🔑 Thông tin tài khoản",
-                description=f"Format: `username - password`\nSố lượng: `{len(formatted_lines)} key`\n\n" +
-                f"```\n{accounts_text}\n```" if formatted_lines else "",
-                color=discord.Color.blue()
-            )
-            user_embed.set_footer(
-                text="Lưu ý: Mỗi dòng là một tài khoản và mật khẩu")
-
-            # Gửi embed cho user
-            await dm_channel.send(embed=user_embed)
+            await send_accounts_dm(user, formatted_lines)
 
-            # Tạo embed để ghi log
-            log_embed = discord.Embed(
-                title="📝 Log Gửi Key",
-                description="Chi tiết giao dịch:",
-                color=discord.Color.green(),
+            log_embeds = log_delivery(
+                user, formatted_lines, delivered_accounts,
+                sender_id=interaction.user.id,
+                sender_text=f"{interaction.user.mention} (`{interaction.user.name}`)",
+                reference_id=interaction.id,
                 timestamp=interaction.created_at
             )
-            log_embed.add_field(
-                name="Người gửi",
-                value=f"{interaction.user.mention} (`{interaction.user.name}`)",
-                inline=True
-            )
-            log_embed.add_field(
-                name="Người nhận",
-                value=f"{user.mention} (`{user.name}`)",
-                inline=True
-            )
-            log_embed.add_field(
-                name="Số lượng key",
-                value=f"`{len(formatted_lines)} key`",
-                inline=True
-            )
-            log_embed.add_field(
-                name="Danh sách key",
-                value=f"```\n{accounts_text}\n```",
-                inline=False
-            )
 
-            # Gửi log vào channel
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                await log_channel.send(embed=log_embed)
-            else:
-                print(f"Không tìm thấy channel log với ID {LOG_CHANNEL_ID}")
+            # Đưa log vào hàng đợi, worker sẽ gửi vào channel
+            for log_embed in log_embeds:
+                await bot.audit_log.log(log_embed)
 
             await interaction.followup.send(
                 f"✅ Đã gửi tin nhắn đến {user.name} và thêm role!",
@@ -224,23 +1095,161 @@ async def send_direct_message(
                 ephemeral=True
             )
         except Exception as e:
-            print(f"Error sending DM: {e}")
+            delivery_log.exception("Error sending DM: %s", e, extra={"user_id": user.id})
             await interaction.followup.send(
                 "❌ Có lỗi xảy ra khi gửi tin nhắn.",
                 ephemeral=True
             )
 
     except Exception as e:
-        print(f"Error: {e}")
+        delivery_log.exception("Error: %s", e)
         await interaction.followup.send(
             "❌ Có lỗi xảy ra. Vui lòng thử lại sau.",
             ephemeral=True
         )
 
 
+async def resolve_member(guild: discord.Guild, reference: str):
+    """
+    Tìm member từ mention (<@id>), id hoặc tên
+    """
+    user_id = reference.strip("<@!>")
+    if user_id.isdigit():
+        try:
+            return await bot.members.get_member(guild, int(user_id))
+        except discord.HTTPException:
+            return None
+    return guild.get_member_named(reference.lstrip("@"))
+
+
+async def deliver_to_recipient(guild, reference, pairs, *, sender_id, reference_id):
+    """
+    Thêm role và gửi DM key cho một người nhận của /sendbulk.
+    Trả về (member hoặc None, thành công, lý do).
+    """
+    async with bot.delivery_semaphore:
+        member = await resolve_member(guild, reference)
+        if member is None:
+            return None, False, "không tìm thấy trong server"
+        formatted_lines = [f"{acc} - {pwd}" for acc, pwd in pairs]
+        try:
+            if not await check_and_add_role(member, CUSTOMER_ROLE_ID):
+                return member, False, "không thể thêm role"
+            await send_accounts_dm(member, formatted_lines)
+        except discord.Forbidden:
+            return member, False, "đã chặn DM"
+        except discord.HTTPException as e:
+            delivery_log.warning("Error sending DM: %s", e, extra={"user_id": member.id})
+            return member, False, f"lỗi Discord ({e.status})"
+        bot.store.record_delivery(reference_id, member.id, member.name, sender_id, [acc for acc, _ in pairs])
+        return member, True, f"{len(pairs)} key"
+
+
+@bot.tree.command(name="sendbulk", description="Gửi key cho nhiều user cùng lúc")
+@app_commands.describe(
+    entries="Danh sách `@user tk - mk ...`, mỗi người nhận cách nhau bằng dấu ;",
+    file="File text/CSV, mỗi dòng `user tk - mk ...` hoặc `user,tk,mk`"
+)
+@timed_command
+async def send_bulk_messages(
+    interaction: discord.Interaction,
+    entries: str = None,
+    file: discord.Attachment = None
+):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    try:
+        await defer(interaction, ephemeral=True)
+
+        if file is not None:
+            if file.size > BULK_MAX_FILE_SIZE:
+                await interaction.followup.send(
+                    f"❌ File quá lớn (tối đa {BULK_MAX_FILE_SIZE // 1024} KB).", ephemeral=True
+                )
+                return
+            lines = (await file.read()).decode("utf-8-sig", errors="replace").splitlines()
+        else:
+            lines = (entries or "").split(";")
+        deliveries, invalid = parse_deliveries(lines)
+
+        if not deliveries:
+            await interaction.followup.send("❌ Không có người nhận hợp lệ nào.", ephemeral=True)
+            return
+        if len(deliveries) > MAX_BATCH_SIZE:
+            await interaction.followup.send(f"❌ Vui lòng gửi tối đa {MAX_BATCH_SIZE} người nhận một lần.", ephemeral=True)
+            return
+
+        # Các người nhận chạy song song, tối đa DELIVERY_CONCURRENCY cùng lúc;
+        # discord.py tự chờ khi gặp rate limit của từng route
+        results = await asyncio.gather(*(
+            deliver_to_recipient(
+                interaction.guild, reference, pairs,
+                sender_id=interaction.user.id, reference_id=interaction.id
+            )
+            for reference, pairs in deliveries.items()
+        ), return_exceptions=True)
+
+        delivered, failed = [], []
+        for (reference, pairs), result in zip(deliveries.items(), results):
+            if isinstance(result, Exception):
+                delivery_log.error("Error delivering keys: %s", result, extra={"recipient": reference})
+                result = (None, False, "lỗi không xác định")
+            member, ok, reason = result
+            name = f"{member.mention} (`{member.name}`)" if member is not None else f"`{reference}`"
+            (delivered if ok else failed).append((name, pairs, reason))
+
+        key_count = sum(len(pairs) for _, pairs, _ in delivered)
+        delivery_log.info(
+            "Đã gửi key hàng loạt cho %d/%d người nhận", len(delivered), len(deliveries),
+            extra={"keys": key_count, "failed": [name for name, _, _ in failed], "invalid_lines": invalid},
+        )
+
+        summary = (
+            f"Tổng số người nhận: **{len(deliveries)}**\n"
+            f"✅ Đã gửi: **{len(delivered)}** ({key_count} key)\n"
+            f"❌ Thất bại: **{len(failed)}**"
+        )
+        if invalid:
+            summary += f"\n⚠️ Dòng không hợp lệ: **{invalid}**"
+        report = ReportBuilder("📨 Kết quả gửi key hàng loạt", summary, timestamp=interaction.created_at)
+        if delivered:
+            report.add_section(f"✅ Đã gửi ({len(delivered)})", (f"{name} - {reason}" for name, _, reason in delivered))
+        if failed:
+            report.add_section(f"❌ Thất bại ({len(failed)})", (f"{name} - {reason}" for name, _, reason in failed))
+        await send_report(interaction, report)
+
+        # Một log tổng hợp cho cả lô thay vì một log cho mỗi người nhận
+        if delivered:
+            log_report = ReportBuilder(
+                "📝 Log Gửi Key",
+                f"Gửi hàng loạt cho **{len(delivered)}** người nhận ({key_count} key)",
+                color=discord.Color.green(),
+                timestamp=interaction.created_at
+            )
+            log_report.add_field("Người gửi", f"{interaction.user.mention} (`{interaction.user.name}`)", inline=True)
+            log_report.add_section("Danh sách key", (
+                f"{name}: " + ", ".join(f"`{acc} - {pwd}`" for acc, pwd in pairs)
+                for name, pairs, _ in delivered
+            ))
+            if failed:
+                log_report.add_section("Chưa gửi được", (f"{name} - {reason}" for name, _, reason in failed))
+            for log_embed in log_report.embeds():
+                await bot.audit_log.log(log_embed)
+
+    except Exception as e:
+        delivery_log.exception("Error in sendbulk command: %s", e)
+        await interaction.followup.send("❌ Có lỗi xảy ra. Vui lòng thử lại sau.", ephemeral=True)
+
+
 @bot.event
 async def on_ready():
-    print(f'🤖 {bot.user} đã sẵn sàng!')
+    # on_ready chạy lại mỗi lần reconnect, chỉ ghi thời gian khởi động lần đầu
+    if bot.ready_seconds is None:
+        bot.ready_seconds = time.perf_counter() - BOOT_STARTED
+    log.info('🤖 %s đã sẵn sàng!', bot.user, extra={"startup_seconds": round(bot.ready_seconds, 3)})
 
 # Thêm hàm kiểm tra và thêm role
 
@@ -250,245 +1259,502 @@ async def check_and_add_role(member: discord.Member, role_id: int):
     Kiểm tra và thêm role cho member nếu chưa có
     """
     try:
+        # Kiểm tra xem member đã có role chưa (tra chỉ mục, không gọi API)
+        if role_id == bot.members.role_id:
+            if bot.members.has_role(member):
+                return True
+        elif member.get_role(role_id) is not None:
+            return True
+
         # Lấy role từ ID
         role = member.guild.get_role(role_id)
         if not role:
-            print(f"Không tìm thấy role với ID {role_id}")
+            role_log.error("Không tìm thấy role", extra={"role_id": role_id, "guild_id": member.guild.id})
             return False
 
-        # Kiểm tra xem member đã có role chưa
-        if role not in member.roles:
-            await member.add_roles(role)
-            print(f"Đã thêm role {role.name} cho {member.name}")
-            return True
+        await member.add_roles(role)
+        if role_id == bot.members.role_id:
+            bot.members.mark(member)
+        role_log.info("Đã thêm role %s cho %s", role.name, member.name, extra={"user_id": member.id})
         return True
     except Exception as e:
-        print(f"Lỗi khi thêm role: {e}")
+        role_log.exception("Lỗi khi thêm role: %s", e, extra={"user_id": member.id})
         return False
 
 
-async def check_single_key(session, key):
+async def check_single_key(key):
     """
-    Hàm kiểm tra một key riêng lẻ
+    Hàm kiểm tra một key riêng lẻ (có cache và gộp request trùng)
     """
-    api_url = f"https://api.autoit.pro/API/api.php?TK={key}"
-    
-    for attempt in range(3):  # Thử tối đa 3 lần
-        try:
-            async with session.get(api_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                if response.status == 200:
-                    try:
-                        data = await response.json()
-                        
-                        if not isinstance(data, dict):
-                            return (key, "error")
-
-                        error = data.get("error")
-                        message = data.get("message")
-                        seconds_remaining = data.get("data")
-
-                        if error is None or message is None:
-                            return (key, "error")
-
-                        # Convert error to int if needed
-                        if isinstance(error, str):
-                            try:
-                                error = int(error)
-                            except ValueError:
-                                return (key, "error")
-
-                        # Phân loại key
-                        if error == 2:
-                            return (key, "not_activated")
-                        elif error != 0 or message.lower() != "ok":
-                            return (key, "inactive")
-                        else:
-                            try:
-                                seconds_remaining = int(seconds_remaining)
-                                if seconds_remaining > 0:
-                                    days_remaining = seconds_remaining // (24 * 3600)
-                                    return (key, "active", days_remaining)
-                                else:
-                                    return (key, "inactive")
-                            except (ValueError, TypeError):
-                                return (key, "error")
-                    except:
-                        if attempt == 2:
-                            return (key, "error")
-                else:
-                    if attempt == 2:
-                        return (key, "error")
-        except:
-            if attempt == 2:
-                return (key, "error")
-        await asyncio.sleep(1)
-    return (key, "error")
+    bot.checks_in_flight += 1
+    try:
+        return await bot.key_cache.get_or_fetch(key, fetch_key_status)
+    finally:
+        bot.checks_in_flight -= 1
+
+
+async def fetch_key_status(key):
+    """
+    Gọi API kiểm tra key và lưu trạng thái mới nhất vào database
+    """
+    result = await bot.api.check_key(key)
+    if result[1] != "error":
+        bot.store.record_key_status(result)
+    return result
+
+
+def check_tally_text(tally):
+    """
+    Số key theo từng trạng thái, dùng cho embed tiến độ và kết quả /check
+    """
+    return (
+        f"✅ Còn hạn: **{tally['active']}**\n"
+        f"❌ Hết hạn: **{tally['inactive']}**\n"
+        f"⚠️ Chưa kích hoạt: **{tally['not_activated']}**\n"
+        f"⛔ Lỗi: **{tally['error']}**"
+    )
+
+
+def build_check_report(key_list, results):
+    """
+    Tạo báo cáo kết quả /check từ danh sách key và kết quả tương ứng
+    """
+    # Khởi tạo lists để lưu kết quả
+    active_keys = []
+    inactive_keys = []
+    not_activated_keys = []
+    error_keys = []
+
+    # Phân loại kết quả
+    for key, result in zip(key_list, results):
+        if isinstance(result, tuple):
+            status = result[1]
+            if status == "active":
+                active_keys.append((key, result[2]))  # result[2] là số ngày
+            elif status == "inactive":
+                inactive_keys.append(key)
+            elif status == "not_activated":
+                not_activated_keys.append(key)
+            else:
+                error_keys.append(key)
+        else:
+            error_keys.append(key)
+
+    # Thêm tổng kết lên đầu
+    tally = {
+        "active": len(active_keys),
+        "inactive": len(inactive_keys),
+        "not_activated": len(not_activated_keys),
+        "error": len(error_keys),
+    }
+    report = ReportBuilder(
+        "📊 Kết quả kiểm tra keys",
+        f"Tổng số key: **{len(key_list)}**\n" + check_tally_text(tally),
+    )
+
+    # Thêm thông tin cho từng loại key
+    if active_keys:
+        # Sắp xếp theo số ngày còn lại
+        active_keys.sort(key=lambda x: x[1], reverse=True)
+        report.add_section(
+            f"✅ Keys còn hạn ({len(active_keys)})",
+            (f"`{key}` - **{days}** ngày" for key, days in active_keys)
+        )
+    if inactive_keys:
+        report.add_section(f"❌ Keys hết hạn ({len(inactive_keys)})", (f"`{key}`" for key in inactive_keys))
+    if not_activated_keys:
+        report.add_section(
+            f"⚠️ Keys chưa kích hoạt ({len(not_activated_keys)})", (f"`{key}`" for key in not_activated_keys)
+        )
+    if error_keys:
+        report.add_section(f"⛔ Keys lỗi ({len(error_keys)})", (f"`{key}`" for key in error_keys))
+
+    return report
+
+
+def token_expiring(interaction) -> bool:
+    """
+    Token của interaction sắp hết hạn (không gửi / sửa followup được nữa)
+    """
+    age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    return age >= INTERACTION_TOKEN_SAFE_SECONDS
+
+
+async def send_followup(interaction, content=None, **kwargs):
+    """
+    Gửi followup; lệnh chạy quá lâu (token sắp hết hạn) thì gửi DM cho người dùng lệnh
+    """
+    if not token_expiring(interaction):
+        return await interaction.followup.send(content, ephemeral=True, **kwargs)
+    try:
+        return await interaction.user.send(content, **kwargs)
+    except discord.HTTPException as e:
+        log.error(
+            "Không gửi được kết quả qua DM sau khi token interaction hết hạn: %s", e,
+            extra={"user_id": interaction.user.id},
+        )
+
+
+async def send_progress(interaction, message, embed):
+    """
+    Gửi hoặc sửa tin nhắn tiến độ, trả về tin nhắn để lần sau sửa tiếp
+    """
+    if token_expiring(interaction):
+        # Token hết hạn thì bỏ cập nhật tiến độ, kết quả cuối được gửi qua DM
+        return message
+    try:
+        if message is None:
+            return await interaction.followup.send(embed=embed, ephemeral=True, wait=True)
+        await message.edit(embed=embed)
+    except discord.HTTPException as e:
+        log.warning("Error updating progress: %s", e)
+    return message
+
+
+async def send_result(interaction, message, embed, file):
+    """
+    Gửi kết quả cuối (kèm file), thay tin nhắn tiến độ nếu có.
+    Token interaction sắp hết hạn (file lớn chạy lâu) thì gửi qua DM.
+    """
+    if message is not None and not token_expiring(interaction):
+        await message.edit(embed=embed, attachments=[file])
+    else:
+        await send_followup(interaction, embed=embed, file=file)
+
+
+async def check_key_file(interaction, file):
+    """
+    /check với file đính kèm: đọc dần key từ file, kiểm tra với số request đồng
+    thời giới hạn và ghi kết quả dần vào file CSV gửi kèm
+    """
+    if file.size > BULK_MAX_FILE_SIZE:
+        await interaction.followup.send(
+            f"❌ File quá lớn (tối đa {BULK_MAX_FILE_SIZE // 1024} KB).", ephemeral=True
+        )
+        return
+
+    reader = BulkReader(iter_url_chunks(file.url), limit=BULK_MAX_ITEMS)
+    keys = reader
+    permissions = getattr(interaction.user, "guild_permissions", None)
+    if permissions is None or not permissions.administrator:
+        # Mỗi key tốn một token của user / guild như /check thường, hết token thì chờ
+        keys = bot.command_limiter.throttle(reader, interaction.user.id, interaction.guild_id)
+    report = CsvReport(("index", "key", "status", "days_remaining"))
+    tally = {"active": 0, "inactive": 0, "not_activated": 0, "error": 0}
+    done = 0
+    progress_message = None
+    last_update = time.monotonic()
+    try:
+        async for index, key, result in bot.executor.stream(check_single_key, keys):
+            status = result[1] if isinstance(result, tuple) and result[1] in tally else "error"
+            tally[status] += 1
+            done += 1
+            report.write(index + 1, key, status, result[2] if status == "active" else "")
+
+            now = time.monotonic()
+            if now - last_update >= CHECK_PROGRESS_INTERVAL:
+                last_update = now
+                progress_message = await send_progress(interaction, progress_message, discord.Embed(
+                    title="⏳ Đang kiểm tra keys từ file...",
+                    description=f"Đã kiểm tra: **{done}**\n" + check_tally_text(tally),
+                    color=discord.Color.orange()
+                ))
+
+        if done == 0:
+            await interaction.followup.send("❌ Không tìm thấy key nào trong file.", ephemeral=True)
+            return
+
+        description = f"Tổng số key: **{done}**\n" + check_tally_text(tally)
+        if reader.truncated:
+            description += f"\n\n⚠️ Chỉ kiểm tra {BULK_MAX_ITEMS} key đầu tiên trong file."
+        embed = discord.Embed(
+            title="📊 Kết quả kiểm tra keys",
+            description=description + "\n📎 Chi tiết trong file đính kèm.",
+            color=discord.Color.blue()
+        )
+        await send_result(interaction, progress_message, embed, discord.File(report.finish(), filename="check_results.csv"))
+        check_log.info("Đã kiểm tra key từ file", extra={"file": file.filename, "total": done, **tally})
+    finally:
+        report.close()
+
 
 @bot.tree.command(name="check", description="Kiểm tra thời hạn của key")
 @app_commands.describe(
-    key="Key cần kiểm tra thời hạn (nhiều key cách nhau bằng khoảng trắng)"
+    key="Key cần kiểm tra thời hạn (nhiều key cách nhau bằng khoảng trắng)",
+    file="File text/CSV chứa danh sách key (kiểm tra hàng loạt)"
 )
+@timed_command
+@rate_limited(check_cost)
 async def check_key(
     interaction: discord.Interaction,
-    key: str
+    key: str = None,
+    file: discord.Attachment = None
 ):
     try:
         # Defer the response since we'll make HTTP requests
-        await interaction.response.defer(ephemeral=True)
-        
+        await defer(interaction, ephemeral=True)
+
+        if file is not None:
+            await check_key_file(interaction, file)
+            return
+
         # Tách các key nếu có nhiều key
-        key_list = [k.strip() for k in key.split() if k.strip()]
+        key_list = [k.strip() for k in (key or "").split() if k.strip()]
+
+        if not key_list:
+            await interaction.followup.send("❌ Vui lòng nhập key hoặc đính kèm file.", ephemeral=True)
+            return
         
-        if len(key_list) > 30:
-            await interaction.followup.send("❌ Vui lòng kiểm tra tối đa 30 key một lần.", ephemeral=True)
+        if len(key_list) > MAX_BATCH_SIZE:
+            await interaction.followup.send(f"❌ Vui lòng kiểm tra tối đa {MAX_BATCH_SIZE} key một lần.", ephemeral=True)
             return
             
         if len(key_list) > 1:
-            # Khởi tạo lists để lưu kết quả
-            active_keys = []
-            inactive_keys = []
-            not_activated_keys = []
-            error_keys = []
-
-            # Tạo session để tái sử dụng connection
-            async with aiohttp.ClientSession() as session:
-                # Chạy tất cả requests đồng thời
-                tasks = [check_single_key(session, key) for key in key_list]
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-
-                # Phân loại kết quả
-                for result in results:
-                    if isinstance(result, tuple):
-                        key = result[0]
-                        status = result[1]
-                        if status == "active":
-                            active_keys.append((key, result[2]))  # result[2] là số ngày
-                        elif status == "inactive":
-                            inactive_keys.append(key)
-                        elif status == "not_activated":
-                            not_activated_keys.append(key)
-                        else:
-                            error_keys.append(key)
-                    else:
-                        error_keys.append(key)
-
-            # Tạo embed để hiển thị kết quả
-            embed = discord.Embed(
-                title="📊 Kết quả kiểm tra keys",
-                color=discord.Color.blue()
-            )
-
-            # Thêm tổng kết lên đầu
             total = len(key_list)
-            summary = f"Tổng số key: **{total}**\n"
-            summary += f"✅ Còn hạn: **{len(active_keys)}**\n"
-            summary += f"❌ Hết hạn: **{len(inactive_keys)}**\n"
-            summary += f"⚠️ Chưa kích hoạt: **{len(not_activated_keys)}**\n"
-            summary += f"⛔ Lỗi: **{len(error_keys)}**"
-            
-            embed.description = summary
-
-            # Thêm thông tin cho từng loại key
-            if active_keys:
-                # Sắp xếp theo số ngày còn lại
-                active_keys.sort(key=lambda x: x[1], reverse=True)
-                active_keys_text = "\n".join([f"`{key}` - **{days}** ngày" for key, days in active_keys])
-                if len(active_keys_text) > 1024:
-                    chunks = [active_keys_text[i:i+1024] for i in range(0, len(active_keys_text), 1024)]
-                    for i, chunk in enumerate(chunks):
-                        embed.add_field(
-                            name=f"✅ Keys còn hạn ({len(active_keys)}) - Phần {i+1}",
-                            value=chunk,
-                            inline=False
-                        )
-                else:
-                    embed.add_field(
-                        name=f"✅ Keys còn hạn ({len(active_keys)})",
-                        value=active_keys_text,
-                        inline=False
-                    )
-
-            if inactive_keys:
-                inactive_keys_text = "\n".join([f"`{key}`" for key in inactive_keys])
-                if len(inactive_keys_text) > 1024:
-                    chunks = [inactive_keys_text[i:i+1024] for i in range(0, len(inactive_keys_text), 1024)]
-                    for i, chunk in enumerate(chunks):
-                        embed.add_field(
-                            name=f"❌ Keys hết hạn ({len(inactive_keys)}) - Phần {i+1}",
-                            value=chunk,
-                            inline=False
-                        )
+            results = [None] * total
+            tally = {"active": 0, "inactive": 0, "not_activated": 0, "error": 0}
+            done = 0
+            progress_message = None
+            last_update = time.monotonic()
+
+            # Nhận kết quả ngay khi từng key xong, cập nhật tiến độ theo chu kỳ
+            async for index, result in bot.executor.as_completed(check_single_key, key_list):
+                results[index] = result
+                status = result[1] if isinstance(result, tuple) else "error"
+                tally[status if status in tally else "error"] += 1
+                done += 1
+
+                now = time.monotonic()
+                if done < total and now - last_update >= CHECK_PROGRESS_INTERVAL:
+                    last_update = now
+                    progress_message = await send_progress(interaction, progress_message, discord.Embed(
+                        title="⏳ Đang kiểm tra keys...",
+                        description=f"Đã kiểm tra: **{done}/{total}**\n" + check_tally_text(tally),
+                        color=discord.Color.orange()
+                    ))
+
+            # Thay tin nhắn tiến độ bằng kết quả cuối cùng
+            await send_report(interaction, build_check_report(key_list, results), message=progress_message)
+            return
+
+        # Xử lý một key duy nhất
+        result = await check_single_key(key_list[0])
+
+        if result[1] == "active":
+            await interaction.followup.send(f"✅ Key `{result[0]}` còn **{result[2]}** ngày.", ephemeral=True)
+        elif result[1] == "not_activated":
+            await interaction.followup.send(f"⚠️ Key `{result[0]}` chưa được kích hoạt.", ephemeral=True)
+        elif result[1] == "inactive":
+            await interaction.followup.send(f"❌ Key `{result[0]}` đã hết hạn hoặc không tồn tại.", ephemeral=True)
+        else:
+            await interaction.followup.send("❌ Có lỗi xảy ra khi kiểm tra key.", ephemeral=True)
+
+    except Exception as e:
+        check_log.exception("Error checking key: %s", e)
+        await send_followup(interaction, "❌ Có lỗi xảy ra khi kiểm tra key.")
+
+
+def classify_addtime_results(account_list, results):
+    """
+    Tách kết quả /addtime thành tài khoản thành công và thất bại
+    """
+    # Khởi tạo lists để lưu kết quả
+    success_accounts = []
+    failed_accounts = []
+
+    # Phân loại kết quả
+    for acc, result in zip(account_list, results):
+        if isinstance(result, tuple):
+            success = result[1]
+            message = result[2]
+            if success:
+                success_accounts.append(acc)
+            else:
+                failed_accounts.append((acc, message))
+        else:
+            # Xử lý trường hợp exception
+            failed_accounts.append((acc, "Lỗi không xác định"))
+
+    return success_accounts, failed_accounts
+
+
+def build_addtime_report(total, success_accounts, failed_accounts, hours, timestamp=None, skipped_accounts=(), duplicates=0):
+    """
+    Tạo báo cáo kết quả /addtime
+    """
+    # Thêm tổng kết lên đầu
+    summary = f"Tổng số tài khoản: **{total}**\n"
+    summary += f"✅ Thành công: **{len(success_accounts)}**\n"
+    summary += f"❌ Thất bại: **{len(failed_accounts)}**\n"
+    if skipped_accounts:
+        summary += f"⏭️ Bỏ qua: **{len(skipped_accounts)}**\n"
+    if duplicates:
+        summary += f"🔁 Nhập trùng (đã gộp): **{duplicates}**\n"
+    summary += f"⏱️ Số giờ đã thêm: **{hours}** giờ/tài khoản"
+
+    report = ReportBuilder("📊 Kết quả thêm thời gian", summary, timestamp=timestamp)
+
+    # Thêm thông tin cho từng loại tài khoản
+    if success_accounts:
+        report.add_section(
+            f"✅ Tài khoản thành công ({len(success_accounts)})", (f"`{acc}`" for acc in success_accounts)
+        )
+    if failed_accounts:
+        report.add_section(
+            f"❌ Tài khoản thất bại ({len(failed_accounts)})", (f"`{acc}` - {msg}" for acc, msg in failed_accounts)
+        )
+    if skipped_accounts:
+        report.add_section(
+            f"⏭️ Tài khoản bỏ qua ({len(skipped_accounts)})", (f"`{acc}` - {reason}" for acc, reason in skipped_accounts)
+        )
+
+    return report
+
+
+async def add_time_file(interaction, file, hours, force):
+    """
+    /addtime với file đính kèm: đọc dần tài khoản từ file, mỗi lô BULK_ADDTIME_CHUNK
+    tài khoản đi qua journal như lệnh thường, kết quả ghi dần vào file CSV gửi kèm
+    """
+    if file.size > BULK_MAX_FILE_SIZE:
+        await interaction.followup.send(
+            f"❌ File quá lớn (tối đa {BULK_MAX_FILE_SIZE // 1024} KB).", ephemeral=True
+        )
+        return
+
+    reader = BulkReader(iter_url_chunks(file.url), limit=BULK_MAX_ITEMS)
+    report = CsvReport(("account", "result", "message"))
+    counts = {"success": 0, "failed": 0, "skipped": 0, "duplicate": 0}
+    progress_message = None
+    last_update = time.monotonic()
+
+    def progress_text():
+        text = (
+            f"Tổng số tài khoản: **{reader.count}**\n"
+            f"✅ Thành công: **{counts['success']}**\n"
+            f"❌ Thất bại: **{counts['failed']}**\n"
+        )
+        if counts["skipped"]:
+            text += f"⏭️ Bỏ qua: **{counts['skipped']}**\n"
+        if counts["duplicate"]:
+            text += f"🔁 Nhập trùng (đã gộp): **{counts['duplicate']}**\n"
+        return text + f"⏱️ Số giờ đã thêm: **{hours}** giờ/tài khoản"
+
+    try:
+        async for chunk in iter_batches(reader, BULK_ADDTIME_CHUNK):
+            recent = {} if force else await bot.addtime_journal.recent(
+                set(chunk), hours, exclude_operation=interaction.id
+            )
+            pending = []
+            for acc in chunk:
+                if acc in recent:
+                    counts["skipped"] += 1
+                    reason = "vừa được thêm cùng số giờ" if recent[acc] == "done" else "lần thêm trước chưa rõ kết quả"
+                    report.write(acc, "skipped", reason)
                 else:
-                    embed.add_field(
-                        name=f"❌ Keys hết hạn ({len(inactive_keys)})",
-                        value=inactive_keys_text,
-                        inline=False
-                    )
-
-            if not_activated_keys:
-                not_activated_keys_text = "\n".join([f"`{key}`" for key in not_activated_keys])
-                if len(not_activated_keys_text) > 1024:
-                    chunks = [not_activated_keys_text[i:i+1024] for i in range(0, len(not_activated_keys_text), 1024)]
-                    for i, chunk in enumerate(chunks):
-                        embed.add_field(
-                            name=f"⚠️ Keys chưa kích hoạt ({len(not_activated_keys)}) - Phần {i+1}",
-                            value=chunk,
-                            inline=False
-                        )
+                    pending.append(acc)
+
+            # Tài khoản đã có trong thao tác (nhập trùng trong file) không được ghi lại
+            account_list = await bot.addtime_journal.begin(interaction.id, interaction.user.id, pending, hours)
+            counts["duplicate"] += len(pending) - len(account_list)
+            inserted = set(account_list)
+            for acc in pending:
+                if acc in inserted:
+                    inserted.discard(acc)
                 else:
-                    embed.add_field(
-                        name=f"⚠️ Keys chưa kích hoạt ({len(not_activated_keys)})",
-                        value=not_activated_keys_text,
-                        inline=False
-                    )
-
-            if error_keys:
-                error_keys_text = "\n".join([f"`{key}`" for key in error_keys])
-                if len(error_keys_text) > 1024:
-                    chunks = [error_keys_text[i:i+1024] for i in range(0, len(error_keys_text), 1024)]
-                    for i, chunk in enumerate(chunks):
-                        embed.add_field(
-                            name=f"⛔ Keys lỗi ({len(error_keys)}) - Phần {i+1}",
-                            value=chunk,
-                            inline=False
-                        )
+                    report.write(acc, "duplicate", "nhập trùng")
+
+            outcome = await bot.addtime_journal.run(interaction.id, bot.api.add_time, bot.executor)
+            results = [outcome.get(acc) for acc in account_list]
+            success_accounts, failed_accounts = classify_addtime_results(account_list, results)
+            failed_messages = dict(failed_accounts)
+            for acc in account_list:
+                ok = acc not in failed_messages
+                message = failed_messages.get(acc, "Thành công")
+                bot.store.record_addtime(interaction.id, interaction.user.id, acc, hours, ok, message)
+                if ok:
+                    report.write(acc, "success", message)
                 else:
-                    embed.add_field(
-                        name=f"⛔ Keys lỗi ({len(error_keys)})",
-                        value=error_keys_text,
-                        inline=False
-                    )
-
-            await interaction.followup.send(embed=embed, ephemeral=True)
+                    result = outcome.get(acc)
+                    report.write(acc, "unknown" if isinstance(result, tuple) and result[1] is None else "failed", message)
+            counts["success"] += len(success_accounts)
+            counts["failed"] += len(failed_accounts)
+
+            await bot.key_cache.invalidate(account_list)
+            bot.sweeper.reschedule(success_accounts)
+
+            now = time.monotonic()
+            if now - last_update >= CHECK_PROGRESS_INTERVAL:
+                last_update = now
+                progress_message = await send_progress(interaction, progress_message, discord.Embed(
+                    title="⏳ Đang thêm thời gian từ file...",
+                    description=progress_text(),
+                    color=discord.Color.orange()
+                ))
+
+        if reader.count == 0:
+            await interaction.followup.send("❌ Không tìm thấy tài khoản nào trong file.", ephemeral=True)
             return
 
-        # Xử lý một key duy nhất
-        async with aiohttp.ClientSession() as session:
-            result = await check_single_key(session, key_list[0])
-            
-            if result[1] == "active":
-                await interaction.followup.send(f"✅ Key `{result[0]}` còn **{result[2]}** ngày.", ephemeral=True)
-            elif result[1] == "not_activated":
-                await interaction.followup.send(f"⚠️ Key `{result[0]}` chưa được kích hoạt.", ephemeral=True)
-            elif result[1] == "inactive":
-                await interaction.followup.send(f"❌ Key `{result[0]}` đã hết hạn hoặc không tồn tại.", ephemeral=True)
-            else:
-                await interaction.followup.send("❌ Có lỗi xảy ra khi kiểm tra key.", ephemeral=True)
+        addtime_log.info(
+            "Đã thêm %d giờ cho %d/%d tài khoản từ file", hours, counts["success"], reader.count,
+            extra={"admin_id": interaction.user.id, "file": file.filename, **counts},
+        )
 
-    except Exception as e:
-        print(f"Error checking key: {e}")
-        await interaction.followup.send("❌ Có lỗi xảy ra khi kiểm tra key.", ephemeral=True)
+        description = progress_text()
+        if reader.truncated:
+            description += f"\n\n⚠️ Chỉ xử lý {BULK_MAX_ITEMS} tài khoản đầu tiên trong file."
+        embed = discord.Embed(
+            title="📊 Kết quả thêm thời gian",
+            description=description + "\n📎 Chi tiết trong file đính kèm.",
+            color=discord.Color.blue(),
+            timestamp=interaction.created_at
+        )
+        await send_result(interaction, progress_message, embed, discord.File(report.finish(), filename="addtime_results.csv"))
+
+        # Log kênh audit chỉ ghi tổng kết, danh sách đầy đủ nằm trong journal
+        if counts["success"]:
+            log_embed = discord.Embed(
+                title="📝 Log Thêm Thời Gian",
+                description=f"Thêm hàng loạt từ file `{file.filename}`",
+                color=discord.Color.blue(),
+                timestamp=interaction.created_at
+            )
+            log_embed.add_field(
+                name="Người thực hiện",
+                value=f"{interaction.user.mention} (`{interaction.user.name}`)",
+                inline=True
+            )
+            log_embed.add_field(
+                name="Số tài khoản",
+                value=f"`{counts['success']}/{reader.count}`",
+                inline=True
+            )
+            log_embed.add_field(
+                name="Số giờ thêm",
+                value=f"`{hours} giờ`",
+                inline=True
+            )
+            await bot.audit_log.log(log_embed)
+    finally:
+        report.close()
 
 
 @bot.tree.command(name="addtime", description="Thêm thời gian cho key")
 @app_commands.describe(
+    hours="Số giờ cần thêm",
     account="Tài khoản cần thêm thời gian (nhiều tài khoản cách nhau bằng khoảng trắng)",
-    hours="Số giờ cần thêm"
+    file="File text/CSV chứa danh sách tài khoản (thêm hàng loạt)",
+    force="Thêm lại cả tài khoản vừa được thêm cùng số giờ gần đây"
 )
+@timed_command
+@rate_limited()
 async def add_time(
     interaction: discord.Interaction,
-    account: str,
-    hours: int
+    hours: int,
+    account: str = None,
+    file: discord.Attachment = None,
+    force: bool = False
 ):
     try:
         # Kiểm tra quyền admin
@@ -501,167 +1767,382 @@ async def add_time(
             await interaction.response.send_message("❌ Số giờ phải lớn hơn 0!", ephemeral=True)
             return
             
-        await interaction.response.defer(ephemeral=True)
-        
-        # Tách các tài khoản nếu có nhiều tài khoản
-        account_list = [acc.strip() for acc in account.split() if acc.strip()]
+        await defer(interaction, ephemeral=True)
+
+        if file is not None:
+            await add_time_file(interaction, file, hours, force)
+            return
         
-        if len(account_list) > 30:
-            await interaction.followup.send("❌ Vui lòng thêm thời gian tối đa 30 tài khoản một lần.", ephemeral=True)
+        # Tách các tài khoản nếu có nhiều tài khoản, bỏ tài khoản nhập trùng (giữ thứ tự)
+        entered = [acc.strip() for acc in (account or "").split() if acc.strip()]
+        unique_accounts = list(dict.fromkeys(entered))
+        duplicates = len(entered) - len(unique_accounts)
+
+        if not unique_accounts:
+            await interaction.followup.send("❌ Vui lòng nhập tài khoản hoặc đính kèm file.", ephemeral=True)
             return
         
-        # Khởi tạo lists để lưu kết quả
-        success_accounts = []
-        failed_accounts = []
+        if len(unique_accounts) > MAX_BATCH_SIZE:
+            await interaction.followup.send(f"❌ Vui lòng thêm thời gian tối đa {MAX_BATCH_SIZE} tài khoản một lần.", ephemeral=True)
+            return
+
+        # Bỏ qua tài khoản vừa được thêm cùng số giờ (vd. admin chạy lại lệnh sau khi timeout)
+        recent = {} if force else await bot.addtime_journal.recent(unique_accounts, hours)
+        skipped_accounts = [
+            (acc, "vừa được thêm cùng số giờ" if recent[acc] == "done" else "lần thêm trước chưa rõ kết quả")
+            for acc in unique_accounts if acc in recent
+        ]
+        account_list = [acc for acc in unique_accounts if acc not in recent]
+
+        # Ghi journal trước khi gửi request, các tài khoản vẫn chạy đồng thời
+        await bot.addtime_journal.begin(interaction.id, interaction.user.id, account_list, hours)
+        outcome = await bot.addtime_journal.run(interaction.id, bot.api.add_time, bot.executor)
+        results = [outcome.get(acc) for acc in account_list]
+
+        success_accounts, failed_accounts = classify_addtime_results(account_list, results)
+        addtime_log.info(
+            "Đã thêm %d giờ cho %d/%d tài khoản", hours, len(success_accounts), len(account_list),
+            extra={
+                "admin_id": interaction.user.id,
+                "failed": [acc for acc, _ in failed_accounts],
+                "skipped": [acc for acc, _ in skipped_accounts],
+                "duplicates": duplicates,
+            },
+        )
+
+        # Lưu lịch sử thêm giờ (ghi nền, không chờ)
+        failed_messages = dict(failed_accounts)
+        for acc in account_list:
+            bot.store.record_addtime(
+                interaction.id, interaction.user.id, acc, hours,
+                acc not in failed_messages, failed_messages.get(acc, "Thành công")
+            )
+
+        # Thời hạn các tài khoản đã thay đổi, xoá kết quả cũ trong cache
+        await bot.key_cache.invalidate(account_list)
+        bot.sweeper.reschedule(success_accounts)
+
+        total = len(unique_accounts)
+        report = build_addtime_report(
+            total, success_accounts, failed_accounts, hours, interaction.created_at,
+            skipped_accounts=skipped_accounts, duplicates=duplicates
+        )
+
+        # Gửi kết quả cho người dùng
+        await send_report(interaction, report)
         
-        # Tạo session để tái sử dụng connection
-        async with aiohttp.ClientSession() as session:
-            # Hàm xử lý thêm thời gian cho một tài khoản
-            async def add_time_single(session, account):
-                api_url = f"https://api.autoit.pro/API/addtime.php?API={API_KEY}&TK={account}&SOGIO={hours}"
-                try:
-                    async with session.get(api_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                        if response.status == 200:
-                            data = await response.text()
-                            try:
-                                # Thử parse JSON từ phản hồi
-                                json_data = await response.json()
-                                # Kiểm tra nếu message là "OK" thì coi là thành công
-                                if json_data.get("message") == "OK":
-                                    return (account, True, "Thành công")
-                                else:
-                                    return (account, False, f"Lỗi: {data}")
-                            except:
-                                # Nếu không phải JSON, kiểm tra theo cách cũ
-                                if "success" in data.lower() or "ok" in data.lower():
-                                    return (account, True, "Thành công")
-                                else:
-                                    return (account, False, f"Lỗi: {data}")
-                        else:
-                            return (account, False, f"Mã lỗi: {response.status}")
-                except Exception as e:
-                    return (account, False, str(e))
+        # Đưa log vào hàng đợi, worker sẽ gửi vào channel
+        if success_accounts:
+            log_report = ReportBuilder(
+                "📝 Log Thêm Thời Gian", "Chi tiết thao tác:", timestamp=interaction.created_at
+            )
+            log_report.add_field(
+                "Người thực hiện", f"{interaction.user.mention} (`{interaction.user.name}`)", inline=True
+            )
+            log_report.add_field("Số tài khoản", f"`{len(success_accounts)}/{total}`", inline=True)
+            log_report.add_field("Số giờ thêm", f"`{hours} giờ`", inline=True)
             
-            # Chạy tất cả requests đồng thời
-            tasks = [add_time_single(session, acc) for acc in account_list]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+            # Thêm danh sách tài khoản thành công
+            log_report.add_section("Tài khoản đã thêm thời gian", (f"`{acc}`" for acc in success_accounts))
             
-            # Phân loại kết quả
-            for result in results:
-                if isinstance(result, tuple):
-                    acc = result[0]
-                    success = result[1]
-                    message = result[2]
-                    if success:
-                        success_accounts.append(acc)
-                    else:
-                        failed_accounts.append((acc, message))
-                else:
-                    # Xử lý trường hợp exception
-                    failed_accounts.append((account_list[results.index(result)], "Lỗi không xác định"))
-        
-        # Tạo embed để hiển thị kết quả
+            for log_embed in log_report.embeds():
+                await bot.audit_log.log(log_embed)
+
+    except Exception as e:
+        addtime_log.exception("Error in addtime command: %s", e)
+        await send_followup(interaction, "❌ Có lỗi xảy ra. Vui lòng thử lại sau.")
+
+@bot.tree.command(name="cachestats", description="Xem thống kê cache kiểm tra key")
+@timed_command
+async def cache_stats(interaction: discord.Interaction):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    stats = bot.key_cache.stats()
+    embed = discord.Embed(
+        title="📦 Thống kê cache key",
+        description=(
+            f"Số key trong cache: **{stats['size']}**\n"
+            f"✅ Hit: **{stats['hits']}**\n"
+            f"🔁 Gộp request: **{stats['coalesced']}**\n"
+            f"❌ Miss: **{stats['misses']}**\n"
+            f"🌐 Lấy từ shard khác: **{stats['shared_hits']}**\n"
+            f"🗑️ Bị loại (LRU): **{stats['evictions']}**\n"
+            f"📈 Tỉ lệ hit: **{stats['hit_rate']:.1%}**"
+        ),
+        color=discord.Color.blue()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="apistatus", description="Xem trạng thái kết nối tới API key")
+@timed_command
+async def api_status(interaction: discord.Interaction):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    state_labels = {
+        "closed": "🟢 Hoạt động",
+        "half_open": "🟡 Đang thử lại",
+        "open": "🔴 Tạm ngắt",
+    }
+    embed = discord.Embed(
+        title="🔌 Trạng thái API",
+        description=f"Tổng số lần retry: **{bot.api.retries}**",
+        color=discord.Color.blue()
+    )
+    for breaker in bot.api.breakers.values():
+        info = breaker.snapshot()
+        value = f"{state_labels[info['state']]}\n"
+        value += f"Lỗi liên tiếp: `{info['failures']}` | Tổng lỗi: `{info['total_failures']}`\n"
+        value += f"Bị từ chối: `{info['rejected']}`"
+        if info["state"] == "open":
+            value += f"\nMở lại sau: `{info['retry_after']:.0f}s`"
+        embed.add_field(name=info["name"], value=value, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+def format_ms(seconds) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+def format_window(window: float) -> str:
+    return f"{window / 60:g} phút"
+
+
+@bot.tree.command(name="status", description="Xem tình trạng hoạt động của bot")
+@timed_command
+async def bot_status(interaction: discord.Interaction):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    runtime = bot.runtime
+    uptime = int(time.perf_counter() - BOOT_STARTED)
+    embed = discord.Embed(
+        title="🩺 Tình trạng bot",
+        description=(
+            f"Thời gian chạy: **{uptime // 86400}d {uptime % 86400 // 3600}h {uptime % 3600 // 60}m**\n"
+            f"Lệnh đang xử lý: **{bot.lifecycle.in_flight()}**\n"
+            f"Key đang kiểm tra: **{bot.checks_in_flight}**\n"
+            f"Slot upstream: **{bot.scheduler.active}** đang dùng, **{bot.scheduler.waiting()}** đang chờ\n"
+            f"Log chờ gửi: **{bot.audit_log.pending()}** | Đơn chờ thanh toán: **{bot.reconciler.pending_count()}**"
+        ),
+        color=discord.Color.blue(),
+        timestamp=datetime.now()
+    )
+
+    lines = [f"Hiện tại: `{format_ms(runtime.lag)}` | Task: `{runtime.tasks}`"]
+    for window in WINDOWS:
+        info = runtime.summary(window)
+        lines.append(
+            f"{format_window(window)}: TB `{format_ms(info['lag_avg'])}` | p99 `{format_ms(info['lag_p99'])}` | "
+            f"max `{format_ms(info['lag_max'])}` | task max `{info['tasks_max'] or 0}`"
+        )
+    embed.add_field(name="⏱️ Event loop", value="\n".join(lines), inline=False)
+
+    for endpoint, latency in bot.api.windows.items():
+        lines = [f"Đang chờ: `{bot.api.in_flight[endpoint]}`"]
+        for window in WINDOWS:
+            info = latency.summary(window)
+            lines.append(
+                f"{format_window(window)}: `{info['count']}` req | p50 `{format_ms(info['p50'])}` | "
+                f"p99 `{format_ms(info['p99'])}` | lỗi `{info['error_ratio']:.1%}`"
+            )
+        embed.add_field(name=f"🌐 {endpoint}", value="\n".join(lines), inline=False)
+
+    if isinstance(bot, discord.AutoShardedClient):
+        latencies = ", ".join(
+            f"#{shard_id}: `{format_ms(latency if math.isfinite(latency) else None)}`"
+            for shard_id, latency in bot.latencies
+        )
+    else:
+        latencies = f"`{format_ms(bot.latency if math.isfinite(bot.latency) else None)}`"
+    embed.add_field(name="📡 Gateway", value=latencies or "-", inline=False)
+
+    rss_max = runtime.summary(max(WINDOWS))["rss_max"] or runtime.rss
+    embed.add_field(
+        name="💾 Bộ nhớ",
+        value=f"RSS: `{runtime.rss / 1048576:.1f} MB` (cao nhất {format_window(max(WINDOWS))}: `{rss_max / 1048576:.1f} MB`)",
+        inline=False
+    )
+    embed.set_footer(text=f"Lấy mẫu mỗi {runtime.interval:g}s")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="history", description="Xem lịch sử key đã giao cho user")
+@app_commands.describe(user="Người dùng cần xem lịch sử")
+@timed_command
+async def key_history(interaction: discord.Interaction, user: discord.Member):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    try:
+        await defer(interaction, ephemeral=True)
+        deliveries = await bot.store.get_user_deliveries(user.id)
+        if not deliveries:
+            await interaction.followup.send(f"ℹ️ Chưa có key nào được giao cho {user.name}.", ephemeral=True)
+            return
+
+        statuses = await bot.store.get_key_statuses(row["account"] for row in deliveries)
+        lines = []
+        for row in deliveries:
+            line = f"<t:{int(row['delivered_at'])}:d> `{row['account']}`"
+            status = statuses.get(row["account"])
+            if status and status["status"] == "active":
+                line += f" - **{status['days']}** ngày"
+            elif status:
+                line += f" - {status['status']}"
+            lines.append(line)
+
+        report = ReportBuilder(f"🗂️ Lịch sử key của {user.name}", f"Số key đã giao: **{len(deliveries)}**")
+        report.add_section("Danh sách key", lines)
+        await send_report(interaction, report)
+    except Exception as e:
+        log.exception("Error reading key history: %s", e)
+        await interaction.followup.send("❌ Có lỗi xảy ra. Vui lòng thử lại sau.", ephemeral=True)
+
+
+@bot.tree.command(name="importbank", description="Đối soát file sao kê ngân hàng (CSV)")
+@app_commands.describe(file="File CSV có cột reference, amount, description")
+@timed_command
+async def import_bank_statement(interaction: discord.Interaction, file: discord.Attachment):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    try:
+        await defer(interaction, ephemeral=True)
+        data = await file.read()
+        summary = await bot.reconciler.ingest(iter_statement_bytes(data))
+
         embed = discord.Embed(
-            title="📊 Kết quả thêm thời gian",
-            color=discord.Color.blue(),
-            timestamp=interaction.created_at
+            title="🧾 Kết quả đối soát",
+            description=(
+                f"✅ Khớp đơn: **{summary['matched']}**\n"
+                f"❔ Không khớp: **{summary['unmatched']}**\n"
+                f"🔁 Trùng lặp: **{summary['duplicates']}**\n"
+                f"⏭️ Bỏ qua: **{summary['ignored']}**\n"
+                f"⏳ Đơn đang chờ: **{bot.reconciler.pending_count()}**"
+            ),
+            color=discord.Color.blue()
         )
-        
-        # Thêm tổng kết lên đầu
-        total = len(account_list)
-        summary = f"Tổng số tài khoản: **{total}**\n"
-        summary += f"✅ Thành công: **{len(success_accounts)}**\n"
-        summary += f"❌ Thất bại: **{len(failed_accounts)}**\n"
-        summary += f"⏱️ Số giờ đã thêm: **{hours}** giờ/tài khoản"
-        
-        embed.description = summary
-        
-        # Thêm thông tin cho từng loại tài khoản
-        if success_accounts:
-            success_accounts_text = "\n".join([f"`{acc}`" for acc in success_accounts])
-            if len(success_accounts_text) > 1024:
-                chunks = [success_accounts_text[i:i+1024] for i in range(0, len(success_accounts_text), 1024)]
-                for i, chunk in enumerate(chunks):
-                    embed.add_field(
-                        name=f"✅ Tài khoản thành công ({len(success_accounts)}) - Phần {i+1}",
-                        value=chunk,
-                        inline=False
-                    )
-            else:
-                embed.add_field(
-                    name=f"✅ Tài khoản thành công ({len(success_accounts)})",
-                    value=success_accounts_text,
-                    inline=False
-                )
-        
-        if failed_accounts:
-            failed_accounts_text = "\n".join([f"`{acc}` - {msg}" for acc, msg in failed_accounts])
-            if len(failed_accounts_text) > 1024:
-                chunks = [failed_accounts_text[i:i+1024] for i in range(0, len(failed_accounts_text), 1024)]
-                for i, chunk in enumerate(chunks):
-                    embed.add_field(
-                        name=f"❌ Tài khoản thất bại ({len(failed_accounts)}) - Phần {i+1}",
-                        value=chunk,
-                        inline=False
-                    )
-            else:
-                embed.add_field(
-                    name=f"❌ Tài khoản thất bại ({len(failed_accounts)})",
-                    value=failed_accounts_text,
-                    inline=False
-                )
-        
-        # Gửi kết quả cho người dùng
         await interaction.followup.send(embed=embed, ephemeral=True)
-        
-        # Gửi log vào channel
-        if success_accounts:
-            log_channel = bot.get_channel(LOG_CHANNEL_ID)
-            if log_channel:
-                log_embed = discord.Embed(
-                    title="📝 Log Thêm Thời Gian",
-                    description="Chi tiết thao tác:",
-                    color=discord.Color.blue(),
-                    timestamp=interaction.created_at
-                )
-                log_embed.add_field(
-                    name="Người thực hiện",
-                    value=f"{interaction.user.mention} (`{interaction.user.name}`)",
-                    inline=True
-                )
-                log_embed.add_field(
-                    name="Số tài khoản",
-                    value=f"`{len(success_accounts)}/{total}`",
-                    inline=True
-                )
-                log_embed.add_field(
-                    name="Số giờ thêm",
-                    value=f"`{hours} giờ`",
-                    inline=True
-                )
-                
-                # Thêm danh sách tài khoản thành công
-                success_accounts_text = "\n".join([f"`{acc}`" for acc in success_accounts])
-                if len(success_accounts_text) > 1024:
-                    chunks = [success_accounts_text[i:i+1024] for i in range(0, len(success_accounts_text), 1024)]
-                    for i, chunk in enumerate(chunks):
-                        log_embed.add_field(
-                            name=f"Tài khoản đã thêm thời gian - Phần {i+1}",
-                            value=chunk,
-                            inline=False
-                        )
-                else:
-                    log_embed.add_field(
-                        name="Tài khoản đã thêm thời gian",
-                        value=success_accounts_text,
-                        inline=False
-                    )
-                
-                await log_channel.send(embed=log_embed)
-                
+    except ValueError as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
     except Exception as e:
-        print(f"Error in addtime command: {e}")
+        log.exception("Error importing bank statement: %s", e)
         await interaction.followup.send("❌ Có lỗi xảy ra. Vui lòng thử lại sau.", ephemeral=True)
 
-# Run the bot
-bot.run(DISCORD_TOKEN)
+
+@bot.tree.command(name="importkeys", description="Nhập key vào kho từ file")
+@app_commands.describe(
+    file="File text, mỗi dòng một key dạng `tk - mk`",
+    product="Loại key (tên sản phẩm trong bảng giá)"
+)
+@timed_command
+async def import_keys(interaction: discord.Interaction, file: discord.Attachment, product: str = "default"):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    try:
+        await defer(interaction, ephemeral=True)
+        data = await file.read()
+        summary = await bot.inventory.import_bytes(data, product)
+        await interaction.followup.send(
+            f"✅ Đã nhập **{summary['added']}** key vào kho "
+            f"(trùng: {summary['duplicates']}, dòng lỗi: {summary['invalid']}).",
+            ephemeral=True
+        )
+    except KeyImportError as e:
+        log.warning("Error importing keys: %s", e, extra={"added": e.summary["added"]})
+        await interaction.followup.send(
+            f"❌ Nhập key bị dừng: {e}\nĐã nhập **{e.summary['added']}** key vào kho trước khi lỗi "
+            f"(trùng: {e.summary['duplicates']}, dòng lỗi: {e.summary['invalid']}).",
+            ephemeral=True
+        )
+    except Exception as e:
+        log.exception("Error importing keys: %s", e)
+        await interaction.followup.send("❌ Có lỗi xảy ra. Vui lòng thử lại sau.", ephemeral=True)
+
+
+@bot.tree.command(name="stock", description="Xem số key còn trong kho")
+@timed_command
+async def key_stock(interaction: discord.Interaction):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    await defer(interaction, ephemeral=True)
+    stock = await bot.inventory.stock()
+    embed = discord.Embed(title="📦 Kho key", color=discord.Color.blue())
+    if not stock:
+        embed.description = "Kho đang trống."
+    for product, counts in stock.items():
+        embed.add_field(
+            name=product,
+            value=(
+                f"✅ Còn trống: **{counts.get('available', 0)}**\n"
+                f"⏳ Đang giữ chỗ: **{counts.get('reserved', 0)}**\n"
+                f"📨 Đã giao: **{counts.get('delivered', 0)}**"
+            ),
+            inline=False
+        )
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(name="deliver", description="Giao key từ kho cho user")
+@app_commands.describe(
+    user="Người dùng nhận key",
+    amount="Số lượng key cần giao"
+)
+@timed_command
+async def deliver_keys(interaction: discord.Interaction, user: discord.Member, amount: int):
+    # Kiểm tra quyền admin
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ Bạn không có quyền sử dụng lệnh này!", ephemeral=True)
+        return
+
+    if amount <= 0:
+        await interaction.response.send_message("❌ Số lượng key phải lớn hơn 0!", ephemeral=True)
+        return
+
+    try:
+        await defer(interaction, ephemeral=True)
+        keys = await deliver_from_inventory(
+            user, amount, f"interaction:{interaction.id}",
+            sender_id=interaction.user.id,
+            sender_text=f"{interaction.user.mention} (`{interaction.user.name}`)",
+            timestamp=interaction.created_at
+        )
+        await interaction.followup.send(f"✅ Đã giao {len(keys)} key cho {user.name}!", ephemeral=True)
+    except OutOfStockError as e:
+        await interaction.followup.send(f"❌ {e}.", ephemeral=True)
+    except discord.Forbidden:
+        await interaction.followup.send(
+            f"❌ Không thể gửi tin nhắn đến {user.name}. Người dùng có thể đã chặn DM.",
+            ephemeral=True
+        )
+    except Exception as e:
+        delivery_log.exception("Error delivering keys: %s", e)
+        await interaction.followup.send("❌ Có lỗi xảy ra khi giao key.", ephemeral=True)
+
+
+if __name__ == "__main__":
+    # Log JSON qua hàng đợi, ẩn token / API key; discord.py dùng chung handler này
+    log_listener = setup_logging(
+        LOG_LEVEL, fmt=LOG_FORMAT, secrets=(DISCORD_TOKEN, API_KEY, BANK_WEBHOOK_SECRET)
+    )
+    try:
+        # Run the bot
+        bot.run(DISCORD_TOKEN, log_handler=None)
+    finally:
+        log_listener.stop()
\ No newline at end of file
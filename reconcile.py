@@ -0,0 +1,434 @@
+"""
+Đối soát chuyển khoản ngân hàng với các đơn /thanhtoan đang chờ.
+
+Giao dịch được đưa vào qua webhook (POST JSON) hoặc import file sao kê CSV.
+Đơn chờ được đánh chỉ mục trong bộ nhớ theo (nội dung CK đã chuẩn hoá, số tiền)
+nên mỗi dòng sao kê chỉ tốn một số lần tra dict, không phụ thuộc số đơn đang mở.
+"""
+import asyncio
+import csv
+import hmac
+import io
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+
+from aiohttp import web
+
+from bot_logging import correlation_id
+from vietqr import to_ascii
+
+RECONCILE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payment_orders (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    user_name TEXT,
+    memo TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    product TEXT NOT NULL DEFAULT 'default',
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    paid_at REAL,
+    transaction_ref TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_match ON payment_orders (memo, amount, status);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON payment_orders (status, expires_at);
+
+CREATE TABLE IF NOT EXISTS bank_transactions (
+    reference TEXT PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    description TEXT,
+    order_id INTEGER,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bank_transactions_received ON bank_transactions (received_at);
+"""
+
+# Thời gian giữ dấu chống xử lý trùng mã giao dịch trong state dùng chung
+REFERENCE_TTL = 7 * 86400
+# Số mã giao dịch đã xử lý giữ trong bộ nhớ tối đa (cũ nhất bị bỏ trước)
+MAX_SEEN_REFS = 100000
+
+# Số token liên tiếp tối đa ghép lại khi dò nội dung CK trong mô tả giao dịch
+MAX_MEMO_TOKENS = 4
+
+# Tên cột được chấp nhận trong file sao kê
+REFERENCE_COLUMNS = ("reference", "ref", "id", "transaction_id", "ma gd", "so tham chieu")
+AMOUNT_COLUMNS = ("amount", "credit", "so tien", "so tien ghi co")
+DESCRIPTION_COLUMNS = ("description", "memo", "content", "noi dung", "mo ta")
+
+log = logging.getLogger("bot.reconcile")
+
+
+def normalize_memo(text: str) -> str:
+    """
+    Chuẩn hoá nội dung CK: bỏ dấu, chữ thường, chỉ giữ chữ và số
+    """
+    return re.sub(r"[^a-z0-9]", "", to_ascii(text).lower())
+
+
+def order_memo(order_id: int) -> str:
+    """
+    Nội dung CK riêng cho từng đơn: "DH" + mã đơn ở hệ 36 (chỉ chữ và số nên
+    không bị ngân hàng hay normalize_memo làm trùng với đơn khác)
+    """
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    code = ""
+    order_id = int(order_id)
+    while True:
+        order_id, digit = divmod(order_id, 36)
+        code = digits[digit] + code
+        if not order_id:
+            break
+    return f"DH{code}"
+
+
+def memo_candidates(description: str):
+    """
+    Các nội dung CK có thể có trong mô tả giao dịch.
+    Ngân hàng hay chèn tiền tố và tách ký tự đặc biệt thành khoảng trắng,
+    nên ghép tối đa MAX_MEMO_TOKENS token liên tiếp.
+    """
+    tokens = [t for t in re.split(r"[^a-z0-9]+", to_ascii(description).lower()) if t]
+    seen = set()
+    for i in range(len(tokens)):
+        candidate = ""
+        for token in tokens[i:i + MAX_MEMO_TOKENS]:
+            candidate += token
+            if candidate not in seen:
+                seen.add(candidate)
+                yield candidate
+
+
+def parse_amount(value) -> int:
+    """
+    Đọc số tiền dạng "1,250,000", "1.250.000 VND" hoặc "1250000.00"
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = re.sub(r"[^0-9.,-]", "", str(value))
+    # Bỏ phần thập phân (tối đa 2 chữ số sau dấu phân cách cuối)
+    text = re.sub(r"[.,]\d{1,2}$", "", text)
+    digits = re.sub(r"\D", "", text)
+    if not digits:
+        return 0
+    return -int(digits) if text.startswith("-") else int(digits)
+
+
+class PaymentReconciler:
+    """
+    Quản lý đơn thanh toán đang chờ và khớp giao dịch ngân hàng với đơn.
+    on_paid(order, transaction) được gọi (async) khi một đơn được thanh toán.
+    Khi chạy nhiều process (shared là state backend dùng chung), đơn do process
+    khác tạo được nạp thêm từ database trước mỗi lần đối soát, và mã giao dịch
+    được đánh dấu trong shared để không process nào xử lý trùng.
+    """
+
+    def __init__(self, store, *, order_ttl: float = 24 * 3600, on_paid=None, shared=None):
+        self.store = store
+        self.order_ttl = order_ttl
+        self.on_paid = on_paid
+        self.shared = shared
+        store.add_schema(RECONCILE_SCHEMA)
+        # Database tạo trước khi có bảng giá theo sản phẩm
+        store.add_column("payment_orders", "product", "TEXT NOT NULL DEFAULT 'default'")
+        # (memo, amount) -> deque các đơn đang chờ, đơn cũ nhất trước
+        self._index = {}
+        self._orders = {}
+        # Mã giao dịch đã xử lý -> thời điểm nhận, cũ nhất trước
+        self._seen_refs = OrderedDict()
+        self._loaded_at = 0.0
+        self.matched = 0
+        self.unmatched = 0
+        self.duplicates = 0
+
+    async def load(self, recent_refs_days: float = 7):
+        """
+        Nạp các đơn đang chờ và mã giao dịch gần đây từ database
+        """
+        await self.refresh()
+        refs = await self.store.fetchall(
+            "SELECT reference, received_at FROM bank_transactions WHERE received_at >= ? ORDER BY received_at",
+            (time.time() - recent_refs_days * 86400,),
+        )
+        for row in refs:
+            self._remember(row["reference"], row["received_at"])
+        self.expire()
+
+    async def refresh(self):
+        """
+        Nạp các đơn đang chờ chưa có trong bộ nhớ (vd. do process khác tạo)
+        """
+        since = self._loaded_at
+        self._loaded_at = time.time()
+        rows = await self.store.fetchall(
+            "SELECT * FROM payment_orders WHERE status = 'pending' AND created_at >= ? ORDER BY created_at",
+            # Lùi lại một chút vì process khác ghi đơn theo lô
+            (since - 60 if since else 0,),
+        )
+        for row in rows:
+            if row["id"] not in self._orders:
+                self._add(row)
+
+    def _remember(self, reference: str, at: float):
+        """
+        Ghi nhận mã giao dịch đã xử lý; bỏ mã quá REFERENCE_TTL hoặc vượt MAX_SEEN_REFS
+        """
+        self._seen_refs[reference] = at
+        self._seen_refs.move_to_end(reference)
+        cutoff = time.time() - REFERENCE_TTL
+        while self._seen_refs:
+            oldest = next(iter(self._seen_refs.values()))
+            if oldest >= cutoff and len(self._seen_refs) <= MAX_SEEN_REFS:
+                break
+            self._seen_refs.popitem(last=False)
+
+    def _add(self, order: dict):
+        self._orders[order["id"]] = order
+        self._index.setdefault((order["memo"], order["amount"]), deque()).append(order)
+
+    def _remove(self, order: dict):
+        self._orders.pop(order["id"], None)
+        bucket = self._index.get((order["memo"], order["amount"]))
+        if bucket is not None:
+            try:
+                bucket.remove(order)
+            except ValueError:
+                pass
+            if not bucket:
+                del self._index[(order["memo"], order["amount"])]
+
+    def pending_count(self) -> int:
+        return len(self._orders)
+
+    def create_order(
+        self, order_id: int, user_id: int, user_name: str, memo: str, amount: int, quantity: int,
+        product: str = "default",
+    ) -> dict:
+        """
+        Tạo đơn chờ thanh toán (ghi database ở nền)
+        """
+        now = time.time()
+        order = {
+            "id": order_id,
+            "user_id": user_id,
+            "user_name": user_name,
+            "memo": normalize_memo(memo),
+            "amount": int(amount),
+            "quantity": quantity,
+            "product": product,
+            "status": "pending",
+            "created_at": now,
+            "expires_at": now + self.order_ttl,
+        }
+        self._add(order)
+        self.store.enqueue(
+            "INSERT OR REPLACE INTO payment_orders "
+            "(id, user_id, user_name, memo, amount, quantity, product, status, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)",
+            (order_id, user_id, user_name, order["memo"], order["amount"], quantity, product, now, order["expires_at"]),
+        )
+        return order
+
+    def expire(self) -> int:
+        """
+        Đánh dấu hết hạn các đơn quá order_ttl
+        """
+        now = time.time()
+        expired = [order for order in self._orders.values() if order["expires_at"] <= now]
+        for order in expired:
+            self._remove(order)
+            order["status"] = "expired"
+        if expired:
+            self.store.enqueue(
+                "UPDATE payment_orders SET status = 'expired' WHERE status = 'pending' AND expires_at <= ?",
+                (now,),
+            )
+        return len(expired)
+
+    def match(self, amount: int, description: str):
+        """
+        Tìm đơn khớp (nội dung CK, số tiền), trả về None nếu không có
+        """
+        now = time.time()
+        for memo in memo_candidates(description):
+            bucket = self._index.get((memo, amount))
+            while bucket:
+                order = bucket[0]
+                if order["expires_at"] <= now:
+                    # Đơn đã hết hạn nhưng chưa được dọn
+                    self._remove(order)
+                    order["status"] = "expired"
+                    continue
+                # Đơn cũ (nội dung CK là tên user) có thể trùng nội dung giữa nhiều
+                # người, không đoán người trả tiền mà để admin xử lý thủ công
+                if len({other["user_id"] for other in bucket}) > 1:
+                    log.warning(
+                        "Giao dịch khớp đơn của nhiều người, bỏ qua",
+                        extra={"memo": memo, "amount": amount, "orders": [other["id"] for other in bucket]},
+                    )
+                    return None
+                return order
+        return None
+
+    async def ingest(self, transactions) -> dict:
+        """
+        Xử lý danh sách giao dịch dạng dict (reference, amount, description).
+        Trả về thống kê số giao dịch khớp / không khớp / trùng.
+        """
+        summary = {"matched": 0, "unmatched": 0, "duplicates": 0, "ignored": 0}
+        paid = []
+        if self.shared is not None:
+            await self.refresh()
+        now = time.time()
+        for count, txn in enumerate(transactions, 1):
+            reference = str(txn.get("reference") or "").strip()
+            amount = parse_amount(txn.get("amount", 0))
+            description = str(txn.get("description") or "")
+            if not reference or amount <= 0:
+                summary["ignored"] += 1
+                continue
+            if reference in self._seen_refs:
+                summary["duplicates"] += 1
+                continue
+            self._remember(reference, now)
+            if self.shared is not None and not await self.shared.add(f"bankref:{reference}", 1, REFERENCE_TTL):
+                # Process khác đã nhận giao dịch này
+                summary["duplicates"] += 1
+                continue
+
+            order = self.match(amount, description)
+            order_id = None
+            if order is not None:
+                order_id = order["id"]
+                self._remove(order)
+                order["status"] = "paid"
+                order["paid_at"] = now
+                order["transaction_ref"] = reference
+                self.store.enqueue(
+                    "UPDATE payment_orders SET status = 'paid', paid_at = ?, transaction_ref = ? WHERE id = ?",
+                    (now, reference, order_id),
+                )
+                summary["matched"] += 1
+                paid.append((order, txn))
+            else:
+                summary["unmatched"] += 1
+            self.store.enqueue(
+                "INSERT OR IGNORE INTO bank_transactions (reference, amount, description, order_id, received_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (reference, amount, description, order_id, now),
+            )
+            # Nhường event loop khi import file lớn
+            if count % 1000 == 0:
+                await asyncio.sleep(0)
+
+        self.matched += summary["matched"]
+        self.unmatched += summary["unmatched"]
+        self.duplicates += summary["duplicates"]
+        log.info("Đã đối soát giao dịch ngân hàng", extra=summary)
+        if self.on_paid is not None:
+            for order, txn in paid:
+                token = correlation_id.set(f"order-{order['id']}")
+                try:
+                    await self.on_paid(order, txn)
+                except Exception:
+                    log.exception("Error handling paid order", extra={"order_id": order["id"]})
+                finally:
+                    correlation_id.reset(token)
+        return summary
+
+    def mark_fulfilled(self, order_id: int, delivered: bool = True):
+        """
+        Ghi nhận đơn đã thanh toán đã được giao key (hoặc giao lỗi, cần giao thủ công)
+        """
+        self.store.enqueue(
+            "UPDATE payment_orders SET status = ? WHERE id = ? AND status = 'paid'",
+            ("fulfilled" if delivered else "failed", order_id),
+        )
+
+    async def unfulfilled(self, since: float):
+        """
+        Các đơn đã thanh toán từ thời điểm since nhưng chưa giao key (vd. bot tắt giữa chừng)
+        """
+        return await self.store.fetchall(
+            "SELECT * FROM payment_orders WHERE status = 'paid' AND paid_at >= ? ORDER BY paid_at", (since,)
+        )
+
+    async def run_expiry(self, interval: float = 300):
+        """
+        Task nền dọn đơn hết hạn
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.expire()
+
+
+def _find_column(header, names):
+    normalized = [to_ascii(h).strip().lower() for h in header]
+    for i, column in enumerate(normalized):
+        if column in names:
+            return i
+    return None
+
+
+def iter_statement(stream):
+    """
+    Đọc file sao kê CSV từng dòng (không nạp cả file vào bộ nhớ).
+    Dòng đầu phải là tiêu đề có cột mã giao dịch, số tiền và nội dung.
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    ref_col = _find_column(header, REFERENCE_COLUMNS)
+    amount_col = _find_column(header, AMOUNT_COLUMNS)
+    desc_col = _find_column(header, DESCRIPTION_COLUMNS)
+    if ref_col is None or amount_col is None or desc_col is None:
+        raise ValueError("File sao kê phải có cột reference, amount và description")
+    width = max(ref_col, amount_col, desc_col)
+    for row in reader:
+        if len(row) <= width:
+            continue
+        yield {"reference": row[ref_col], "amount": row[amount_col], "description": row[desc_col]}
+
+
+def iter_statement_bytes(data: bytes):
+    return iter_statement(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline=""))
+
+
+def create_webhook_app(reconciler: PaymentReconciler, secret: str = None, app: web.Application = None) -> web.Application:
+    """
+    Thêm endpoint POST /bank/webhook nhận giao dịch dạng JSON:
+    {"reference": ..., "amount": ..., "description": ...} hoặc {"transactions": [...]}
+    Không có secret thì không mở endpoint (ai gọi được cũng giả được giao dịch và nhận key).
+    """
+    app = app or web.Application()
+    if not secret:
+        log.warning("Chưa đặt BANK_WEBHOOK_SECRET, không mở endpoint /bank/webhook")
+        return app
+    expected = secret.encode("utf-8")
+
+    async def handler(request):
+        provided = request.headers.get("X-Webhook-Secret", "").encode("utf-8")
+        if not hmac.compare_digest(provided, expected):
+            return web.json_response({"error": "unauthorized"}, status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.json_response({"error": "invalid json"}, status=400)
+        if isinstance(payload, dict) and "transactions" in payload:
+            transactions = payload["transactions"]
+        elif isinstance(payload, list):
+            transactions = payload
+        else:
+            transactions = [payload]
+        if not all(isinstance(txn, dict) for txn in transactions):
+            return web.json_response({"error": "invalid transaction"}, status=400)
+        summary = await reconciler.ingest(transactions)
+        return web.json_response(summary)
+
+    app.router.add_post("/bank/webhook", handler)
+    return app
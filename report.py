@@ -0,0 +1,266 @@
+"""
+Dựng embed kết quả (check, addtime, log...) trong giới hạn của Discord.
+
+Các dòng được gom vào field tối đa 1024 ký tự mà không cắt đôi dòng nào,
+field được xếp vào embed tối đa 25 field / 6000 ký tự, embed được gom thành
+tin nhắn tối đa 10 embed / 6000 ký tự. Báo cáo quá dài cho một tin nhắn được
+gửi dạng phân trang có nút bấm, trang chỉ được dựng khi người dùng chuyển tới.
+"""
+import discord
+
+# Giới hạn của Discord
+MAX_TITLE_CHARS = 256
+MAX_DESCRIPTION_CHARS = 4096
+MAX_FIELD_NAME_CHARS = 256
+MAX_FIELD_CHARS = 1024
+MAX_FIELDS_PER_EMBED = 25
+MAX_EMBED_CHARS = 6000
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+
+ELLIPSIS = "…"
+# Chừa chỗ cho footer "Trang x/y" khi phân trang
+PAGE_FOOTER_RESERVE = 32
+
+
+def truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - len(ELLIPSIS)] + ELLIPSIS
+
+
+def pack_lines(lines, limit: int = MAX_FIELD_CHARS):
+    """
+    Gom các dòng thành các khối tối đa limit ký tự, không cắt đôi dòng
+    (chỉ dòng dài hơn limit mới bị rút gọn)
+    """
+    chunk, size = [], 0
+    for line in lines:
+        line = truncate(line, limit)
+        # +1 cho ký tự xuống dòng
+        if chunk and size + 1 + len(line) > limit:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        size += len(line) + (1 if chunk else 0)
+        chunk.append(line)
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def pack_embeds(embeds):
+    """
+    Chia embed thành các nhóm vừa một tin nhắn
+    """
+    group, size = [], 0
+    for embed in embeds:
+        length = len(embed)
+        if group and (len(group) >= MAX_EMBEDS_PER_MESSAGE or size + length > MAX_EMBED_CHARS_PER_MESSAGE):
+            yield group
+            group, size = [], 0
+        group.append(embed)
+        size += length
+    if group:
+        yield group
+
+
+def limit_lines(lines, limit: int = MAX_FIELD_CHARS) -> str:
+    """
+    Nội dung cho một field duy nhất: giữ các dòng đầu vừa limit ký tự và ghi
+    số dòng bị bỏ (dùng khi không cần liệt kê đủ, vd. log)
+    """
+    lines = list(lines)
+    # Chừa chỗ cho dòng "... và N dòng khác"
+    shown = next(pack_lines(lines, limit - 32), "")
+    count = shown.count("\n") + 1 if shown else 0
+    if count < len(lines):
+        shown += f"\n... và {len(lines) - count} dòng khác"
+    return shown
+
+
+class ReportBuilder:
+    """
+    Báo cáo gồm tiêu đề, mô tả và các mục (danh sách dòng).
+    Mục dài được chia thành nhiều field "Phần 1, 2..."; field tràn sang embed
+    tiếp theo khi vượt 25 field hoặc 6000 ký tự.
+
+        report = ReportBuilder("📊 Kết quả", summary)
+        report.add_section("✅ Thành công", lines)
+        await send_report(interaction, report)
+    """
+
+    def __init__(self, title: str, description: str = None, *, color=None, timestamp=None, footer: str = None):
+        self.title = truncate(title, MAX_TITLE_CHARS)
+        self.description = truncate(description, MAX_DESCRIPTION_CHARS) if description else None
+        self.color = color if color is not None else discord.Color.blue()
+        self.timestamp = timestamp
+        self.footer = footer
+        self._fields = []
+        self._pages = None
+        self._built = {}
+
+    def add_field(self, name: str, value: str, inline: bool = False):
+        self._fields.append((truncate(name, MAX_FIELD_NAME_CHARS), truncate(value, MAX_FIELD_CHARS), inline))
+        self._pages = None
+        self._built = {}
+        return self
+
+    def add_section(self, name: str, lines, inline: bool = False):
+        """
+        Thêm danh sách dòng; dài hơn một field thì chia thành nhiều phần
+        """
+        chunks = list(pack_lines(lines))
+        if len(chunks) == 1:
+            self.add_field(name, chunks[0], inline)
+        else:
+            for i, chunk in enumerate(chunks):
+                self.add_field(f"{name} - Phần {i + 1}", chunk, inline)
+        return self
+
+    def _new_embed(self, first: bool) -> discord.Embed:
+        embed = discord.Embed(
+            title=self.title if first else truncate(f"{self.title} (tiếp)", MAX_TITLE_CHARS),
+            description=self.description if first else None,
+            color=self.color,
+            timestamp=self.timestamp,
+        )
+        if self.footer:
+            embed.set_footer(text=self.footer)
+        return embed
+
+    def _header_length(self, first: bool) -> int:
+        # Bằng len() của embed rỗng do _new_embed(first) tạo ra
+        title = self.title if first else truncate(f"{self.title} (tiếp)", MAX_TITLE_CHARS)
+        description = self.description if first else None
+        return len(title) + len(description or "") + len(self.footer or "")
+
+    def _layout(self) -> list:
+        """
+        Chia field vào các embed chỉ dựa trên độ dài: [(field đầu, field cuối + 1, độ dài embed)].
+        Field tràn sang embed tiếp theo khi vượt 25 field hoặc 6000 ký tự.
+        """
+        if self._pages is None:
+            pages = []
+            start, length = 0, self._header_length(True)
+            for i, (name, value, _) in enumerate(self._fields):
+                if i - start >= MAX_FIELDS_PER_EMBED or length + len(name) + len(value) > MAX_EMBED_CHARS - PAGE_FOOTER_RESERVE:
+                    pages.append((start, i, length))
+                    start, length = i, self._header_length(False)
+                length += len(name) + len(value)
+            pages.append((start, len(self._fields), length))
+            self._pages = pages
+        return self._pages
+
+    def _embed(self, index: int) -> discord.Embed:
+        embed = self._built.get(index)
+        if embed is None:
+            start, end, _ = self._layout()[index]
+            embed = self._new_embed(index == 0)
+            for name, value, inline in self._fields[start:end]:
+                embed.add_field(name=name, value=value, inline=inline)
+            self._built[index] = embed
+        return embed
+
+    def embeds(self) -> list:
+        """
+        Toàn bộ báo cáo dưới dạng các embed hợp lệ
+        """
+        return [self._embed(i) for i in range(self.page_count())]
+
+    def messages(self) -> list:
+        """
+        Các nhóm embed, mỗi nhóm gửi được trong một tin nhắn
+        """
+        return list(pack_embeds(self.embeds()))
+
+    def single_message(self):
+        """
+        Các embed nếu cả báo cáo vừa một tin nhắn, ngược lại None (không dựng embed nào)
+        """
+        layout = self._layout()
+        if len(layout) > MAX_EMBEDS_PER_MESSAGE or sum(length for _, _, length in layout) > MAX_EMBED_CHARS_PER_MESSAGE:
+            return None
+        return self.embeds()
+
+    def page(self, index: int) -> discord.Embed:
+        """
+        Dựng một trang khi cần hiển thị, kèm số trang ở footer
+        """
+        embed = self._embed(index)
+        if self.page_count() > 1:
+            text = f"Trang {index + 1}/{self.page_count()}"
+            embed.set_footer(text=f"{self.footer} • {text}" if self.footer else text)
+        return embed
+
+    def page_count(self) -> int:
+        return len(self._layout())
+
+
+class ReportPaginator(discord.ui.View):
+    """
+    Phân trang có nút bấm; render(index) chỉ được gọi khi cần hiển thị trang đó
+    """
+
+    def __init__(self, render, page_count: int, *, owner_id: int = None, timeout: float = 600):
+        super().__init__(timeout=timeout)
+        self.render = render
+        self.page_count = page_count
+        self.owner_id = owner_id
+        self.index = 0
+        self.message = None
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.index <= 0
+        self.next_page.disabled = self.index >= self.page_count - 1
+        self.position.label = f"{self.index + 1}/{self.page_count}"
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if self.owner_id is not None and interaction.user.id != self.owner_id:
+            await interaction.response.send_message("❌ Chỉ người dùng lệnh mới chuyển trang được.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction, index: int):
+        self.index = max(0, min(index, self.page_count - 1))
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.render(self.index), view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index - 1)
+
+    @discord.ui.button(label="1/1", style=discord.ButtonStyle.secondary, disabled=True)
+    async def position(self, interaction: discord.Interaction, button: discord.ui.Button):
+        pass
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.index + 1)
+
+    async def on_timeout(self):
+        # Hết hạn thì bỏ nút, giữ nguyên trang đang xem
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+
+async def send_report(interaction: discord.Interaction, report: ReportBuilder, *, message=None, ephemeral: bool = True, **kwargs):
+    """
+    Gửi báo cáo qua followup (hoặc sửa `message`, vd. tin nhắn tiến độ).
+    Vừa một tin nhắn thì gửi tất cả embed một lần; dài hơn thì gửi trang đầu
+    kèm nút chuyển trang, vẫn chỉ một lần gọi API.
+    """
+    embeds = report.single_message()
+    if embeds is not None:
+        if message is not None:
+            await message.edit(embeds=embeds, **kwargs)
+            return message
+        return await interaction.followup.send(embeds=embeds, ephemeral=ephemeral, wait=True, **kwargs)
+
+    view = ReportPaginator(report.page, report.page_count(), owner_id=interaction.user.id)
+    if message is not None:
+        await message.edit(embed=report.page(0), view=view, **kwargs)
+    else:
+        message = await interaction.followup.send(embed=report.page(0), view=view, ephemeral=ephemeral, wait=True, **kwargs)
+    view.message = message
+    return message
@@ -0,0 +1,168 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+# Các mã HTTP coi là lỗi tạm thời, có thể thử lại
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """
+    Lỗi tạm thời từ upstream (5xx, 429, mất kết nối, timeout)
+    """
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(Exception):
+    """
+    Circuit breaker đang mở, từ chối request ngay lập tức
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' đang mở, thử lại sau {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    """
+    Exponential backoff với full jitter: delay = random(0, min(max_delay, base * 2^attempt))
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 5.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho một endpoint.
+    - closed: cho request đi qua, đếm lỗi liên tiếp
+    - open: sau failure_threshold lỗi liên tiếp, từ chối ngay trong reset_timeout giây
+    - half_open: hết reset_timeout thì cho một request thử, thành công thì đóng lại
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        """
+        Gọi trước mỗi request, raise CircuitOpenError nếu phải từ chối
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.name, self.retry_after() or self.reset_timeout)
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            # Request thử thất bại hoặc quá nhiều lỗi liên tiếp: mở lại circuit
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """
+        Bỏ lượt thử đang giữ (vd. request bị huỷ giữa chừng)
+        """
+        self._probing = False
+
+    def snapshot(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "failures": self.failures,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after(),
+        }
+
+
+def is_retryable(exc: BaseException, idempotent: bool = True) -> bool:
+    """
+    Có nên thử lại sau lỗi này không.
+    Với request không idempotent (addtime) chỉ thử lại khi chắc chắn request
+    chưa tới được server (không kết nối được, hoặc server từ chối vì quá tải).
+    """
+    if isinstance(exc, RetryableError):
+        return idempotent or exc.status in (429, 503)
+    if isinstance(exc, aiohttp.ClientConnectorError):
+        return True
+    if isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return idempotent
+    return False
+
+
+async def call_with_retry(func, *, policy: RetryPolicy, breaker: CircuitBreaker = None, idempotent: bool = True, on_retry=None):
+    """
+    Gọi func() với backoff + jitter, chỉ thử lại với lỗi tạm thời.
+    Lỗi tạm thời được ghi nhận vào breaker; breaker mở thì dừng ngay.
+    """
+    for attempt in range(policy.attempts):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception as e:
+            transient = isinstance(e, (RetryableError, aiohttp.ClientError, asyncio.TimeoutError))
+            if breaker is not None:
+                if transient:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if attempt == policy.attempts - 1 or not is_retryable(e, idempotent):
+                raise
+            if on_retry is not None:
+                on_retry(attempt, e)
+            await asyncio.sleep(policy.delay(attempt))
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
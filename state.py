@@ -0,0 +1,196 @@
+"""
+Trạng thái dùng chung giữa các shard / process.
+
+MemoryStateBackend (mặc định) chỉ sống trong một process. SQLiteStateBackend
+lưu vào database của BotStore nên mọi process trỏ cùng DB_PATH chia sẻ cache
+trạng thái key, token bucket gọi API và dấu chống xử lý trùng.
+Giá trị được lưu dạng JSON.
+"""
+import json
+import time
+
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_shared_state_expires ON shared_state (expires_at);
+
+CREATE TABLE IF NOT EXISTS shared_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Số lần ghi giữa hai lần dọn các giá trị đã hết hạn
+PURGE_EVERY = 1000
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, capacity: float, cost: float = 1):
+    """
+    Nạp lại token bucket, trả về (số token còn sau khi lấy cost token, số giây phải chờ).
+    Không đủ token thì không trừ gì. cost âm là trả lại token (không vượt capacity).
+    """
+    tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+    cost = min(cost, capacity)
+    if tokens >= cost:
+        return min(capacity, tokens - cost), 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryStateBackend:
+    """
+    Trạng thái trong bộ nhớ của process hiện tại
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._values = {}
+        self._buckets = {}
+        self._writes = 0
+
+    def _store(self, key: str, value, ttl: float):
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            now = time.time()
+            for expired in [k for k, (expires_at, _) in self._values.items() if expires_at <= now]:
+                del self._values[expired]
+        self._values[key] = (time.time() + ttl, value)
+
+    def _alive(self, key: str):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._values[key]
+            return None
+        return entry
+
+    async def get(self, key: str):
+        entry = self._alive(key)
+        return entry[1] if entry else None
+
+    async def set(self, key: str, value, ttl: float):
+        self._store(key, value, ttl)
+
+    async def add(self, key: str, value, ttl: float) -> bool:
+        """
+        Chỉ ghi nếu key chưa tồn tại (hoặc đã hết hạn); True nếu ghi được
+        """
+        if self._alive(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def delete(self, keys):
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def take_token(self, name: str, rate: float, capacity: float, cost: float = 1) -> float:
+        """
+        Lấy cost token (mặc định 1); trả về 0 nếu lấy được, ngược lại số giây cần chờ
+        """
+        now = time.time()
+        tokens, updated_at = self._buckets.get(name, (capacity, now))
+        tokens, wait = _refill(tokens, updated_at, now, rate, capacity, cost)
+        self._buckets[name] = (tokens, now)
+        return wait
+
+
+class SQLiteStateBackend:
+    """
+    Trạng thái dùng chung qua SQLite (WAL) của BotStore.
+    Mọi thao tác ghi ngay (không qua hàng đợi ghi theo lô) để process khác thấy được.
+    """
+
+    shared = True
+
+    def __init__(self, store):
+        self.store = store
+        store.add_schema(STATE_SCHEMA)
+        self._writes = 0
+
+    async def _write(self, func):
+        self._writes += 1
+        purge = self._writes % PURGE_EVERY == 0
+
+        def run(conn):
+            with conn:
+                if purge:
+                    conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),))
+                return func(conn)
+
+        return await self.store.run(run)
+
+    async def get(self, key: str):
+        def read(conn):
+            return conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+
+        row = await self.store.run(read)
+        return json.loads(row[0]) if row else None
+
+    async def set(self, key: str, value, ttl: float):
+        data = json.dumps(value)
+        await self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, data, time.time() + ttl),
+        ))
+
+    async def add(self, key: str, value, ttl: float) -> bool:
+        data = json.dumps(value)
+
+        def add(conn):
+            now = time.time()
+            # Chỉ ghi đè khi giá trị cũ đã hết hạn
+            return conn.execute(
+                "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE shared_state.expires_at <= ?",
+                (key, data, now + ttl, now),
+            ).rowcount == 1
+
+        return await self._write(add)
+
+    async def delete(self, keys):
+        rows = [(key,) for key in keys]
+        if rows:
+            await self._write(lambda conn: conn.executemany("DELETE FROM shared_state WHERE key = ?", rows))
+
+    async def take_token(self, name: str, rate: float, capacity: float, cost: float = 1) -> float:
+        def take(conn):
+            # BEGIN IMMEDIATE giữ khoá ghi nên các process lấy token lần lượt
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM shared_buckets WHERE name = ?", (name,)
+                ).fetchone()
+                tokens, updated_at = (row[0], row[1]) if row else (capacity, now)
+                tokens, wait = _refill(tokens, updated_at, now, rate, capacity, cost)
+                conn.execute(
+                    "INSERT OR REPLACE INTO shared_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (name, tokens, now),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return wait
+
+        return await self.store.run(take)
+
+
+def create_state_backend(kind: str, store):
+    """
+    kind: "memory" hoặc "sqlite"
+    """
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SQLiteStateBackend(store)
+    raise ValueError(f"STATE_BACKEND không hợp lệ: {kind}")
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("bot.store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    interaction_id INTEGER,
+    user_id INTEGER NOT NULL,
+    user_name TEXT,
+    sender_id INTEGER,
+    account TEXT NOT NULL,
+    delivered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_user ON deliveries (user_id, delivered_at);
+CREATE INDEX IF NOT EXISTS idx_deliveries_account ON deliveries (account);
+
+CREATE TABLE IF NOT EXISTS addtime_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    interaction_id INTEGER,
+    admin_id INTEGER,
+    account TEXT NOT NULL,
+    hours INTEGER NOT NULL,
+    success INTEGER NOT NULL,
+    message TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_addtime_account ON addtime_history (account, created_at);
+
+CREATE TABLE IF NOT EXISTS key_status (
+    key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    days INTEGER,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_key_status_checked ON key_status (checked_at);
+
+CREATE TABLE IF NOT EXISTS bot_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class BotStore:
+    """
+    Lưu trữ SQLite (WAL) cho lịch sử giao key, thêm giờ và trạng thái key.
+    - Mọi thao tác chạy trên một thread riêng, không chặn event loop
+    - Ghi được gom lại và commit theo lô mỗi flush_interval giây
+    - Lô ghi lỗi được đưa lại đầu hàng đợi và thử lại (chờ lâu dần); sau
+      max_attempts lần thì ghi từng lệnh, chỉ bỏ lệnh lỗi không phải tạm thời.
+      Hàng đợi giữ tối đa max_pending lệnh, quá thì bỏ lệnh cũ nhất.
+    """
+
+    def __init__(
+        self,
+        path: str = "bot.db",
+        *,
+        flush_interval: float = 1.0,
+        max_batch: int = 500,
+        max_pending: int = 50000,
+        max_attempts: int = 5,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._failures = 0
+        self.dropped = 0
+        self._conn = None
+        self._executor = None
+        self._pending = []
+        self._wakeup = None
+        self._flusher = None
+        self._schemas = [SCHEMA]
+        self._columns = []
+
+    def add_schema(self, script: str):
+        """
+        Đăng ký thêm bảng (gọi trước open())
+        """
+        self._schemas.append(script)
+
+    def add_column(self, table: str, column: str, definition: str):
+        """
+        Thêm cột vào bảng đã có trong database cũ (gọi trước open()).
+        SQLite không có ADD COLUMN IF NOT EXISTS nên kiểm tra bằng PRAGMA table_info.
+        """
+        self._columns.append((table, column, definition))
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._wakeup = asyncio.Event()
+        await self.run(self._connect)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def _connect(self, _):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for script in self._schemas:
+            self._conn.executescript(script)
+        for table, column, definition in self._columns:
+            existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                log.info("Đã thêm cột %s.%s", table, column)
+        self._conn.commit()
+
+    async def close(self):
+        """
+        Ghi nốt dữ liệu còn chờ rồi đóng kết nối
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._executor is None:
+            return
+        await self.flush()
+        await self.run(lambda conn: conn.close())
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._conn = None
+
+    async def run(self, func):
+        """
+        Chạy func(conn) trên thread SQLite
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._conn))
+
+    def enqueue(self, sql: str, params=()):
+        """
+        Thêm một lệnh ghi vào hàng đợi, không chờ (ghi theo lô ở nền)
+        """
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.max_batch and self._wakeup is not None:
+            self._wakeup.set()
+
+    def enqueue_many(self, sql: str, rows):
+        for params in rows:
+            self.enqueue(sql, params)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+
+        def write(conn):
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+
+        def write_each(conn):
+            # Lỗi tạm thời (database bị khoá, I/O) thì giữ lại, lệnh lỗi khác thì bỏ
+            retry, dropped = [], []
+            for statement in batch:
+                try:
+                    with conn:
+                        conn.execute(*statement)
+                except sqlite3.OperationalError:
+                    retry.append(statement)
+                except sqlite3.Error as e:
+                    dropped.append((statement[0], e))
+            return retry, dropped
+
+        try:
+            if self._failures < self.max_attempts:
+                await self.run(write)
+                self._failures = 0
+                return
+            batch, dropped = await self.run(write_each)
+        except sqlite3.Error:
+            self._failures += 1
+            self._requeue(batch)
+            raise
+        for sql, e in dropped:
+            log.error("Bỏ lệnh ghi lỗi: %s", e, extra={"sql": sql})
+        self.dropped += len(dropped)
+        if batch:
+            self._requeue(batch)
+            raise sqlite3.OperationalError(f"{len(batch)} lệnh ghi chưa thành công, thử lại sau")
+        self._failures = 0
+
+    def _requeue(self, batch):
+        """
+        Đưa lô ghi lỗi lại đầu hàng đợi, giữ tối đa max_pending lệnh mới nhất
+        """
+        self._pending = batch + self._pending
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+            log.error("Hàng đợi ghi database đầy, bỏ %d lệnh cũ nhất", overflow)
+
+    async def _flush_loop(self):
+        while True:
+            if self._failures:
+                # Đang lỗi thì chờ lâu dần trước khi thử lại (tối đa 30 giây)
+                await asyncio.sleep(min(self.flush_interval * 2 ** self._failures, 30))
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                log.error("Error writing to database: %s", e)
+
+    async def fetchall(self, sql: str, params=()):
+        """
+        Đọc dữ liệu (ghi nốt hàng đợi trước để luôn đọc được dữ liệu mới nhất)
+        """
+        await self.flush()
+        return await self.run(lambda conn: [dict(row) for row in conn.execute(sql, params).fetchall()])
+
+    async def fetchone(self, sql: str, params=()):
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    # Các thao tác ghi
+
+    def record_delivery(self, interaction_id, user_id, user_name, sender_id, accounts):
+        now = time.time()
+        for account in accounts:
+            self.enqueue(
+                "INSERT INTO deliveries (interaction_id, user_id, user_name, sender_id, account, delivered_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (interaction_id, user_id, user_name, sender_id, account, now),
+            )
+
+    def record_addtime(self, interaction_id, admin_id, account, hours, success, message):
+        self.enqueue(
+            "INSERT INTO addtime_history (interaction_id, admin_id, account, hours, success, message, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (interaction_id, admin_id, account, hours, int(success), message, time.time()),
+        )
+
+    def record_key_status(self, result):
+        key, status = result[0], result[1]
+        days = result[2] if len(result) > 2 else None
+        self.enqueue(
+            "INSERT INTO key_status (key, status, days, checked_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET status = excluded.status, days = excluded.days, "
+            "checked_at = excluded.checked_at",
+            (key, status, days, time.time()),
+        )
+
+    async def set_meta(self, key: str, value: str):
+        """
+        Lưu một giá trị cấu hình nội bộ (vd. hash của lệnh đã sync)
+        """
+        def write(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO bot_meta (key, value, updated_at) VALUES (?, ?, ?)",
+                    (key, value, time.time()),
+                )
+
+        await self.run(write)
+
+    # Các truy vấn
+
+    async def get_meta(self, key: str):
+        row = await self.fetchone("SELECT value FROM bot_meta WHERE key = ?", (key,))
+        return row["value"] if row else None
+
+    async def get_user_deliveries(self, user_id: int, limit: int = 100):
+        return await self.fetchall(
+            "SELECT account, sender_id, delivered_at FROM deliveries "
+            "WHERE user_id = ? ORDER BY delivered_at DESC LIMIT ?",
+            (user_id, limit),
+        )
+
+    async def get_addtime_history(self, account: str, limit: int = 20):
+        return await self.fetchall(
+            "SELECT admin_id, hours, success, message, created_at FROM addtime_history "
+            "WHERE account = ? ORDER BY created_at DESC LIMIT ?",
+            (account, limit),
+        )
+
+    async def get_key_statuses(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = await self.fetchall(
+            f"SELECT key, status, days, checked_at FROM key_status WHERE key IN ({placeholders})",
+            keys,
+        )
+        return {row["key"]: row for row in rows}
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+
+from batch import BatchExecutor, TokenBucket
+from bot_logging import correlation_id
+
+SWEEPER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweep_schedule (
+    key TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    next_check_at REAL NOT NULL,
+    last_status TEXT,
+    last_days INTEGER,
+    reminded_threshold INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_sweep_due ON sweep_schedule (next_check_at);
+"""
+
+log = logging.getLogger("bot.sweeper")
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def next_check_delay(status: str, days) -> float:
+    """
+    Key càng gần hết hạn thì kiểm tra càng thường xuyên
+    """
+    if status == "active" and days is not None:
+        if days <= 1:
+            return 2 * HOUR
+        if days <= 3:
+            return 6 * HOUR
+        if days <= 7:
+            return 12 * HOUR
+        # Còn nhiều ngày: kiểm tra lại khi còn khoảng 7 ngày, tối đa 7 ngày một lần
+        return min(7 * DAY, max(DAY, (days - 7) * DAY))
+    if status == "error":
+        return HOUR
+    # Hết hạn / chưa kích hoạt: thỉnh thoảng kiểm tra xem có được gia hạn không
+    return 3 * DAY
+
+
+class ExpirySweeper:
+    """
+    Task nền kiểm tra lại các key đã giao theo lô nhỏ và nhắc khách sắp hết hạn.
+    - check(key) -> kết quả như KeyAPIClient.check_key
+    - notify(user_id, [(key, days), ...]) gửi DM nhắc gia hạn, trả về False nếu
+      không gửi (mốc nhắc chỉ được lưu khi đã gửi, lần kiểm tra sau nhắc lại)
+    Có token bucket và số request đồng thời riêng, thấp hơn nhiều so với lệnh
+    tương tác, nên không chiếm hết quota upstream.
+    """
+
+    def __init__(
+        self,
+        store,
+        check,
+        notify,
+        *,
+        interval: float = 60,
+        batch_size: int = 200,
+        concurrency: int = 3,
+        rate: float = 2,
+        remind_days=(3, 1),
+    ):
+        self.store = store
+        self.check = check
+        self.notify = notify
+        self.interval = interval
+        self.batch_size = batch_size
+        self.executor = BatchExecutor(concurrency)
+        self.bucket = TokenBucket(rate, max(rate, 1))
+        self.remind_days = sorted(remind_days, reverse=True)
+        store.add_schema(SWEEPER_SCHEMA)
+        self._last_delivery_id = 0
+        self.checked = 0
+        self.reminders = 0
+
+    async def sync(self):
+        """
+        Thêm các key mới được giao vào lịch kiểm tra
+        """
+        last_id = self._last_delivery_id
+
+        def sync(conn):
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO sweep_schedule (key, user_id, next_check_at) "
+                    "SELECT account, user_id, 0 FROM deliveries WHERE id > ?",
+                    (last_id,),
+                )
+                row = conn.execute("SELECT MAX(id) FROM deliveries").fetchone()
+                return row[0] or 0
+
+        await self.store.flush()
+        self._last_delivery_id = await self.store.run(sync)
+
+    def reschedule(self, keys):
+        """
+        Kiểm tra lại sớm các key vừa thay đổi thời hạn (vd. sau /addtime)
+        """
+        self.store.enqueue_many(
+            "UPDATE sweep_schedule SET next_check_at = 0 WHERE key = ?",
+            [(key,) for key in keys],
+        )
+
+    def _threshold(self, days):
+        """
+        Mốc nhắc nhỏ nhất mà days đã chạm tới (vd. còn 2 ngày -> mốc 3)
+        """
+        reached = None
+        for threshold in self.remind_days:
+            if days <= threshold:
+                reached = threshold
+        return reached
+
+    async def _check_one(self, row):
+        await self.bucket.acquire()
+        result = await self.check(row["key"])
+        return row, result
+
+    async def sweep_once(self) -> int:
+        """
+        Kiểm tra một lô key đến hạn, trả về số key đã kiểm tra
+        """
+        await self.sync()
+        now = time.time()
+        due = await self.store.fetchall(
+            "SELECT key, user_id, reminded_threshold FROM sweep_schedule "
+            "WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?",
+            (now, self.batch_size),
+        )
+        if not due:
+            return 0
+
+        reminders = {}
+        updates = []
+        for item in await self.executor.map(self._check_one, due):
+            if isinstance(item, Exception):
+                continue
+            row, result = item
+            status = result[1]
+            days = result[2] if status == "active" else None
+            reminded = row["reminded_threshold"]
+
+            if status == "active":
+                threshold = self._threshold(days)
+                if threshold is None:
+                    # Đã được gia hạn: cho phép nhắc lại ở lần hết hạn sau
+                    reminded = None
+                elif reminded is None or threshold < reminded:
+                    reminders.setdefault(row["user_id"], []).append((row["key"], days, threshold))
+
+            updates.append((
+                time.time() + next_check_delay(status, days), status, days, reminded, row["key"]
+            ))
+
+        self.store.enqueue_many(
+            "UPDATE sweep_schedule SET next_check_at = ?, last_status = ?, last_days = ?, "
+            "reminded_threshold = ? WHERE key = ?",
+            updates,
+        )
+        self.checked += len(updates)
+
+        sent = 0
+        for user_id, keys in reminders.items():
+            try:
+                if not await self.notify(user_id, [(key, days) for key, days, _ in keys]):
+                    continue
+            except Exception as e:
+                log.warning("Error sending expiry reminder: %s", e, extra={"user_id": user_id})
+                continue
+            sent += 1
+            self.store.enqueue_many(
+                "UPDATE sweep_schedule SET reminded_threshold = ? WHERE key = ?",
+                [(threshold, key) for key, _, threshold in keys],
+            )
+        self.reminders += sent
+        log.info("Đã kiểm tra lô key đến hạn", extra={"checked": len(updates), "reminders": sent})
+        return len(updates)
+
+    async def run(self):
+        sweep = 0
+        while True:
+            sweep += 1
+            correlation_id.set(f"sweep-{sweep}")
+            try:
+                checked = await self.sweep_once()
+            except Exception:
+                log.exception("Error in expiry sweeper")
+                checked = 0
+            # Còn nhiều key đến hạn thì chạy lô tiếp theo ngay
+            if checked < self.batch_size:
+                await asyncio.sleep(self.interval)
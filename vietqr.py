@@ -0,0 +1,154 @@
+import asyncio
+import struct
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import qrcode
+
+# Mã định danh NAPAS (VietQR) và mã dịch vụ chuyển khoản tới số tài khoản
+VIETQR_GUID = "A000000727"
+SERVICE_ACCOUNT_TRANSFER = "QRIBFTTA"
+CURRENCY_VND = "704"
+COUNTRY_VN = "VN"
+
+
+def _tlv(tag: str, value: str) -> str:
+    """
+    Mã hoá một trường EMVCo: ID (2 ký tự) + độ dài (2 chữ số) + giá trị
+    """
+    if len(value) > 99:
+        raise ValueError(f"Trường {tag} dài quá 99 ký tự")
+    return f"{tag}{len(value):02d}{value}"
+
+
+def crc16_ccitt(data: bytes) -> int:
+    """
+    CRC16/CCITT-FALSE (poly 0x1021, init 0xFFFF) theo chuẩn EMVCo
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def to_ascii(text: str) -> str:
+    """
+    Bỏ dấu tiếng Việt vì app ngân hàng chỉ nhận nội dung không dấu
+    """
+    text = text.replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c) and c.isascii())
+
+
+def build_vietqr_payload(bank_bin: str, account_no: str, amount: int = None, message: str = "") -> str:
+    """
+    Tạo chuỗi VietQR (EMVCo) cho chuyển khoản tới số tài khoản
+    """
+    beneficiary = _tlv("00", bank_bin) + _tlv("01", account_no)
+    merchant_info = (
+        _tlv("00", VIETQR_GUID)
+        + _tlv("01", beneficiary)
+        + _tlv("02", SERVICE_ACCOUNT_TRANSFER)
+    )
+    payload = _tlv("00", "01")
+    # 12 = mã QR động (có số tiền), 11 = mã QR tĩnh
+    payload += _tlv("01", "12" if amount else "11")
+    payload += _tlv("38", merchant_info)
+    payload += _tlv("53", CURRENCY_VND)
+    if amount:
+        payload += _tlv("54", str(int(amount)))
+    payload += _tlv("58", COUNTRY_VN)
+    message = to_ascii(message)
+    if message:
+        payload += _tlv("62", _tlv("08", message))
+    payload += "6304"
+    return payload + f"{crc16_ccitt(payload.encode('ascii')):04X}"
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+def render_qr_png(data: str, *, box_size: int = 8, border: int = 4) -> bytes:
+    """
+    Vẽ mã QR thành ảnh PNG đen trắng 1-bit (không cần Pillow)
+    """
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()  # Đã bao gồm viền
+
+    size = len(matrix) * box_size
+    raw = bytearray()
+    for row in matrix:
+        # Bit 1 = trắng, 0 = đen
+        bits = 0
+        nbits = 0
+        line = bytearray([0])  # Filter type 0
+        for dark in row:
+            for _ in range(box_size):
+                bits = (bits << 1) | (0 if dark else 1)
+                nbits += 1
+                if nbits == 8:
+                    line.append(bits)
+                    bits = nbits = 0
+        if nbits:
+            line.append(bits << (8 - nbits))
+        raw += bytes(line) * box_size
+
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 9))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+class VietQRRenderer:
+    """
+    Tạo ảnh VietQR trên thread pool (không chặn event loop),
+    cache LRU ảnh PNG theo (số tiền, nội dung chuyển khoản).
+    """
+
+    def __init__(self, bank_bin: str, account_no: str, *, cache_size: int = 256, box_size: int = 8):
+        self.bank_bin = bank_bin
+        self.account_no = account_no
+        self.cache_size = cache_size
+        self.box_size = box_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _render(self, amount: int, message: str) -> bytes:
+        payload = build_vietqr_payload(self.bank_bin, self.account_no, amount, message)
+        return render_qr_png(payload, box_size=self.box_size)
+
+    async def render(self, amount: int, message: str = "") -> bytes:
+        """
+        Trả về ảnh PNG của mã QR thanh toán
+        """
+        cache_key = (int(amount), message)
+        png = self._cache.get(cache_key)
+        if png is not None:
+            self.hits += 1
+            self._cache.move_to_end(cache_key)
+            return png
+
+        self.misses += 1
+        png = await asyncio.to_thread(self._render, int(amount), message)
+        self._cache[cache_key] = png
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return png